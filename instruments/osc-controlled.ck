@@ -0,0 +1,103 @@
+//---------------------------------------------------------------------
+// name: osc-controlled.ck
+// desc: simple synth voice driven by the PyDAW OSC control bridge
+//       parameters and notes can be changed while the script runs
+//
+// usage: chuck osc-controlled.ck:<port>:<reply port>
+//        (PyDAW passes the ports automatically)
+//
+// messages:
+//   /pydaw/param/gain f      output gain (0-1)
+//   /pydaw/param/filter f    low pass cutoff in Hz
+//   /pydaw/param/tempo f     tempo in BPM
+//   /pydaw/param/beat f      transport position in beats
+//   /pydaw/note i i f        pitch, velocity, duration in seconds
+//                            (0 holds the note until note_off)
+//   /pydaw/note_off i        pitch
+//
+// reports (to the reply port, every 50 ms):
+//   /pydaw/position i f      own port, current beat
+//---------------------------------------------------------------------
+
+OscIn oin;
+OscMsg msg;
+6449 => oin.port;
+if( me.args() ) Std.atoi( me.arg(0) ) => oin.port;
+
+oin.addAddress( "/pydaw/param/gain, f" );
+oin.addAddress( "/pydaw/param/filter, f" );
+oin.addAddress( "/pydaw/param/tempo, f" );
+oin.addAddress( "/pydaw/param/beat, f" );
+oin.addAddress( "/pydaw/note, i i f" );
+oin.addAddress( "/pydaw/note_off, i" );
+
+// patch
+SawOsc osc => LPF lpf => ADSR env => Gain master => dac;
+env.set( 5::ms, 80::ms, 0.6, 200::ms );
+2000 => lpf.freq;
+0.5 => master.gain;
+120.0 => float tempo;
+0.0 => float beat;
+-1 => int heldPitch;
+now => time beatTime;
+
+// the beat keeps moving at the current tempo between updates from PyDAW
+fun float currentBeat()
+{
+    return beat + ( now - beatTime ) / second * tempo / 60.0;
+}
+
+fun void report( int replyPort )
+{
+    OscOut xmit;
+    xmit.dest( "127.0.0.1", replyPort );
+    while( true )
+    {
+        50::ms => now;
+        xmit.start( "/pydaw/position" );
+        oin.port() => xmit.add;
+        currentBeat() => xmit.add;
+        xmit.send();
+    }
+}
+
+if( me.args() > 1 ) spork ~ report( Std.atoi( me.arg(1) ) );
+
+fun void release( float seconds, int pitch )
+{
+    seconds::second => now;
+    if( heldPitch == pitch ) env.keyOff();
+}
+
+while( true )
+{
+    oin => now;
+    while( oin.recv( msg ) )
+    {
+        if( msg.address == "/pydaw/param/gain" ) msg.getFloat(0) => master.gain;
+        else if( msg.address == "/pydaw/param/filter" ) msg.getFloat(0) => lpf.freq;
+        else if( msg.address == "/pydaw/param/tempo" )
+        {
+            currentBeat() => beat;
+            now => beatTime;
+            msg.getFloat(0) => tempo;
+        }
+        else if( msg.address == "/pydaw/param/beat" )
+        {
+            msg.getFloat(0) => beat;
+            now => beatTime;
+        }
+        else if( msg.address == "/pydaw/note" )
+        {
+            msg.getInt(0) => heldPitch;
+            Std.mtof( heldPitch ) => osc.freq;
+            msg.getInt(1) / 127.0 => osc.gain;
+            env.keyOn();
+            if( msg.getFloat(2) > 0 ) spork ~ release( msg.getFloat(2), heldPitch );
+        }
+        else if( msg.address == "/pydaw/note_off" )
+        {
+            if( msg.getInt(0) == heldPitch ) env.keyOff();
+        }
+    }
+}
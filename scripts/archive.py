@@ -0,0 +1,513 @@
+import io
+import os
+import sys
+import json
+import zlib
+import queue
+import base64
+import shutil
+import hashlib
+import tarfile
+import argparse
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logger import logger
+from asset_store import default_store, _blob_references
+import riff
+
+ARCHIVE_EXTENSION = ".pydaw.tar"
+MANIFEST_NAME = "manifest.json"
+BLOBS_PREFIX = ".pydaw-blobs/"  # History blobs the manifest references, restored into the asset store on import
+
+CODEC_STORE = "store"
+CODEC_ZLIB = "zlib"
+CODEC_FLAC = "flac"
+
+# Already compressed, another general codec pass would only cost time
+STORE_EXTENSIONS = (".mp3", ".ogg", ".flac", ".png", ".jpg", ".zip", ".gz")
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg", ".aiff", ".flac")
+# Raw PCM sample format per bits per sample, as understood by ffmpeg
+PCM_FORMATS = {8: "u8", 16: "s16le", 24: "s24le"}
+
+PAX_PREFIX = "PYDAW."
+CHUNK_SIZE = 1024 * 1024  # Files are read, hashed and compressed this many bytes at a time
+QUEUE_CHUNKS = 4  # Chunks buffered per entry between the tar stream and the thread running its codec
+# Filler reserved in every header, so it can be rewritten in place once the payload size and hash are known
+HEADER_PAD = 64
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Stream:
+    """Bounded queue of chunks handed from one thread to another, closed with None.
+
+    Both ends give up with _Cancelled once cancelled is set, so a failure on
+    one side never leaves the other blocked.
+    """
+
+    def __init__(self, cancelled):
+        self._queue = queue.Queue(QUEUE_CHUNKS)
+        self._cancelled = cancelled
+        self._closed = False  # Whether the reading side got the closing None
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self._cancelled.is_set():
+                    raise _Cancelled()
+
+    def close(self):
+        self.put(None)
+
+    def __iter__(self):
+        while not self._closed:
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._cancelled.is_set():
+                    raise _Cancelled()
+                continue
+            if item is None:
+                self._closed = True
+                return
+            yield item
+
+
+def _read_chunks(f, size=None):
+    """Yield f's content CHUNK_SIZE bytes at a time, at most size bytes when given."""
+    while size is None or size > 0:
+        chunk = f.read(CHUNK_SIZE if size is None else min(CHUNK_SIZE, size))
+        if not chunk:
+            return
+        if size is not None:
+            size -= len(chunk)
+        yield chunk
+
+
+def _ffmpeg(args, feed, emit):
+    """Run ffmpeg, feed(stdin) writes its input on a helper thread while emit(chunk) receives its output."""
+    process = subprocess.Popen(["ffmpeg", "-v", "error", *args], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+    errors = []
+
+    def run_feed():
+        try:
+            feed(process.stdin)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=run_feed, daemon=True)
+    feeder.start()
+    try:
+        for chunk in _read_chunks(process.stdout):
+            emit(chunk)
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        feeder.join()
+        process.wait()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, "ffmpeg")
+    if errors:
+        raise errors[0]
+
+
+def _wav_layout(f, size):
+    """The PCM format and data chunk span of an open WAV file, or None if FLAC can't hold it losslessly."""
+    try:
+        fmt = riff.read_format(f.name)
+    except (OSError, ValueError):
+        return None
+    pcm_format = PCM_FORMATS.get(fmt["bits_per_sample"])
+    if fmt["format_tag"] not in (riff.WAVE_FORMAT_PCM, riff.WAVE_FORMAT_EXTENSIBLE) or pcm_format is None:
+        return None
+    start, end = fmt["data_offset"], fmt["data_offset"] + fmt["data_size"]
+    if end > size or fmt["data_size"] % fmt["block_align"]:
+        return None
+    return fmt, pcm_format, start, end
+
+
+def _pax(headers):
+    return {PAX_PREFIX + key: value for key, value in headers.items()}
+
+
+def encode_entry(path, name, emit):
+    """Hash and compress one file in chunks, passing everything to emit. Runs on a worker thread.
+
+    emit first gets the entry's pax headers, with the hash not known yet,
+    then the payload chunks. Returns the final headers. The PCM data of WAV
+    files is streamed through ffmpeg's FLAC encoder; everything around it is
+    kept verbatim in the headers, so the file can be rebuilt byte for byte.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        headers = {"sha256": "0" * 64, "size": str(size)}
+        layout = None
+        if name.lower().endswith(STORE_EXTENSIONS):
+            headers["codec"] = CODEC_STORE
+        elif name.lower().endswith(".wav") and shutil.which("ffmpeg"):
+            layout = _wav_layout(f, size)
+        if layout:
+            fmt, pcm_format, start, end = layout
+            head = f.read(start)
+            sha.update(head)
+            # The tail is read after the data, its placeholder only has to be as long
+            headers.update(codec=CODEC_FLAC, pcm=pcm_format, head=base64.b64encode(head).decode("ascii"),
+                           tail=base64.b64encode(bytes(size - end)).decode("ascii"))
+        elif "codec" not in headers:
+            headers["codec"] = CODEC_ZLIB
+        emit(_pax(headers))
+
+        if layout:
+            args = ["-f", pcm_format, "-ar", str(fmt["sample_rate"]), "-ac", str(fmt["channels"]), "-i", "pipe:0"]
+            if fmt["bits_per_sample"] == 24:
+                args += ["-sample_fmt", "s32"]
+            args += ["-c:a", "flac", "-compression_level", "8", "-f", "flac", "pipe:1"]
+
+            def feed(stdin):
+                for chunk in _read_chunks(f, end - start):
+                    sha.update(chunk)
+                    stdin.write(chunk)
+
+            _ffmpeg(args, feed, emit)
+            tail = f.read()
+            sha.update(tail)
+            headers["tail"] = base64.b64encode(tail).decode("ascii")
+        elif headers["codec"] == CODEC_ZLIB:
+            compressor = zlib.compressobj(6)
+            for chunk in _read_chunks(f):
+                sha.update(chunk)
+                data = compressor.compress(chunk)
+                if data:
+                    emit(data)
+            emit(compressor.flush())
+        else:
+            for chunk in _read_chunks(f):
+                sha.update(chunk)
+                emit(chunk)
+    headers["sha256"] = sha.hexdigest()
+    return _pax(headers)
+
+
+def decode_entry(name, headers, chunks, write):
+    """Decompress one entry's payload chunks into write(data) and verify its hash. Runs on a worker thread."""
+    codec = headers[PAX_PREFIX + "codec"]
+    sha = hashlib.sha256()
+
+    def output(data):
+        sha.update(data)
+        write(data)
+
+    if codec == CODEC_FLAC:
+        output(base64.b64decode(headers[PAX_PREFIX + "head"]))
+
+        def feed(stdin):
+            for chunk in chunks:
+                stdin.write(chunk)
+
+        _ffmpeg(["-f", "flac", "-i", "pipe:0", "-f", headers[PAX_PREFIX + "pcm"], "pipe:1"], feed, output)
+        output(base64.b64decode(headers[PAX_PREFIX + "tail"]))
+    elif codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj()
+        for chunk in chunks:
+            # Bounded output per call, a small chunk may inflate to a lot of data
+            while chunk:
+                output(decompressor.decompress(chunk, CHUNK_SIZE))
+                chunk = decompressor.unconsumed_tail
+        output(decompressor.flush())
+    else:
+        for chunk in chunks:
+            output(chunk)
+    if sha.hexdigest() != headers[PAX_PREFIX + "sha256"]:
+        raise ValueError(f"Integrity check failed for {name}")
+
+
+def _workspace_files(workspace_path):
+    """Relative paths of every file in a workspace, manifest first so imports can read it up front."""
+    names = []
+    for root, _, files in os.walk(workspace_path):
+        for filename in files:
+            names.append(os.path.relpath(os.path.join(root, filename), workspace_path).replace(os.sep, "/"))
+    names.sort(key=lambda name: (name != MANIFEST_NAME, name))
+    return names
+
+
+def _header(info, length=None):
+    """info's tar header, padded through a filler record to exactly length bytes so it can replace an earlier one.
+
+    Without length the header gets the most filler.
+    """
+    for pad in range(HEADER_PAD, -1, -1):
+        info.pax_headers[PAX_PREFIX + "pad"] = "0" * pad
+        header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        if length is None or len(header) == length:
+            return header
+    raise ValueError(f"The header of {info.name} outgrew its reserved space")
+
+
+def _write_entry(f, name, stream, future):
+    """Append one entry to an uncompressed tar file as its payload streams in.
+
+    The size and hash are only known once the payload is written, so the
+    header is written first with placeholders and rewritten afterwards.
+    """
+    chunks = iter(stream)
+    headers = next(chunks, None)
+    if headers is None:
+        future.result()  # The encoder failed before it got anywhere
+        raise ValueError(f"No data for {name}")
+    info = tarfile.TarInfo(name)
+    info.pax_headers = headers
+    start = f.tell()
+    header = _header(info)
+    f.write(header)
+    for chunk in chunks:
+        f.write(chunk)
+        info.size += len(chunk)
+    f.write(tarfile.NUL * (-info.size % tarfile.BLOCKSIZE))
+    info.pax_headers = future.result()
+    end = f.tell()
+    f.seek(start)
+    f.write(_header(info, len(header)))
+    f.seek(end)
+
+
+def _encode_into(path, name, stream):
+    try:
+        return encode_entry(path, name, stream.put)
+    finally:
+        stream.close()
+
+
+def _manifest_blobs(workspace_path, store):
+    """Digests of the history blobs a workspace's manifest references that the store has."""
+    try:
+        with open(os.path.join(workspace_path, MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return []
+    digests = set()
+    _blob_references(manifest, digests)
+    missing = {digest for digest in digests if not store.has_blob(digest)}
+    if missing:
+        logger.warning(f"{len(missing)} history blobs of {workspace_path} are missing from the asset store")
+    return sorted(digests - missing)
+
+
+def export_workspace(workspace_path, archive_path, workers=None, store=None):
+    """Stream a whole workspace into a single archive. Returns the number of entries written.
+
+    Up to workers files are hashed and compressed at once on worker threads
+    (zlib, hashlib and ffmpeg all run outside the GIL) and streamed into the
+    archive in order, so neither the workspace nor its compressed form is
+    ever staged. The history blobs the manifest references are packed from
+    the asset store. Blocks until done; the workspace window runs it on a
+    worker thread.
+    """
+    workers = workers or os.cpu_count() or 1
+    store = store or default_store()
+    entries = [(os.path.join(workspace_path, name), name) for name in _workspace_files(workspace_path)]
+    entries += [(store.blob_path(digest), BLOBS_PREFIX + digest) for digest in _manifest_blobs(workspace_path, store)]
+    tmp_path = archive_path + ".part"
+    cancelled = threading.Event()
+    try:
+        with open(tmp_path, "wb") as f, ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            remaining = iter(entries)
+            try:
+                while True:
+                    # Every entry in flight has a thread, so the one written next is always making progress
+                    for path, name in remaining:
+                        stream = _Stream(cancelled)
+                        pending.append((name, stream, executor.submit(_encode_into, path, name, stream)))
+                        if len(pending) >= workers:
+                            break
+                    if not pending:
+                        break
+                    _write_entry(f, *pending.popleft())
+            except BaseException:
+                cancelled.set()
+                raise
+            f.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+            f.write(tarfile.NUL * (-f.tell() % tarfile.RECORDSIZE))
+        os.replace(tmp_path, archive_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logger.info(f"Exported {len(entries)} entries from {workspace_path} to {archive_path}")
+    return len(entries)
+
+
+def _track_paths(tracks):
+    """Every string value of the given manifest tracks, the files they reference are among them."""
+    paths = set()
+
+    def collect(value):
+        if isinstance(value, str):
+            paths.add(value.replace(os.sep, "/"))
+        elif isinstance(value, dict):
+            for item in value.values():
+                collect(item)
+        elif isinstance(value, list):
+            for item in value:
+                collect(item)
+
+    collect(tracks)
+    return paths
+
+
+def _safe_path(dest, name):
+    path = os.path.normpath(os.path.join(dest, name))
+    root = os.path.abspath(dest)
+    if os.path.isabs(name) or os.path.commonpath([root, os.path.abspath(path)]) != root:
+        raise ValueError(f"Refusing to extract {name} outside of {dest}")
+    return path
+
+
+def _extract_file(name, headers, stream, path):
+    """Decode an entry into path through a temporary file, so a file hardlinked to a blob is never written."""
+    tmp_path = f"{path}.pydaw-tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            decode_entry(name, headers, stream, f.write)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _extract_blob(name, headers, stream, store):
+    data = io.BytesIO()
+    decode_entry(name, headers, stream, data.write)
+    store.put_bytes(name[len(BLOBS_PREFIX):], data.getvalue())
+
+
+def _drain(stream):
+    # Consumed even after a failure, so the reading side never waits on a full queue
+    try:
+        for _ in stream:
+            pass
+    except _Cancelled:
+        pass
+
+
+def _extract_into(extract, name, headers, stream, target):
+    try:
+        extract(name, headers, stream, target)
+    except BaseException:
+        _drain(stream)
+        raise
+
+
+def import_workspace(archive_path, dest, tracks=None, workers=None, store=None):
+    """Extract an archive into dest. Returns the list of extracted names.
+
+    With tracks (a list of track names) only those tracks are kept in the
+    manifest and, of the audio files and history blobs, only those the kept
+    tracks reference. Every other file is always extracted. Entries are
+    skipped before any of their data is read; the rest stream from the
+    archive to up to workers decoder threads that write them straight to
+    their destination. History blobs are restored into the asset store.
+    """
+    workers = workers or os.cpu_count() or 1
+    store = store or default_store()
+    os.makedirs(dest, exist_ok=True)
+    wanted_paths = None
+    wanted_blobs = None
+    extracted = []
+    cancelled = threading.Event()
+
+    def wanted(name):
+        if name.startswith(BLOBS_PREFIX):
+            digest = name[len(BLOBS_PREFIX):]
+            return not store.has_blob(digest) and (wanted_blobs is None or digest in wanted_blobs)
+        if tracks is not None and name.lower().endswith(AUDIO_EXTENSIONS):
+            return wanted_paths is not None and any(path == name or path.endswith("/" + name)
+                                                    for path in wanted_paths)
+        return True
+
+    with open(archive_path, "rb") as f, tarfile.open(fileobj=f, mode="r|") as tar, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for member in tar:
+                if not member.isfile() or not wanted(member.name):
+                    continue
+                if member.name == MANIFEST_NAME:
+                    # Decoded right away: the track selection depends on it
+                    data = io.BytesIO()
+                    decode_entry(member.name, member.pax_headers, _read_chunks(tar.extractfile(member)), data.write)
+                    manifest = json.loads(data.getvalue())
+                    if tracks is not None:
+                        manifest["tracks"] = [track for track in manifest.get("tracks", [])
+                                              if track.get("name") in tracks]
+                        wanted_paths = _track_paths(manifest["tracks"])
+                        wanted_blobs = set()
+                        _blob_references(manifest, wanted_blobs)
+                        data = io.BytesIO(json.dumps(manifest, indent=4).encode("utf-8"))
+                    with open(_safe_path(dest, MANIFEST_NAME), "wb") as out:
+                        out.write(data.getvalue())
+                    extracted.append(member.name)
+                    continue
+
+                if member.name.startswith(BLOBS_PREFIX):
+                    extract, target = _extract_blob, store
+                else:
+                    extract, target = _extract_file, _safe_path(dest, member.name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                # Every entry in flight has a thread, so the one being fed is always making progress
+                while len(pending) >= workers:
+                    name, future = pending.popleft()
+                    future.result()
+                    extracted.append(name)
+                stream = _Stream(cancelled)
+                pending.append((member.name, executor.submit(_extract_into, extract, member.name,
+                                                             member.pax_headers, stream, target)))
+                for chunk in _read_chunks(tar.extractfile(member)):
+                    stream.put(chunk)
+                stream.close()
+            while pending:
+                name, future = pending.popleft()
+                future.result()
+                extracted.append(name)
+        except BaseException:
+            cancelled.set()
+            raise
+    logger.info(f"Imported {len(extracted)} entries from {archive_path} into {dest}")
+    return extracted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import PyDAW workspace archives.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Pack a workspace directory into an archive")
+    export_parser.add_argument("workspace")
+    export_parser.add_argument("archive")
+    import_parser = subparsers.add_parser("import", help="Extract an archive into a workspace directory")
+    import_parser.add_argument("archive")
+    import_parser.add_argument("dest")
+    import_parser.add_argument("--track", action="append", dest="tracks", help="Only import this track (repeatable)")
+    for sub in (export_parser, import_parser):
+        sub.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_workspace(args.workspace, args.archive, args.workers)
+    else:
+        import_workspace(args.archive, args.dest, args.tracks, args.workers)
+    sys.exit(0)
@@ -0,0 +1,396 @@
+import os
+import sys
+import json
+import stat
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from logger import logger
+from memory_accounting import deep_size, default_accountant, MB
+from config import STORE_DIR, WORKSPACE_ROOTS
+from history import BLOB_KEY
+
+ASSETS_FILE = "assets.json"  # Per workspace: relative asset path -> content digest
+MANIFEST_FILE = "manifest.json"  # Per workspace project state, may reference history blobs
+HASH_CACHE_FILE = "hashes.json"
+WORKSPACES_FILE = "workspaces.json"  # Workspaces that used the store, wherever they live
+CHUNK_SIZE = 1024 * 1024
+HASH_CACHE_BUDGET = 32 * MB
+FICLONE = 0x40049409  # Linux ioctl that makes dst share src's extents (reflink)
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_store():
+    """The process-wide store under ~/pydaw/store."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = AssetStore()
+            default_accountant().register("asset_store/hash_cache", _default_store.memory_footprint,
+                                          budget=HASH_CACHE_BUDGET)
+        return _default_store
+
+
+def _blob_references(value, digests):
+    """Collect the digests of {"$blob": digest} references in saved project state."""
+    if isinstance(value, dict):
+        if BLOB_KEY in value:
+            digests.add(value[BLOB_KEY])
+            return
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            _blob_references(item, digests)
+
+
+def _reflink(src, dst):
+    """Create dst as a copy-on-write clone of src. Returns False where unsupported."""
+    try:
+        if sys.platform.startswith("linux"):
+            import fcntl
+
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        if sys.platform == "darwin":
+            import ctypes
+
+            libc = ctypes.CDLL("libc.dylib", use_errno=True)
+            return libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0
+    except (OSError, AttributeError):
+        if os.path.exists(dst):
+            os.remove(dst)
+    return False
+
+
+def _hardlink(src, dst):
+    """Create dst as a hardlink of src. Returns False where unsupported, e.g. across filesystems."""
+    try:
+        os.link(src, dst)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class AssetStore:
+    """Content-addressed blob store shared by every workspace.
+
+    Blobs live under <root>/blobs/<first two hex digits>/<sha256>. Workspace
+    files are materialized from blobs as copy-on-write reflinks where the
+    filesystem supports them, so they can be edited without touching the blob.
+    Elsewhere they are hardlinks sharing the read-only blob's inode, which
+    detach() turns into a writable copy before a file is edited in place,
+    and plain copies only across filesystems. Each workspace records which
+    digest backs which file in its assets.json.
+    """
+
+    def __init__(self, root=STORE_DIR, workspaces_dirs=WORKSPACE_ROOTS):
+        self.root = root
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.workspaces_dirs = list(workspaces_dirs)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # "dev:inode" -> [mtime_ns, size, digest]; files sharing an inode are hashed once
+        self._hash_cache = self._load_json(os.path.join(root, HASH_CACHE_FILE), {})
+        self._hash_cache_dirty = False
+        # Workspaces opened from outside workspaces_dirs are remembered so GC still sees their assets
+        self._workspaces = self._load_json(os.path.join(root, WORKSPACES_FILE), [])
+
+    @staticmethod
+    def _load_json(path, default):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return default
+
+    @staticmethod
+    def _write_json(path, data):
+        # Write to a temporary file first so a crash never leaves a truncated file behind
+        directory = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def save_hash_cache(self):
+        with self._lock:
+            if self._hash_cache_dirty:
+                self._write_json(os.path.join(self.root, HASH_CACHE_FILE), self._hash_cache)
+                self._hash_cache_dirty = False
+
+    def memory_footprint(self):
+        """(bytes, entries) of the in-memory hash cache."""
+        with self._lock:
+            return deep_size(self._hash_cache), len(self._hash_cache)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    def has_blob(self, digest):
+        return os.path.exists(self.blob_path(digest))
+
+    def digest(self, path):
+        """SHA-256 of a file, cached by inode, mtime and size.
+
+        Use this as the cache key for decoded audio so identical files share one cache entry.
+        """
+        st = os.stat(path)
+        key = f"{st.st_dev}:{st.st_ino}"
+        with self._lock:
+            cached = self._hash_cache.get(key)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self._lock:
+            self._hash_cache[key] = [st.st_mtime_ns, st.st_size, digest]
+            self._hash_cache_dirty = True
+        return digest
+
+    def ingest(self, path):
+        """Store a file's content as a blob (if not already present) and return its digest."""
+        digest = self.digest(path)
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            return digest
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp_path = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if not _reflink(path, tmp_path):
+            shutil.copyfile(path, tmp_path)
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp_path, blob)
+
+        # Workspace files hardlinked to the blob share its inode, remember its digest too
+        st = os.stat(blob)
+        with self._lock:
+            self._hash_cache[f"{st.st_dev}:{st.st_ino}"] = [st.st_mtime_ns, st.st_size, digest]
+            self._hash_cache_dirty = True
+        return digest
+
+    def put_bytes(self, digest, data):
+        """Store an in-memory payload (e.g. a history blob) under its SHA-256 digest."""
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            return digest
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp_path = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp_path, blob)
+        return digest
+
+    def read_bytes(self, digest):
+        """The payload of a blob, or None if the store doesn't have it."""
+        try:
+            with open(self.blob_path(digest), "rb") as f:
+                return f.read()
+        except OSError as e:
+            logger.warning(f"Missing blob {digest}: {e}")
+            return None
+
+    def materialize(self, digest, dest):
+        """Make dest a reflink, a hardlink or, across filesystems, a copy of a blob. Returns the method used.
+
+        A hardlinked dest is the read-only blob itself: call detach(dest) before editing it in place.
+        """
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        tmp_path = f"{dest}.pydaw-tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        if _reflink(blob, tmp_path):
+            method = "reflink"
+        elif _hardlink(blob, tmp_path):
+            method = "hardlink"
+        else:
+            shutil.copyfile(blob, tmp_path)
+            method = "copy"
+        os.replace(tmp_path, dest)
+        return method
+
+    def detach(self, path):
+        """Give a file hardlinked to a blob its own writable copy, breaking the link. Returns whether it was linked.
+
+        Anything editing a workspace file in place must call this first, or it would change the blob
+        and every other workspace sharing it.
+        """
+        if os.stat(path).st_nlink < 2:
+            return False
+        tmp_path = f"{path}.pydaw-tmp"
+        shutil.copyfile(path, tmp_path)  # Takes the content, not the read-only mode
+        os.replace(tmp_path, path)
+        return True
+
+    def _can_reflink(self, path):
+        """Whether path can share extents with the store, i.e. both are on one filesystem with reflink support."""
+        probe = os.path.join(self.blobs_dir, f".probe-{os.getpid()}-{threading.get_ident()}")
+        if not _reflink(path, probe):
+            return False
+        os.remove(probe)
+        return True
+
+    def _link_into_store(self, path, digest):
+        """Store path's content as a blob by making the blob a hardlink of it. Returns False where impossible.
+
+        The file then shares the blob's inode and becomes read-only with it.
+        """
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp_path = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if not _hardlink(path, tmp_path):
+            return False
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp_path, blob)
+        return True
+
+    def register_workspace(self, workspace_path):
+        """Remember a workspace so garbage collection keeps the blobs it references."""
+        workspace_path = os.path.abspath(workspace_path)
+        with self._lock:
+            if workspace_path in self._workspaces:
+                return
+            self._workspaces.append(workspace_path)
+            self._write_json(os.path.join(self.root, WORKSPACES_FILE), self._workspaces)
+        if not os.path.exists(os.path.join(workspace_path, ASSETS_FILE)):
+            self.write_assets(workspace_path, {})
+
+    def workspace_paths(self):
+        """Every workspace under the workspace roots plus those registered from elsewhere."""
+        paths = []
+        for workspaces_dir in self.workspaces_dirs:
+            if os.path.isdir(workspaces_dir):
+                paths.extend(os.path.join(workspaces_dir, name) for name in os.listdir(workspaces_dir))
+        with self._lock:
+            paths.extend(path for path in self._workspaces if os.path.isdir(path))
+        return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+    def read_assets(self, workspace_path):
+        return self._load_json(os.path.join(workspace_path, ASSETS_FILE), {})
+
+    def write_assets(self, workspace_path, assets):
+        self._write_json(os.path.join(workspace_path, ASSETS_FILE), assets)
+
+    def add_to_workspace(self, workspace_path, src_path, relative_dest=None):
+        """Import a file into a workspace through the store. Returns the digest."""
+        self.register_workspace(workspace_path)
+        relative_dest = relative_dest or os.path.join("instruments", os.path.basename(src_path))
+        digest = self.ingest(src_path)
+        self.materialize(digest, os.path.join(workspace_path, relative_dest))
+        assets = self.read_assets(workspace_path)
+        assets[relative_dest] = digest
+        self.write_assets(workspace_path, assets)
+        self.save_hash_cache()
+        return digest
+
+    def dedupe_workspace(self, workspace_path, subdir="instruments"):
+        """Move every file under a workspace subdirectory into the store and link it back.
+
+        Returns the number of bytes no longer stored twice. Files share the
+        blob's extents through reflinks where the filesystem supports them,
+        otherwise its inode through hardlinks. Where neither works, e.g. with
+        the store on another filesystem, files are left alone: storing them
+        would only double their disk use.
+        """
+        self.register_workspace(workspace_path)
+        # Forget files that were deleted since the last pass
+        assets = {relative_path: digest for relative_path, digest in self.read_assets(workspace_path).items()
+                  if os.path.exists(os.path.join(workspace_path, relative_path))}
+        reflinks = None  # Probed on the first file that needs it
+        saved = 0
+        for root, _, files in os.walk(os.path.join(workspace_path, subdir)):
+            for filename in files:
+                path = os.path.join(root, filename)
+                relative_path = os.path.relpath(path, workspace_path)
+                try:
+                    st = os.stat(path)
+                    digest = self.digest(path)
+                    blob = self.blob_path(digest)
+                    if os.path.exists(blob) and os.path.samefile(blob, path):
+                        assets[relative_path] = digest
+                        continue
+                    if reflinks is None:
+                        reflinks = self._can_reflink(path)
+                    if assets.get(relative_path) == digest and reflinks:
+                        continue  # Reflinked by an earlier pass
+                    if not os.path.exists(blob):
+                        if reflinks:
+                            self.ingest(path)
+                        elif not self._link_into_store(path, digest):
+                            continue
+                    else:
+                        # Share the stored copy instead; a plain copy would only cost I/O
+                        tmp_path = f"{path}.pydaw-tmp"
+                        if not (_reflink(blob, tmp_path) or _hardlink(blob, tmp_path)):
+                            continue
+                        os.replace(tmp_path, path)
+                        saved += st.st_size
+                    assets[relative_path] = digest
+                except OSError as e:
+                    logger.warning(f"Could not dedupe {path}: {e}")
+        self.write_assets(workspace_path, assets)
+        self.save_hash_cache()
+        if saved:
+            logger.info(f"Deduplicated {saved} bytes in {workspace_path}")
+        return saved
+
+    def referenced_digests(self):
+        """Digests referenced by any workspace's assets.json or by blobs in its saved history state."""
+        digests = set()
+        for workspace_path in self.workspace_paths():
+            digests.update(self.read_assets(workspace_path).values())
+            _blob_references(self._load_json(os.path.join(workspace_path, MANIFEST_FILE), {}), digests)
+        return digests
+
+    def collect_garbage(self, dry_run=False):
+        """Delete blobs no workspace references. Returns (blobs removed, bytes freed).
+
+        Blobs still hardlinked into a workspace are kept even when unreferenced,
+        deleting them would not free any space.
+        """
+        referenced = self.referenced_digests()
+        removed, freed = 0, 0
+        for prefix in os.listdir(self.blobs_dir):
+            prefix_dir = os.path.join(self.blobs_dir, prefix)
+            for digest in os.listdir(prefix_dir):
+                blob = os.path.join(prefix_dir, digest)
+                if digest in referenced or digest.endswith(".tmp"):
+                    continue
+                st = os.stat(blob)
+                if st.st_nlink > 1:
+                    continue
+                removed += 1
+                freed += st.st_size
+                if not dry_run:
+                    os.chmod(blob, stat.S_IWUSR | stat.S_IRUSR)  # Windows refuses to delete read-only files
+                    os.remove(blob)
+        logger.info(f"Asset store GC: {'would remove' if dry_run else 'removed'} {removed} blobs, {freed} bytes")
+        return removed, freed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the shared PyDAW asset store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    gc_parser = subparsers.add_parser("gc", help="Delete blobs no workspace references")
+    gc_parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    dedupe_parser = subparsers.add_parser("dedupe", help="Move a workspace's instruments into the store")
+    dedupe_parser.add_argument("workspace")
+    args = parser.parse_args()
+
+    store = default_store()
+    if args.command == "gc":
+        removed, freed = store.collect_garbage(dry_run=args.dry_run)
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {removed} blobs, {freed / MB:.1f} MB")
+    else:
+        print(f"Deduplicated {store.dedupe_workspace(args.workspace) / MB:.1f} MB")
@@ -1,11 +1,25 @@
 import subprocess
 from PySide6.QtWidgets import QTextEdit
+from osc_bridge import OscControlBridge
+from supervisor import ProcessSupervisor, RESTART_ON_FAILURE, audio_affinity, priority_allowed
+from memory_accounting import deep_size, MB
+
+CHUCK_MEMORY_LIMIT = 2048 * MB  # Address space per script, stops a runaway script before it takes the machine
+CHUCK_CPU_QUOTA = 1.0  # CPUs per script
+CHUCK_NICE = -5  # Only applied where the user may raise priority, like the sampler output
 
 
 class ChucKManager:
-    def __init__(self, console: QTextEdit = None):
+    def __init__(self, console: QTextEdit = None, supervisor: ProcessSupervisor = None,
+                 control: OscControlBridge = None):
         self.console = console
-        self.processes = {}  # Dictionary to track processes by script path
+        # Several managers (one per workspace) can share a supervisor and control bridge,
+        # each one only tracks and stops the scripts it started
+        self.supervisor = supervisor or ProcessSupervisor()
+        self.processes = {}  # Supervisor handle -> script path, one entry per running instance
+        # Each script is started with an OSC port as its first argument (chuck script.ck:port:reply_port)
+        # so parameters can be changed while it runs, and may report its beat back to reply_port
+        self.control = control or OscControlBridge()
 
     def log_output(self, message):
         """Log a message to the console."""
@@ -14,37 +28,83 @@ class ChucKManager:
         print(message)  # Also print to the terminal for debugging
 
     def run_script(self, script_path):
-        """Run a ChucK script and keep track of the process."""
+        """Run a ChucK script and return the supervisor handle of its process."""
+        osc_port = None
         try:
             self.log_output(f"Starting ChucK script: {script_path}")
-            process = subprocess.Popen(
-                ["chuck", script_path],
+            osc_port = self.control.allocate_port()
+            handle = self.supervisor.spawn(
+                ["chuck", f"{script_path}:{osc_port}:{self.control.reply_port}"],
+                name="chuck",
+                restart=RESTART_ON_FAILURE,
+                nice=CHUCK_NICE if priority_allowed(CHUCK_NICE) else None,
+                affinity=audio_affinity(),
+                memory_limit=CHUCK_MEMORY_LIMIT,
+                cpu_quota=CHUCK_CPU_QUOTA,
+                on_exit=self._on_exit,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 text=True
             )
-            self.processes[script_path] = process
+            self.processes[handle] = script_path
+            self.control.register(handle, osc_port)
             self.log_output(f"ChucK script started: {script_path}")
+            return handle
         except Exception as e:
+            if osc_port is not None:
+                self.control.release_port(osc_port)
             self.log_output(f"Error running ChucK script: {e}")
+            return None
+
+    def _on_exit(self, child):
+        """Forget a script once the supervisor has given up on it. Called from the reaper thread."""
+        self.processes.pop(child.handle, None)
+        self.control.unregister(child.handle)
+
+    def handles_for(self, script_path):
+        """Handles of every running instance of a script."""
+        return [handle for handle, path in list(self.processes.items()) if path == script_path]
 
     def stop_script(self, script_path):
-        """Stop a specific ChucK script."""
-        process = self.processes.get(script_path)
-        if process and process.poll() is None:  # Check if the process is running
-            process.terminate()  # Terminate the process
-            process.wait()  # Wait for the process to terminate
+        """Stop every running instance of a specific ChucK script."""
+        handles = self.handles_for(script_path)
+        for handle in handles:
+            self.stop_handle(handle)
+        if handles:
             self.log_output(f"Stopped ChucK script: {script_path}")
-            del self.processes[script_path]  # Remove the process from the dictionary
         else:
             self.log_output(f"No running process found for script: {script_path}")
 
+    def stop_handle(self, handle, kill=False):
+        """Stop a single script instance."""
+        self.supervisor.stop(handle, kill=kill)
+        self.processes.pop(handle, None)
+        self.control.unregister(handle)
+
     def stop_all_scripts(self):
         """Forcefully stop all running ChucK scripts."""
-        for script_path, process in list(self.processes.items()):
-            if process.poll() is None:  # Check if the process is running
-                process.kill()  # Forcefully terminate the process
-                process.wait()  # Wait for the process to terminate
-                self.log_output(f"Forcefully stopped ChucK script: {script_path}")
+        for handle, script_path in list(self.processes.items()):
+            self.stop_handle(handle, kill=True)
+            self.log_output(f"Forcefully stopped ChucK script: {script_path}")
         self.processes.clear()  # Clear the dictionary
-        self.log_output("All ChucK scripts have been forcefully stopped.")
\ No newline at end of file
+        self.log_output("All ChucK scripts have been forcefully stopped.")
+
+    def set_param(self, script_path, name, value):
+        """Change a parameter of every running instance of a script without restarting it."""
+        for handle in self.handles_for(script_path):
+            self.control.set_param(handle, name, value)
+
+    def trigger_note(self, script_path, pitch, velocity=100, duration=0.0):
+        """Play a note on every running instance of a script."""
+        for handle in self.handles_for(script_path):
+            self.control.trigger_note(handle, pitch, velocity, duration)
+
+    def memory_footprint(self):
+        """(bytes, instances) of the running script table, measured on a copy as the reaper thread edits it."""
+        processes = dict(self.processes)
+        return deep_size(processes), len(processes)
+
+    def usage(self):
+        """Live resource usage of every running script."""
+        return [dict(stats, script=self.processes.get(stats["handle"])) for stats in self.supervisor.usage_all()
+                if stats["handle"] in self.processes]
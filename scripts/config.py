@@ -5,12 +5,19 @@ import json
 PYDAW_DIR = os.path.expanduser("~/pydaw")
 WORKSPACES_DIR = os.path.join(PYDAW_DIR, "workspaces")
 INSTRUMENTS_DIR = os.path.join(PYDAW_DIR, "instruments")
+STORE_DIR = os.path.join(PYDAW_DIR, "store")
+STRETCH_CACHE_DIR = os.path.join(PYDAW_DIR, "stretch_cache")
 SETTINGS_FILE = os.path.join(PYDAW_DIR, "pydawsettings.json")
+# wsui.py creates workspaces under $PYDAW_CUSTOM_PATH/workspaces when that is set
+CUSTOM_WORKSPACES_DIR = os.path.join(os.path.expanduser(os.getenv("PYDAW_CUSTOM_PATH", PYDAW_DIR)), "workspaces")
+WORKSPACE_ROOTS = list(dict.fromkeys([WORKSPACES_DIR, CUSTOM_WORKSPACES_DIR]))
 
 # Ensure necessary directories exist
 os.makedirs(PYDAW_DIR, exist_ok=True)
 os.makedirs(WORKSPACES_DIR, exist_ok=True)
 os.makedirs(INSTRUMENTS_DIR, exist_ok=True)
+os.makedirs(STORE_DIR, exist_ok=True)
+os.makedirs(STRETCH_CACHE_DIR, exist_ok=True)
 
 # Load or initialize settings
 if os.path.exists(SETTINGS_FILE):
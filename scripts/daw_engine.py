@@ -1,9 +1,10 @@
 import dawdreamer
 from logger import logger
+from transport import SAMPLE_RATE, BLOCK_SIZE
 
 try:
-    engine = dawdreamer.RenderEngine(44100, 512)
-    engine.set_bpm(120)
+    engine = dawdreamer.RenderEngine(SAMPLE_RATE, BLOCK_SIZE)
+    engine.set_bpm(120)  # Until a workspace transport takes over the tempo
 except Exception as e:
     logger.error(f"Error initializing DAW Dreamer: {e}")
 
@@ -11,5 +12,14 @@ def load_vst(vst_path):
     try:
         plugin = engine.make_plugin_processor("vst", vst_path)
         engine.load_graph({"nodes": [{"id": "vst", "processor": plugin}]})
+        return plugin
     except Exception as e:
         logger.error(f"Failed to load VST {vst_path}: {e}")
+
+
+def load_track(plugin, sequencer_track, tempo_map):
+    """Send a SequencerTrack's clips to a loaded plugin. Call again after edits, only changes are re-encoded."""
+    try:
+        return sequencer_track.sync(plugin, tempo_map)
+    except Exception as e:
+        logger.error(f"Failed to load MIDI into {plugin.get_name()}: {e}")
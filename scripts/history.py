@@ -0,0 +1,326 @@
+import sys
+import hashlib
+import weakref
+from collections.abc import Mapping
+
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024  # Bytes of history kept for undo
+BLOB_KEY = "$blob"  # Saved state refers to blob payloads as {"$blob": sha256, "size": bytes}
+
+
+class Blob:
+    """A heavy payload (audio edit, plugin state, ...) stored once and shared by reference."""
+    __slots__ = ("digest", "data", "__weakref__")
+
+    def __init__(self, digest, data):
+        self.digest = digest
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"Blob({self.digest[:12]}, {len(self.data)} bytes)"
+
+
+class BlobStore:
+    """Interns payloads by content hash so identical payloads exist once in memory.
+
+    Blobs are held weakly: once no snapshot in the history references a blob
+    any more it is freed with it. nbytes counts the payloads still alive.
+    """
+
+    def __init__(self):
+        self._blobs = weakref.WeakValueDictionary()
+        self.nbytes = 0
+
+    def put(self, data):
+        """Return (blob, is_new) for the given bytes-like payload."""
+        data = bytes(data)
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self._blobs.get(digest)
+        if blob is not None:
+            return blob, False
+        blob = Blob(digest, data)
+        self._blobs[digest] = blob
+        size = sys.getsizeof(data)
+        self.nbytes += size
+        weakref.finalize(blob, self._freed, size)
+        return blob, True
+
+    def _freed(self, size):
+        self.nbytes -= size
+
+    def __len__(self):
+        return len(self._blobs)
+
+
+class FrozenDict(Mapping):
+    """Immutable mapping. set/delete return a new mapping sharing all untouched values."""
+    __slots__ = ("_data",)
+
+    def __init__(self, data=()):
+        self._data = dict(data)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"FrozenDict({self._data!r})"
+
+    def set(self, key, value):
+        data = dict(self._data)
+        data[key] = value
+        return FrozenDict(data)
+
+    def delete(self, key):
+        data = dict(self._data)
+        del data[key]
+        return FrozenDict(data)
+
+
+def freeze(value, intern=None, load_blob=None):
+    """Convert JSON-like data into immutable FrozenDicts and tuples.
+
+    bytes payloads are turned into Blobs by intern(data) when it is given.
+    Blob references in saved state are loaded back with load_blob(digest),
+    references it can't resolve (it returns None) are kept as they are.
+    """
+    if isinstance(value, (FrozenDict, Blob)):
+        return value
+    if isinstance(value, Mapping):
+        if BLOB_KEY in value and load_blob is not None and intern is not None:
+            data = load_blob(value[BLOB_KEY])
+            if data is not None:
+                return intern(data)
+        return FrozenDict((key, freeze(item, intern, load_blob)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item, intern, load_blob) for item in value)
+    if isinstance(value, (bytes, bytearray, memoryview)) and intern is not None:
+        return intern(value)
+    return value
+
+
+def thaw(value, save_blob=None):
+    """Convert frozen state back into plain dicts and lists for saving as JSON.
+
+    Blobs are written as references, save_blob(digest, data) stores their
+    payloads (e.g. in the asset store) so freeze can load them back.
+    """
+    if isinstance(value, FrozenDict):
+        return {key: thaw(item, save_blob) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item, save_blob) for item in value]
+    if isinstance(value, Blob):
+        if save_blob is not None:
+            save_blob(value.digest, value.data)
+        return {BLOB_KEY: value.digest, "size": len(value)}
+    return value
+
+
+def get_in(state, path):
+    for key in path:
+        state = state[key]
+    return state
+
+
+def _replace(container, key, value):
+    if isinstance(container, tuple):
+        if key == len(container):
+            return container + (value,)
+        return container[:key] + (value,) + container[key + 1:]
+    return container.set(key, value)
+
+
+def _setter(value):
+    return lambda container, key: _replace(container, key, value)
+
+
+def _remove(container, key):
+    if isinstance(container, tuple):
+        return container[:key] + container[key + 1:]
+    return container.delete(key)
+
+
+def _size(value, seen):
+    """Approximate bytes owned by a freshly frozen value. Blobs are counted by the BlobStore instead."""
+    if id(value) in seen or isinstance(value, Blob):
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, FrozenDict):
+        size += sys.getsizeof(value._data) + sum(_size(item, seen) for item in value.values())
+    elif isinstance(value, tuple):
+        size += sum(_size(item, seen) for item in value)
+    return size
+
+
+class HistoryEntry:
+    """One step of the command log: references to the snapshots before and after it."""
+    __slots__ = ("label", "paths", "before", "after", "cost")
+
+    def __init__(self, label, paths, before, after, cost):
+        self.label = label
+        self.paths = paths
+        self.before = before
+        self.after = after
+        self.cost = cost
+
+
+class ProjectHistory:
+    """Undo/redo history over persistent project state snapshots.
+
+    Every edit produces a new snapshot that copies only the containers on the
+    path to the edited value and shares everything else with the previous
+    snapshot. The log stores references to snapshots, so undo and redo are a
+    pointer swap. The oldest steps are dropped once the estimated memory the
+    log owns exceeds memory_budget. A blob counts towards it as long as any
+    kept snapshot references it. Blob references in the initial state are
+    loaded with load_blob(digest).
+    """
+
+    def __init__(self, state=None, memory_budget=DEFAULT_MEMORY_BUDGET, on_change=None, load_blob=None):
+        self.blobs = BlobStore()
+        self.load_blob = load_blob
+        self.state = freeze(state or {}, self._intern, load_blob)
+        self.memory_budget = memory_budget
+        self.on_change = on_change
+        # The log is a list read from _start on, dropping the oldest step only moves _start
+        # so undo/redo index it in constant time
+        self._entries = []
+        self._start = 0
+        self._position = 0  # Number of entries currently applied
+        self._entries_size = 0  # Bytes of the containers the kept entries copied
+
+    @property
+    def memory_used(self):
+        return self._entries_size + self.blobs.nbytes
+
+    def reset(self, state):
+        """Replace the state and forget all history, e.g. after loading a project."""
+        self._entries = []
+        self.state = freeze(state, self._intern, self.load_blob)
+        self._start = 0
+        self._position = 0
+        self._entries_size = 0
+        self._changed()
+
+    def _entry(self, index):
+        return self._entries[self._start + index]
+
+    def _intern(self, data):
+        return self.blobs.put(data)[0]
+
+    def get(self, path, default=None):
+        try:
+            return get_in(self.state, path)
+        except (KeyError, IndexError, TypeError):
+            return default
+
+    def set(self, label, path, value):
+        """Set the value at path (a sequence of keys/indices) as one undoable step."""
+        self.update(label, {tuple(path): value})
+
+    def update(self, label, changes):
+        """Set several values, given as {path: value}, as one undoable step."""
+        edits = []
+        for path, value in changes.items():
+            frozen = freeze(value, self._intern)
+            edits.append((path, _setter(frozen), _size(frozen, set())))
+        self._commit(label, edits)
+
+    def delete(self, label, path):
+        """Remove the value at path as one undoable step."""
+        self._commit(label, [(path, _remove, 0)])
+
+    def append(self, label, path, value):
+        """Append value to the list at path as one undoable step."""
+        self.set(label, tuple(path) + (len(get_in(self.state, path)),), value)
+
+    @staticmethod
+    def _apply(state, path, operation):
+        """Return (new state, bytes copied) with operation(parent, key) applied at path."""
+        if not path:
+            raise ValueError("Cannot replace the whole project state as an edit")
+        parents = [state]
+        for key in path[:-1]:
+            parents.append(parents[-1][key])
+
+        # Copy only the containers along the path, everything else is shared
+        node = operation(parents[-1], path[-1])
+        cost = sys.getsizeof(node)
+        for parent, key in zip(reversed(parents[:-1]), reversed(path[:-1])):
+            node = _replace(parent, key, node)
+            cost += sys.getsizeof(node)
+        return node, cost
+
+    def _commit(self, label, edits):
+        """Apply [(path, operation, cost)] to the current state and log them as one step."""
+        state, total = self.state, 0
+        for path, operation, cost in edits:
+            state, copied = self._apply(state, tuple(path), operation)
+            total += cost + copied
+
+        # A new edit discards the redo branch
+        while len(self) > self._position:
+            self._entries_size -= self._entries.pop().cost
+        paths = tuple(tuple(path) for path, _, _ in edits)
+        self._entries.append(HistoryEntry(label, paths, self.state, state, total))
+        self._position += 1
+        self._entries_size += total
+        self.state = state
+        self._enforce_budget()
+        self._changed()
+
+    def _enforce_budget(self):
+        # Always keep the newest step so it can be undone. Dropping a step frees the blobs
+        # only its snapshots referenced, which memory_used sees through the blob store
+        while self.memory_used > self.memory_budget and self._position > 1:
+            self._entries_size -= self._entries[self._start].cost
+            self._entries[self._start] = None  # Free the snapshots it referenced
+            self._start += 1
+            self._position -= 1
+        if self._start > len(self._entries) // 2:
+            # Compact now and then, amortized this stays constant time per step
+            del self._entries[:self._start]
+            self._start = 0
+
+    def can_undo(self):
+        return self._position > 0
+
+    def can_redo(self):
+        return self._position < len(self)
+
+    def undo_label(self):
+        return self._entry(self._position - 1).label if self.can_undo() else None
+
+    def redo_label(self):
+        return self._entry(self._position).label if self.can_redo() else None
+
+    def undo(self):
+        if not self.can_undo():
+            return False
+        self._position -= 1
+        self.state = self._entry(self._position).before
+        self._changed()
+        return True
+
+    def redo(self):
+        if not self.can_redo():
+            return False
+        self.state = self._entry(self._position).after
+        self._position += 1
+        self._changed()
+        return True
+
+    def __len__(self):
+        return len(self._entries) - self._start
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change(self)
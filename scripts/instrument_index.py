@@ -0,0 +1,326 @@
+import os
+import re
+import bisect
+import math
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from logger import logger
+from memory_accounting import deep_size
+import riff
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg")
+CHUCK_EXTENSIONS = (".ck",)
+INSTRUMENT_EXTENSIONS = CHUCK_EXTENSIONS + AUDIO_EXTENSIONS
+
+KIND_CHUCK = 0
+KIND_AUDIO = 1
+
+# Below this many files the process pool costs more than it saves
+PARALLEL_THRESHOLD = 32
+EXCERPT_LENGTH = 200
+
+# Capitalised ChucK types that are not unit generators
+NON_UGEN_TYPES = {
+    "Event", "Object", "Shred", "Machine", "Math", "Std", "FileIO", "Hid", "HidMsg",
+    "MidiIn", "MidiOut", "MidiMsg", "OscIn", "OscOut", "OscMsg", "OscRecv", "OscSend",
+    "OscEvent", "SerialIO", "StringTokenizer", "ConsoleInput", "KBHit", "IO", "RegEx",
+}
+
+_COMMENT_PATTERN = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+_STRING_PATTERN = re.compile(r'"(?:\\.|[^"\\])*"')
+# "SinOsc s", "LiSa lisa[3]", "Pan8 @ pan", "new Gen10"
+_DECLARATION_PATTERN = re.compile(
+    r"\b([A-Z][A-Za-z0-9_]*)(?:\s*@)?(?:\s*\[\s*\d*\s*\])*\s+(?=[a-z_])|\bnew\s+([A-Z][A-Za-z0-9_]*)"
+)
+_NO_IDS = np.zeros(0, np.int32)
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9]+")
+_QUERY_PATTERN = re.compile(
+    r"(?P<uses>uses\s+\w+)"
+    r"|(?P<duration>(?P<op>[<>]=?)\s*(?P<value>\d+(?:\.\d+)?)\s*(?P<unit>ms|s|sec|seconds)?\b)"
+    r"|(?P<word>\w+)",
+    re.I,
+)
+
+
+def _tokenize(text):
+    """Split text into lowercase search tokens, also breaking CamelCase and digits apart."""
+    tokens = set()
+    for word in _WORD_PATTERN.findall(text):
+        tokens.add(word.lower())
+        for part in re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+", word):
+            tokens.add(part.lower())
+    return tokens
+
+
+def extract_chuck_metadata(file_path):
+    """Return the declared UGens and a text excerpt for a ChucK script."""
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        source = f.read()
+
+    code = _COMMENT_PATTERN.sub(" ", _STRING_PATTERN.sub('""', source))
+    names = {declared or created for declared, created in _DECLARATION_PATTERN.findall(code)}
+    # ALL_CAPS names are constants, not types
+    ugens = sorted(name for name in names if name not in NON_UGEN_TYPES and not name.isupper())
+
+    # Prefer the header comment as the excerpt, it usually describes the instrument
+    comments = [line.strip().lstrip("/").strip() for line in source.splitlines() if line.strip().startswith("//")]
+    excerpt = " ".join(line for line in comments if line and not set(line) <= {"-", "="})
+    if not excerpt:
+        excerpt = " ".join(source.split())
+    return {"ugens": ugens, "excerpt": excerpt[:EXCERPT_LENGTH]}
+
+
+def extract_audio_metadata(file_path):
+    """Return duration, channel count, sample rate and peak/RMS loudness (dBFS) of an audio file."""
+    from pydub import AudioSegment
+
+    try:
+        segment = AudioSegment.from_file(file_path)
+    except Exception:
+        if not file_path.endswith(".wav"):
+            raise
+        # Compressed WAVs (mu-law, ADPCM) need ffmpeg to decode; the header still gives the basics
+        fmt = riff.read_format(file_path)
+        return {
+            "duration": fmt["frames"] / fmt["sample_rate"] if fmt["sample_rate"] else 0.0,
+            "channels": fmt["channels"],
+            "sample_rate": fmt["sample_rate"],
+            "peak_dbfs": math.nan,
+            "rms_dbfs": math.nan,
+        }
+    return {
+        "duration": len(segment) / 1000.0,
+        "channels": segment.channels,
+        "sample_rate": segment.frame_rate,
+        "peak_dbfs": segment.max_dBFS,
+        "rms_dbfs": segment.dBFS,
+    }
+
+
+def extract_metadata(file_path):
+    """Extract metadata for a single library file. Runs inside worker processes."""
+    try:
+        if file_path.endswith(CHUCK_EXTENSIONS):
+            return extract_chuck_metadata(file_path)
+        return extract_audio_metadata(file_path)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+class InstrumentIndex:
+    """Searchable catalog of instrument library files and their metadata.
+
+    Entries are stored column-wise in flat arrays and addressed by integer id.
+    Text postings are concatenated in vocabulary order, so the entries of
+    every token sharing a prefix are one contiguous slice. A query marks
+    each term's entries in a boolean mask and ANDs the masks, which stays
+    in the low milliseconds even for one-letter prefixes over 50k entries.
+    """
+
+    def __init__(self, max_workers=None, metadata_cache=None):
+        self.max_workers = max_workers
+        # file path -> (mtime_ns, size, metadata), survives rebuilds so rescans only extract changed files.
+        # Indexes passed the same dict share it, so a new index only extracts what none of them has seen.
+        self._metadata_cache = {} if metadata_cache is None else metadata_cache
+        self.roots = []
+        self._reset()
+
+    def _reset(self):
+        self.paths = []
+        self.sources = array("B")
+        self.kinds = array("B")
+        self.durations = array("d")
+        self.channels = array("H")
+        self.sample_rates = array("I")
+        self.peak_dbfs = array("d")
+        self.rms_dbfs = array("d")
+        self.ugens = []
+        self.excerpts = []
+        self._token_postings = {}  # token -> set of ids while building, folded into _postings by _finalize
+        self._ugen_postings = {}
+        self._channel_postings = {}
+        self._vocabulary = []
+        self._postings = np.zeros(0, np.int32)  # Ids of every token's entries, in vocabulary order
+        self._posting_offsets = np.zeros(1, np.int64)  # Where each vocabulary token's ids start in _postings
+        self._duration_order = np.zeros(0, np.int32)
+        self._duration_keys = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def memory_footprint(self):
+        """(bytes, entries) held by the index, including the metadata cache."""
+        return deep_size(self), len(self)
+
+    def build(self, roots):
+        """Return a new index of every instrument file below the given (source_label, directory) roots.
+
+        This index is left as it is, so searches on it keep working while
+        the new one is built. It shares the metadata cache, so only new or
+        changed files are extracted. Swap the result in once it's done.
+        """
+        index = InstrumentIndex(self.max_workers, self._metadata_cache)
+        index.roots = [(label, os.path.expanduser(directory)) for label, directory in roots]
+        files = []
+        for source_id, (_, directory) in enumerate(index.roots):
+            for file_path, stat in index._scan(directory):
+                files.append((source_id, file_path, stat))
+
+        index._extract_missing(files)
+        for source_id, file_path, stat in files:
+            index._add_entry(source_id, file_path, index._metadata_cache[file_path][2])
+        index._finalize()
+        logger.info(f"Indexed {len(index)} instrument library files")
+        return index
+
+    def _scan(self, directory):
+        if not os.path.exists(directory):
+            return
+        for root, _, files in os.walk(directory):
+            for filename in sorted(files):
+                if filename.endswith(INSTRUMENT_EXTENSIONS):
+                    file_path = os.path.join(root, filename)
+                    try:
+                        yield file_path, os.stat(file_path)
+                    except OSError:
+                        continue
+
+    def _extract_missing(self, files):
+        """Extract metadata for files that are new or changed since the last build."""
+        missing = []
+        for _, file_path, stat in files:
+            cached = self._metadata_cache.get(file_path)
+            if not cached or cached[0] != stat.st_mtime_ns or cached[1] != stat.st_size:
+                missing.append((file_path, stat))
+
+        if len(missing) < PARALLEL_THRESHOLD:
+            results = [extract_metadata(file_path) for file_path, _ in missing]
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(extract_metadata, [file_path for file_path, _ in missing], chunksize=16))
+
+        for (file_path, stat), metadata in zip(missing, results):
+            if "error" in metadata:
+                logger.warning(f"Could not read metadata for {file_path}: {metadata['error']}")
+            self._metadata_cache[file_path] = (stat.st_mtime_ns, stat.st_size, metadata)
+
+    def _add_entry(self, source_id, file_path, metadata):
+        entry_id = len(self.paths)
+        is_chuck = file_path.endswith(CHUCK_EXTENSIONS)
+        self.paths.append(file_path)
+        self.sources.append(source_id)
+        self.kinds.append(KIND_CHUCK if is_chuck else KIND_AUDIO)
+        self.durations.append(metadata.get("duration", 0.0))
+        self.channels.append(metadata.get("channels", 0))
+        self.sample_rates.append(metadata.get("sample_rate", 0))
+        self.peak_dbfs.append(metadata.get("peak_dbfs", math.nan))
+        self.rms_dbfs.append(metadata.get("rms_dbfs", math.nan))
+        ugens = tuple(metadata.get("ugens", ()))
+        self.ugens.append(ugens)
+        self.excerpts.append(metadata.get("excerpt", ""))
+
+        tokens = _tokenize(self.relative_path(entry_id))
+        for ugen in ugens:
+            tokens |= _tokenize(ugen)
+            self._ugen_postings.setdefault(ugen.lower(), set()).add(entry_id)
+        tokens |= _tokenize(self.excerpts[-1])
+        for token in tokens:
+            self._token_postings.setdefault(token, set()).add(entry_id)
+        if not is_chuck:
+            self._channel_postings.setdefault(self.channels[-1], set()).add(entry_id)
+
+    def _finalize(self):
+        self._vocabulary = sorted(self._token_postings)
+        postings = [sorted(self._token_postings[token]) for token in self._vocabulary]
+        self._posting_offsets = np.cumsum([0] + [len(ids) for ids in postings], dtype=np.int64)
+        self._postings = np.array([i for ids in postings for i in ids], dtype=np.int32)
+        self._token_postings = {}
+        self._ugen_postings = {ugen: np.array(sorted(ids), np.int32) for ugen, ids in self._ugen_postings.items()}
+        self._channel_postings = {channels: np.array(sorted(ids), np.int32)
+                                  for channels, ids in self._channel_postings.items()}
+        order = sorted((i for i in range(len(self.paths)) if self.kinds[i] == KIND_AUDIO),
+                       key=self.durations.__getitem__)
+        self._duration_order = np.array(order, dtype=np.int32)
+        self._duration_keys = [self.durations[i] for i in order]
+
+    def source_label(self, entry_id):
+        return self.roots[self.sources[entry_id]][0]
+
+    def source_ids(self, directories):
+        """Ids of the roots at the given directories, for restricting a search to them."""
+        directories = {os.path.normpath(os.path.expanduser(directory)) for directory in directories}
+        return {source_id for source_id, (_, directory) in enumerate(self.roots)
+                if os.path.normpath(directory) in directories}
+
+    def path(self, entry_id):
+        return self.paths[entry_id]
+
+    def relative_path(self, entry_id):
+        return os.path.relpath(self.paths[entry_id], self.roots[self.sources[entry_id]][1])
+
+    def describe(self, entry_id):
+        """Return a one-line human readable metadata summary for an entry."""
+        if self.kinds[entry_id] == KIND_CHUCK:
+            ugens = ", ".join(self.ugens[entry_id]) or "no UGens"
+            return f"ChucK: {ugens}\n{self.excerpts[entry_id]}"
+        channels = {1: "mono", 2: "stereo"}.get(self.channels[entry_id], f"{self.channels[entry_id]} ch")
+        summary = f"{self.durations[entry_id]:.2f} s, {channels}, {self.sample_rates[entry_id]} Hz"
+        if not math.isnan(self.peak_dbfs[entry_id]):
+            summary += f", peak {self.peak_dbfs[entry_id]:.1f} dBFS, RMS {self.rms_dbfs[entry_id]:.1f} dBFS"
+        return summary
+
+    def _prefix_ids(self, prefix):
+        """Ids of the entries of every token starting with prefix, one slice of the postings (may repeat ids)."""
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        # Every token with the prefix sorts before prefix followed by the highest code point
+        end = bisect.bisect_left(self._vocabulary, prefix + "\U0010ffff", start)
+        return self._postings[self._posting_offsets[start]:self._posting_offsets[end]]
+
+    def _mask(self, ids):
+        mask = np.zeros(len(self.paths), dtype=bool)
+        mask[ids] = True
+        return mask
+
+    def search(self, query, sources=None):
+        """Return the sorted ids of entries matching a query such as "stereo, >10 s, uses LiSa".
+
+        Supported terms: "mono"/"stereo", duration comparisons ("<2s", ">= 500 ms"),
+        "uses <UGen>" and free text, which is prefix matched against file names,
+        UGens and excerpts. All terms must match. sources optionally restricts
+        the result to entries below those root ids.
+        """
+        terms = []
+        low, high = float("-inf"), float("inf")
+        for match in _QUERY_PATTERN.finditer(query):
+            if match.group("uses"):
+                ugen = match.group("uses").split()[1].lower()
+                terms.append(self._ugen_postings.get(ugen, _NO_IDS))
+            elif match.group("duration"):
+                value = float(match.group("value"))
+                if (match.group("unit") or "s").lower() == "ms":
+                    value /= 1000.0
+                if match.group("op").startswith(">"):
+                    low = max(low, value if "=" in match.group("op") else value + 1e-9)
+                else:
+                    high = min(high, value if "=" in match.group("op") else value - 1e-9)
+            else:
+                word = match.group("word").lower()
+                if word in ("mono", "stereo"):
+                    terms.append(self._channel_postings.get(1 if word == "mono" else 2, _NO_IDS))
+                else:
+                    terms.append(self._prefix_ids(word))
+        if low != float("-inf") or high != float("inf"):
+            start = bisect.bisect_left(self._duration_keys, low)
+            end = bisect.bisect_right(self._duration_keys, high)
+            terms.append(self._duration_order[start:end])
+        if sources is not None:
+            source_ids = np.frombuffer(self.sources, dtype=np.uint8) if len(self.sources) else np.zeros(0, np.uint8)
+            terms.append(np.flatnonzero(np.isin(source_ids, list(sources))))
+
+        if not terms:
+            return list(range(len(self.paths)))
+        result = None
+        for ids in sorted(terms, key=len):
+            result = self._mask(ids) if result is None else result & self._mask(ids)
+        return np.flatnonzero(result).tolist()
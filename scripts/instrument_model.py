@@ -0,0 +1,144 @@
+import os
+from array import array
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex
+from instrument_index import INSTRUMENT_EXTENSIONS
+from memory_accounting import deep_size
+
+# Role returning the structured (source_label, relative_path, file_path) id of a row
+EntryRole = Qt.UserRole + 1
+
+FETCH_BATCH_SIZE = 512
+
+
+class LibraryScan:
+    """Incremental directory scan of the instrument library stored as compact columns.
+
+    Only the source id and the path relative to its root are kept per entry, so
+    memory grows by a small string per file instead of one widget item per file.
+    """
+
+    def __init__(self, roots):
+        self.roots = [(label, os.path.expanduser(directory)) for label, directory in roots]
+        self.sources = array("B")
+        self.relative_paths = []
+        self._walker = self._walk()
+        self.exhausted = False
+
+    def __len__(self):
+        return len(self.relative_paths)
+
+    def _walk(self):
+        for source_id, (_, directory) in enumerate(self.roots):
+            if not os.path.exists(directory):
+                continue
+            for root, _, files in os.walk(directory):
+                for filename in sorted(files):
+                    if filename.endswith(INSTRUMENT_EXTENSIONS):
+                        yield source_id, os.path.relpath(os.path.join(root, filename), directory)
+
+    def scan_more(self, count):
+        """Scan up to count more files. Returns how many entries were added."""
+        added = 0
+        for source_id, relative_path in self._walker:
+            self.sources.append(source_id)
+            self.relative_paths.append(relative_path)
+            added += 1
+            if added == count:
+                return added
+        self.exhausted = True
+        return added
+
+    def source_label(self, entry_id):
+        return self.roots[self.sources[entry_id]][0]
+
+    def relative_path(self, entry_id):
+        return self.relative_paths[entry_id]
+
+    def path(self, entry_id):
+        return os.path.join(self.roots[self.sources[entry_id]][1], self.relative_paths[entry_id])
+
+    def describe(self, entry_id):
+        return None
+
+
+class InstrumentListModel(QAbstractListModel):
+    """List model over library entries that reveals rows lazily in batches.
+
+    The entries come either from a LibraryScan, which is walked on demand as the
+    view asks for more rows, or from an InstrumentIndex together with the ids of a
+    search result. Either way the model only holds integer row ids.
+    """
+
+    def __init__(self, roots, parent=None):
+        super().__init__(parent)
+        self.roots = roots
+        self._entries = LibraryScan(roots)
+        self._rows = None  # None means every entry in scan order
+        self._loaded = 0
+
+    def _available(self):
+        return len(self._entries) if self._rows is None else len(self._rows)
+
+    def _has_more(self):
+        if self._loaded < self._available():
+            return True
+        return self._rows is None and not self._entries.exhausted
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._loaded
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._has_more()
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        if self._rows is None and self._loaded + FETCH_BATCH_SIZE > len(self._entries):
+            self._entries.scan_more(FETCH_BATCH_SIZE)
+        count = min(FETCH_BATCH_SIZE, self._available() - self._loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def entry_id(self, row):
+        return row if self._rows is None else self._rows[row]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self._loaded:
+            return None
+        entry_id = self.entry_id(index.row())
+        if role == Qt.DisplayRole:
+            return f"[{self._entries.source_label(entry_id)}] {self._entries.relative_path(entry_id)}"
+        if role == Qt.ToolTipRole:
+            return self._entries.describe(entry_id)
+        if role == EntryRole:
+            return (self._entries.source_label(entry_id), self._entries.relative_path(entry_id),
+                    self._entries.path(entry_id))
+        return None
+
+    def rescan(self):
+        """Drop all rows and start a fresh lazy scan of the library directories."""
+        self.beginResetModel()
+        self._entries = LibraryScan(self.roots)
+        self._rows = None
+        self._loaded = 0
+        self.endResetModel()
+
+    def show_index_results(self, index, entry_ids):
+        """Show the given InstrumentIndex entries, e.g. the result of a search."""
+        self.beginResetModel()
+        self._entries = index
+        self._rows = array("I", entry_ids)
+        self._loaded = 0
+        self.endResetModel()
+
+    def memory_footprint(self):
+        """(bytes, loaded rows) owned by the model. A shown InstrumentIndex is accounted for separately."""
+        owned = self._entries if self._rows is None else self._rows
+        return deep_size(owned), self._loaded
+
+    def is_empty(self):
+        """True once it is known that there are no rows to show at all."""
+        return self._available() == 0 and not self._has_more()
@@ -0,0 +1,425 @@
+import os
+import sys
+import json
+import math
+import time
+import wave
+import shutil
+import threading
+import argparse
+import tempfile
+import statistics
+import numpy as np
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QTimer
+from logger import logger
+from memory_accounting import process_rss, open_descriptors
+
+SAMPLE_INTERVAL = 0.5  # Seconds between memory/descriptor samples
+LAG_TIMER_INTERVAL = 10  # Milliseconds, the event loop lag probe
+FLOOD_BURST = 32  # OSC parameter changes and notes sent per flood step
+FLOOD_MIDI_RATE = 1000  # MIDI note messages per second fed in by the flood scenario
+TONE_SECONDS = 2.0  # Length of the generated audition file
+
+# Stand-in for chuck and ffplay. Behaviour is configured through PYDAW_FAKE_* environment variables so
+# every child of one run behaves the same without changing the command lines the app builds.
+FAKE_BINARY = '''#!{python}
+import os, sys, time, socket
+name = os.path.basename(sys.argv[0])
+delay = float(os.environ.get("PYDAW_FAKE_STARTUP_DELAY", "0"))
+output_rate = float(os.environ.get("PYDAW_FAKE_OUTPUT_RATE", "0"))
+cpu_burn = float(os.environ.get("PYDAW_FAKE_CPU", "0"))
+sink = os.environ.get("PYDAW_FAKE_AUDIO_SINK", "null")
+ready_dir = os.environ.get("PYDAW_FAKE_READY_DIR")
+lifetime = float(os.environ.get("PYDAW_FAKE_LIFETIME", "0"))
+if name.startswith("ffplay") and "-autoexit" in sys.argv:
+    lifetime = lifetime or float(os.environ.get("PYDAW_FAKE_PLAY_SECONDS", "2"))
+
+time.sleep(delay)
+sock = None
+for arg in sys.argv[1:]:
+    # chuck script.ck:port:reply_port, listen like the real script would so OSC sends have a receiver
+    port = (arg.split(":") + [""])[1]
+    if port.isdigit():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", int(port)))
+        sock.setblocking(False)
+audio = None
+if sink != "null":
+    # A directory sink gets one raw 16-bit stereo file per process
+    audio = open(os.path.join(sink, f"{{name}}-{{os.getpid()}}.raw"), "ab")
+streaming = "pipe:0" in sys.argv
+if streaming:
+    # Consume the sampler's PCM stream like the real ffplay would, or the writer would block
+    def drain():
+        while True:
+            data = sys.stdin.buffer.read(4096)
+            if not data:
+                os._exit(0)
+            if audio:
+                audio.write(data)
+    import threading
+    threading.Thread(target=drain, daemon=True).start()
+if ready_dir:
+    open(os.path.join(ready_dir, str(os.getpid())), "w").close()
+print(f"{{name}}: ready", flush=True)
+
+tick = 0.01
+frames = int(44100 * tick)
+started = next_tick = time.monotonic()
+lines = 0
+while not lifetime or time.monotonic() - started < lifetime:
+    busy_until = time.monotonic() + tick * cpu_burn
+    while time.monotonic() < busy_until:
+        pass
+    if sock:
+        try:
+            while sock.recv(65536):
+                pass
+        except BlockingIOError:
+            pass
+    if audio and not streaming:
+        audio.write(bytes(frames * 4))
+    now = time.monotonic()
+    while output_rate and lines < (now - started) * output_rate:
+        print(f"{{name}}: line {{lines}}", flush=True)
+        lines += 1
+    next_tick += tick
+    time.sleep(max(0.0, next_tick - time.monotonic()))
+'''
+
+
+def write_test_tone(path, seconds=TONE_SECONDS, frequency=440.0, sample_rate=44100):
+    """Write a 16-bit stereo sine to path for the playback scenario."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = (np.sin(2 * math.pi * frequency * t) * 0.5 * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(np.repeat(samples, 2).tobytes())
+    return path
+
+
+def write_fake_binaries(directory):
+    """Write executable stand-ins for chuck and ffplay into directory."""
+    for name in ("chuck", "ffplay"):
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(FAKE_BINARY.format(python=sys.executable))
+        os.chmod(path, 0o755)
+
+
+class FakeEnvironment:
+    """Context manager putting fake chuck/ffplay first on PATH, configured through the environment.
+
+    sink is "null" (audio is generated and dropped) or a directory that gets
+    one raw PCM file per child.
+    """
+
+    def __init__(self, startup_delay=0.0, output_rate=0.0, cpu_burn=0.0, sink="null", lifetime=0.0,
+                 play_seconds=2.0):
+        self.settings = {
+            "PYDAW_FAKE_STARTUP_DELAY": str(startup_delay),
+            "PYDAW_FAKE_OUTPUT_RATE": str(output_rate),
+            "PYDAW_FAKE_CPU": str(cpu_burn),
+            "PYDAW_FAKE_AUDIO_SINK": sink,
+            "PYDAW_FAKE_LIFETIME": str(lifetime),
+            "PYDAW_FAKE_PLAY_SECONDS": str(play_seconds),
+        }
+        self.directory = None
+        self.ready_dir = None
+        self._saved = {}
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix="pydaw-loadtest-")
+        self.ready_dir = os.path.join(self.directory, "ready")
+        os.makedirs(self.ready_dir)
+        write_fake_binaries(self.directory)
+        settings = dict(self.settings, PYDAW_FAKE_READY_DIR=self.ready_dir,
+                        PATH=self.directory + os.pathsep + os.environ.get("PATH", ""))
+        for key, value in settings.items():
+            self._saved[key] = os.environ.get(key)
+            os.environ[key] = value
+        return self
+
+    def __exit__(self, *exc):
+        for key, value in self._saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def is_ready(self, pid):
+        return pid is not None and os.path.exists(os.path.join(self.ready_dir, str(pid)))
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def _summary(values):
+    if not values:
+        return None
+    return {"count": len(values), "min": min(values), "median": statistics.median(values),
+            "p95": _percentile(values, 0.95), "max": max(values)}
+
+
+class LoadTest:
+    """Drives a scenario against a real WorkspaceWindow inside the Qt event loop and records metrics.
+
+    Scenarios are generators that perform an action and yield the number of
+    seconds to wait before their next step, so they never block the event
+    loop whose lag is being measured.
+    """
+
+    def __init__(self, environment, workspace_path):
+        from workspace import WorkspaceWindow
+
+        self.environment = environment
+        self.window = WorkspaceWindow("Load Test", workspace_path)
+        # Measure the ffplay output process the fake environment stands in for, never a real audio device
+        self.window.sampler_output.use_device = False
+        self.chuck_manager = self.window.chuck_manager
+        self.supervisor = self.chuck_manager.supervisor
+        self.spawn_latencies = []
+        self.loop_lags = []
+        self.samples = []
+        self._pending = {}  # handle -> time the spawn was requested
+        self._output_requested = None  # Time the sampler output was asked for, until its process exists
+        self._started = None
+        self._last_tick = None
+        self._lag_timer = QTimer()
+        self._lag_timer.timeout.connect(self._on_lag_tick)
+        self._sample_timer = QTimer()
+        self._sample_timer.timeout.connect(self._sample)
+
+    def spawn_chuck(self, script_path):
+        requested = time.perf_counter()
+        handle = self.chuck_manager.run_script(script_path)
+        if handle is not None:
+            self._pending[handle] = requested
+        return handle
+
+    def play_audio(self, file_path):
+        # Only the first trigger starts the sampler's output process, later ones are voices. The file is
+        # decoded on the library's worker first, so the process shows up on a later lag tick.
+        if self.window.sampler_output.handle is None and self._output_requested is None:
+            self._output_requested = time.perf_counter()
+        self.window.instrument_library.play_audio(file_path)
+
+    def _on_lag_tick(self):
+        now = time.perf_counter()
+        if self._last_tick is not None:
+            self.loop_lags.append(max(0.0, now - self._last_tick - LAG_TIMER_INTERVAL / 1000))
+        self._last_tick = now
+        output = self.window.sampler_output.handle
+        if self._output_requested is not None and output is not None:
+            self._pending[output] = self._output_requested
+            self._output_requested = None
+        # Spawn latency is the time until the child has started up, not just until Popen returned
+        for handle, requested in list(self._pending.items()):
+            child = self.supervisor.get(handle)
+            if child is None:
+                del self._pending[handle]
+            elif self.environment.is_ready(child.pid):
+                self.spawn_latencies.append(now - requested)
+                del self._pending[handle]
+
+    def _sample(self):
+        usage = self.supervisor.usage_all()
+        self.samples.append({
+            "time": time.perf_counter() - self._started,
+            "rss": process_rss(),
+            "fds": open_descriptors(),
+            "children": len(usage),
+            "children_rss": sum(stats.get("rss", 0) for stats in usage),
+            "event_loop_lag_max": max(self.loop_lags[-int(SAMPLE_INTERVAL * 1000 / LAG_TIMER_INTERVAL):], default=0.0),
+        })
+
+    def run(self, scenario, settle=1.0):
+        """Run a scenario generator to completion and return the report."""
+        app = QApplication.instance()
+        self._started = time.perf_counter()
+        self._sample()
+        self._lag_timer.start(LAG_TIMER_INTERVAL)
+        self._sample_timer.start(int(SAMPLE_INTERVAL * 1000))
+
+        def step():
+            try:
+                delay = next(scenario)
+            except StopIteration:
+                QTimer.singleShot(int(settle * 1000), finish)
+                return
+            QTimer.singleShot(int(delay * 1000), step)
+
+        def finish():
+            self._lag_timer.stop()
+            self._sample_timer.stop()
+            self._sample()
+            app.quit()
+
+        QTimer.singleShot(0, step)
+        app.exec()
+        # Close the workspace like a user would; as the session's last window it also shuts the session down
+        self.window.close()
+        # One more sample once everything is reaped: growth left over now is a leak
+        time.sleep(settle)
+        self._sample()
+        return self.report()
+
+    def report(self):
+        first, loaded, last = self.samples[0], self.samples[-2], self.samples[-1]
+        return {
+            "duration": loaded["time"],
+            "spawn_latency": _summary(self.spawn_latencies),
+            "spawns_not_ready": len(self._pending),
+            "event_loop_lag": _summary(self.loop_lags),
+            "rss_growth": loaded["rss"] - first["rss"],
+            "rss_after_teardown": last["rss"] - first["rss"],
+            "rss_peak": max(sample["rss"] for sample in self.samples),
+            "fd_growth": (loaded["fds"] - first["fds"]) if first["fds"] is not None else None,
+            "fd_after_teardown": (last["fds"] - first["fds"]) if first["fds"] is not None else None,
+            "fd_peak": max((sample["fds"] or 0) for sample in self.samples),
+            "osc": dict(self.chuck_manager.control.stats),
+            "samples": self.samples,
+        }
+
+
+def scenario_spawn(test, script_path, count, interval, hold):
+    """Start count ChucK scripts, interval seconds apart, and keep them running for hold seconds."""
+    for _ in range(count):
+        test.spawn_chuck(script_path)
+        yield interval
+    yield hold
+
+
+def scenario_playback(test, audio_path, count, interval, hold):
+    """Trigger count overlapping sampler previews through the instrument library."""
+    for _ in range(count):
+        test.play_audio(audio_path)
+        yield interval
+    yield hold
+
+
+def scenario_flood(test, script_path, count, interval, hold):
+    """Flood one running instrument with count bursts of OSC parameter changes and notes plus MIDI input.
+
+    MIDI notes arrive on a separate thread at FLOOD_MIDI_RATE, like mido's
+    callback thread, and play the workspace's sampler.
+    """
+    handle = test.spawn_chuck(script_path)
+    if handle is None:
+        return
+    while True:
+        child = test.supervisor.get(handle)
+        if child is None:
+            logger.warning("The flooded instrument exited before it started up")
+            return
+        if test.environment.is_ready(child.pid):
+            break
+        yield 0.01
+
+    session = test.window.session
+    flooding = threading.Event()
+    flooding.set()
+
+    def feed_midi():
+        pitch = 0
+        while flooding.is_set():
+            session.note_on(48 + pitch % 24, 100)
+            session.note_off(48 + (pitch - 12) % 24)
+            pitch += 1
+            time.sleep(2 / FLOOD_MIDI_RATE)
+
+    midi = threading.Thread(target=feed_midi, daemon=True)
+    midi.start()
+    try:
+        for step in range(count):
+            for i in range(FLOOD_BURST):
+                test.chuck_manager.set_param(script_path, "gain", (step * FLOOD_BURST + i) % 100 / 100)
+                test.chuck_manager.trigger_note(script_path, 48 + i % 24, 100, 0.05)
+            yield interval
+        yield hold
+    finally:
+        flooding.clear()
+        midi.join()
+
+
+def scenario_churn(test, script_path, count, interval, hold):
+    """Start and immediately stop a script count times, to expose leaked threads, pipes and processes."""
+    for _ in range(count):
+        handle = test.spawn_chuck(script_path)
+        yield interval
+        if handle is not None:
+            test.chuck_manager.stop_handle(handle, kill=True)
+        yield interval
+    yield hold
+
+
+SCENARIOS = {
+    "spawn": scenario_spawn,
+    "playback": scenario_playback,
+    "flood": scenario_flood,
+    "churn": scenario_churn,
+}
+
+
+def print_report(report):
+    def seconds(summary):
+        if not summary:
+            return "n/a"
+        return f"median {summary['median'] * 1000:.1f} ms, p95 {summary['p95'] * 1000:.1f} ms, " \
+               f"max {summary['max'] * 1000:.1f} ms ({summary['count']})"
+
+    print(f"Duration:         {report['duration']:.1f} s")
+    print(f"Spawn latency:    {seconds(report['spawn_latency'])}, {report['spawns_not_ready']} never ready")
+    print(f"Event loop lag:   {seconds(report['event_loop_lag'])}")
+    print(f"RSS:              {report['rss_growth'] / 1e6:+.1f} MB under load, "
+          f"{report['rss_after_teardown'] / 1e6:+.1f} MB after teardown, peak {report['rss_peak'] / 1e6:.1f} MB")
+    if report["osc"]["bundles"]:
+        print(f"OSC:              {report['osc']['updates']} updates, {report['osc']['coalesced']} coalesced, "
+              f"{report['osc']['messages']} messages in {report['osc']['bundles']} bundles")
+    if report["fd_growth"] is not None:
+        print(f"File descriptors: {report['fd_growth']:+d} under load, "
+              f"{report['fd_after_teardown']:+d} after teardown, peak {report['fd_peak']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test PyDAW with stand-in chuck/ffplay processes.")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--count", type=int, default=200, help="Processes to start (or start/stop cycles)")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between scenario steps")
+    parser.add_argument("--hold", type=float, default=5.0, help="Seconds to keep everything running at the end")
+    parser.add_argument("--startup-delay", type=float, default=0.05, help="Seconds each fake child takes to start")
+    parser.add_argument("--output-rate", type=float, default=0.0, help="Log lines per second per fake child")
+    parser.add_argument("--cpu", type=float, default=0.0, help="Fraction of a core each fake child burns")
+    parser.add_argument("--sink", default="null", help="'null' or a directory for raw audio output")
+    parser.add_argument("--script", default="loadtest.ck", help="Script path passed to the fake chuck")
+    parser.add_argument("--audio", help="Audio file auditioned through the sampler (default: a generated tone)")
+    parser.add_argument("--workspace", help="Workspace directory (default: a temporary one)")
+    parser.add_argument("--json", help="Also write the full report, including samples, to this file")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    workspace_path = args.workspace or tempfile.mkdtemp(prefix="pydaw-loadtest-workspace-")
+    with FakeEnvironment(args.startup_delay, args.output_rate, args.cpu, args.sink) as environment:
+        test = LoadTest(environment, workspace_path)
+        if args.scenario == "playback":
+            target = args.audio or write_test_tone(os.path.join(environment.directory, "tone.wav"))
+        else:
+            target = args.script
+        logger.info(f"Running {args.scenario} with {args.count} fake processes")
+        report = test.run(SCENARIOS[args.scenario](test, target, args.count, args.interval, args.hold))
+    if not args.workspace:
+        shutil.rmtree(workspace_path, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+    sys.exit(0)
@@ -2,10 +2,12 @@ import sys
 import os
 import subprocess
 import json
+import argparse
 from PySide6.QtWidgets import QApplication, QWidget, QVBoxLayout, QPushButton, QMessageBox
 from PySide6.QtGui import QIcon
 from wsui import main as start_wsui  # Import the main function from wsui.py
 from config import SETTINGS_FILE
+from memory_accounting import default_accountant
 
 # Ensure scripts directory exists
 SCRIPTS_DIR = os.path.expanduser("~/pydaw/scripts")
@@ -55,7 +57,22 @@ def setup_auto_updates():
     return config.get("auto_update_enabled", False)
 
 
+def parse_args():
+    """Parse PyDAW's own command line flags, leaving the rest to Qt."""
+    parser = argparse.ArgumentParser(description="PyDAW")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Trace Python allocations from startup so memory reports show what grew")
+    parser.add_argument("--memory-report", metavar="PATH",
+                        help="Trace allocations and write a JSON memory report to PATH on exit")
+    args, _ = parser.parse_known_args()
+    return args
+
+
 def main():
+    args = parse_args()
+    if args.trace_memory or args.memory_report:
+        default_accountant().start_tracing()
+
     # Prompt the user to set up auto-updates on the first start
     auto_updates_enabled = setup_auto_updates()
 
@@ -67,6 +84,8 @@ def main():
     app = QApplication.instance()
     if not app:  # If QApplication instance doesn't exist, create one
         app = QApplication(sys.argv)
+    if args.memory_report:
+        app.aboutToQuit.connect(lambda: default_accountant().dump(args.memory_report))
 
     # Now it's safe to create the main window
     main_window = QWidget()
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from array import array
+from collections import deque
+from collections.abc import Mapping
+from logger import logger
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MB = 1024 * 1024
+TRACE_FRAMES = 10  # Stack depth recorded per allocation while tracing
+DIFF_TOP = 25  # Allocation sites listed in a snapshot diff
+
+_default_accountant = None
+_default_accountant_lock = threading.Lock()
+
+
+def default_accountant():
+    """The process-wide accountant every subsystem registers with."""
+    global _default_accountant
+    with _default_accountant_lock:
+        if _default_accountant is None:
+            _default_accountant = MemoryAccountant()
+        return _default_accountant
+
+
+def process_rss():
+    """Resident memory of this process in bytes."""
+    if psutil:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        # Peak rather than current on platforms without /proc, still shows growth
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def open_descriptors():
+    """Number of open file descriptors (handles on Windows) of this process."""
+    if psutil:
+        process = psutil.Process()
+        return process.num_handles() if sys.platform == "win32" else process.num_fds()
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(fd_dir):
+            return len(os.listdir(fd_dir))
+    return None
+
+
+def deep_size(value, seen=None):
+    """Approximate bytes owned by a Python value, following containers and plain objects.
+
+    Objects reached twice are counted once. NumPy arrays count their buffer
+    if they own it. Qt objects only count their Python wrapper.
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    # Includes the data buffer for arrays that own it, only the header for views
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, bytearray, array, int, float, bool, type(None))):
+        return size
+    if isinstance(value, Mapping):
+        return size + sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset, deque)):
+        return size + sum(deep_size(item, seen) for item in value)
+    if hasattr(value, "__dict__") and type(value).__module__ not in ("builtins",) \
+            and not type(value).__module__.startswith(("PySide6", "shiboken")):
+        size += deep_size(vars(value), seen)
+    for slot in getattr(type(value), "__slots__", ()):
+        if hasattr(value, slot):
+            size += deep_size(getattr(value, slot), seen)
+    return size
+
+
+class MemoryAccountant:
+    """Registry of per-subsystem memory footprints with budgets, plus tracemalloc snapshot diffs.
+
+    Each subsystem registers a sizer returning its current footprint in
+    bytes, or (bytes, item count). Sizers are only called when a report or
+    check is requested, so registering costs nothing while nobody looks.
+    """
+
+    def __init__(self):
+        self._sizers = {}  # name -> (sizer, budget)
+        self._over_budget = set()
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def register(self, name, sizer, budget=None):
+        with self._lock:
+            self._sizers[name] = (sizer, budget)
+
+    def unregister(self, name):
+        """Forget a subsystem, or every subsystem whose name starts with name + "/"."""
+        with self._lock:
+            for key in [key for key in self._sizers if key == name or key.startswith(name + "/")]:
+                del self._sizers[key]
+                self._over_budget.discard(key)
+
+    def measure(self):
+        """Current footprint of every registered subsystem, largest first."""
+        with self._lock:
+            sizers = list(self._sizers.items())
+        entries = []
+        for name, (sizer, budget) in sizers:
+            entry = {"name": name, "bytes": None, "items": None, "budget": budget}
+            try:
+                result = sizer()
+                entry["bytes"], entry["items"] = result if isinstance(result, tuple) else (result, None)
+            except Exception as e:
+                entry["error"] = str(e)
+            entry["over_budget"] = bool(budget and entry["bytes"] and entry["bytes"] > budget)
+            entries.append(entry)
+        entries.sort(key=lambda entry: entry["bytes"] or 0, reverse=True)
+        return entries
+
+    def check(self):
+        """Measure and warn once for every subsystem that newly went over its budget. Returns those entries.
+
+        Sizers may walk large object graphs, so call this from a worker thread.
+        """
+        entries = self.measure()
+        newly_over = []
+        with self._lock:
+            for entry in entries:
+                if entry["over_budget"] and entry["name"] not in self._over_budget:
+                    self._over_budget.add(entry["name"])
+                    newly_over.append(entry)
+                elif not entry["over_budget"]:
+                    self._over_budget.discard(entry["name"])
+        for entry in newly_over:
+            logger.warning(f"{entry['name']} uses {entry['bytes'] / MB:.1f} MB, "
+                           f"over its {entry['budget'] / MB:.1f} MB budget")
+        return newly_over
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start_tracing(self, frames=TRACE_FRAMES):
+        """Start tracemalloc and take the baseline snapshot later diffs are relative to."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._baseline = self.snapshot()
+
+    def stop_tracing(self):
+        self._baseline = None
+        tracemalloc.stop()
+
+    @staticmethod
+    def snapshot():
+        """A filtered tracemalloc snapshot to diff against later, or None while not tracing."""
+        if not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def snapshot_diff(self, top=DIFF_TOP, baseline=None):
+        """Allocation sites that grew most since baseline, or since tracing started.
+
+        The shared baseline is never moved, so callers wanting growth between
+        their own calls keep a snapshot() of their own and pass it in.
+        """
+        baseline = baseline or self._baseline
+        if not tracemalloc.is_tracing() or baseline is None:
+            return []
+        stats = self.snapshot().compare_to(baseline, "traceback")
+        return [{
+            "size_diff": stat.size_diff,
+            "count_diff": stat.count_diff,
+            "size": stat.size,
+            "traceback": [f"{frame.filename}:{frame.lineno}" for frame in reversed(stat.traceback)],  # Innermost first
+        } for stat in stats[:top]]
+
+    def report(self, include_diff=True):
+        report = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "pid": os.getpid(),
+            "rss": process_rss(),
+            "open_descriptors": open_descriptors(),
+            "threads": threading.active_count(),
+            "subsystems": self.measure(),
+            "tracing": self.tracing,
+        }
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            report["traced"] = {"current": current, "peak": peak}
+            if include_diff:
+                report["allocation_growth"] = self.snapshot_diff()
+        return report
+
+    def dump(self, path):
+        """Write the report as JSON, e.g. to attach to a bug report."""
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+        logger.info(f"Memory report written to {path}")
+
+
+def format_report(report):
+    """Plain-text rendering of a report for the debug menu."""
+    lines = [f"Process RSS {report['rss'] / MB:.1f} MB, {report['open_descriptors']} descriptors, "
+             f"{report['threads']} threads", ""]
+    for entry in report["subsystems"]:
+        size = "error: " + entry["error"] if entry.get("error") else f"{(entry['bytes'] or 0) / MB:10.2f} MB"
+        items = f"  {entry['items']} items" if entry["items"] is not None else ""
+        budget = f"  / {entry['budget'] / MB:.0f} MB" if entry["budget"] else ""
+        flag = "  OVER BUDGET" if entry["over_budget"] else ""
+        lines.append(f"{entry['name']:<40} {size}{budget}{items}{flag}")
+    if report.get("traced"):
+        lines += ["", f"Traced Python allocations: {report['traced']['current'] / MB:.1f} MB "
+                      f"(peak {report['traced']['peak'] / MB:.1f} MB)"]
+    for stat in report.get("allocation_growth", [])[:10]:
+        lines.append(f"{stat['size_diff'] / 1e3:+10.1f} kB {stat['count_diff']:+8d}  {stat['traceback'][0]}")
+    return "\n".join(lines)
@@ -0,0 +1,404 @@
+import math
+import time
+import threading
+from collections import deque
+import numpy as np
+from PySide6.QtWidgets import QWidget, QHBoxLayout, QLabel
+from PySide6.QtCore import QObject, Qt, Signal, QRectF
+from PySide6.QtGui import QPainter, QColor
+from logger import logger
+from transport import SAMPLE_RATE
+
+DISPLAY_RATE = 30  # Meter updates per second
+TAP_CAPACITY = 1 << 15  # Frames per tap ring buffer, must be at least twice the frames of one display period
+FLOOR_DB = -90.0
+PEAK_DECAY_DB = 20.0  # Peak hold fall-off per second
+MOMENTARY_SECONDS = 0.4  # EBU R128 momentary loudness window
+CPU_BUDGET = 0.25  # Fraction of each display period analysis may take before resolution drops
+# Resolution steps (spectrum FFT size, spectrum bands, spectra per update, loudness frames per update), lowest
+# load first. Below full resolution loudness is estimated from only the newest frames of each update.
+LEVELS = [(4096, 64, 16, None), (2048, 48, 8, 1024), (1024, 32, 4, 512), (512, 16, 2, 256)]
+
+
+def _db(power):
+    return np.maximum(10.0 * np.log10(np.maximum(power, 1e-30)), FLOOR_DB)
+
+
+def _biquad_power(b, a, w):
+    z = np.exp(-1j * w)
+    return np.abs(np.polyval(b[::-1], z) / np.polyval(a[::-1], z)) ** 2
+
+
+def k_weighting(frequencies, sample_rate):
+    """Power response of the ITU-R BS.1770 K-weighting filter (high shelf + high pass) at the given frequencies."""
+    w = 2 * np.pi * np.asarray(frequencies) / sample_rate
+
+    # Stage 1: high shelf, +4 dB above ~1.7 kHz
+    gain_db, q, fc = 3.99984385397, 0.7071752369554193, 1681.9744509555319
+    A = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha, cos = math.sin(w0) / (2 * q), math.cos(w0)
+    shelf_b = [A * ((A + 1) + (A - 1) * cos + 2 * math.sqrt(A) * alpha), -2 * A * ((A - 1) + (A + 1) * cos),
+               A * ((A + 1) + (A - 1) * cos - 2 * math.sqrt(A) * alpha)]
+    shelf_a = [(A + 1) - (A - 1) * cos + 2 * math.sqrt(A) * alpha, 2 * ((A - 1) - (A + 1) * cos),
+               (A + 1) - (A - 1) * cos - 2 * math.sqrt(A) * alpha]
+
+    # Stage 2: high pass at ~38 Hz
+    q, fc = 0.5003270373253953, 38.13547087613982
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha, cos = math.sin(w0) / (2 * q), math.cos(w0)
+    highpass_b = [(1 + cos) / 2, -(1 + cos), (1 + cos) / 2]
+    highpass_a = [1 + alpha, -2 * cos, 1 - alpha]
+
+    return _biquad_power(shelf_b, shelf_a, w) * _biquad_power(highpass_b, highpass_a, w)
+
+
+class MeterTap:
+    """Single-producer single-consumer ring buffer between an audio thread and the meter worker.
+
+    The producer only ever advances the written counter after copying a
+    block in, the consumer only advances its read counter, so no lock is
+    needed. If the consumer falls behind, the oldest audio is dropped.
+    """
+
+    def __init__(self, name, channels=2, sample_rate=SAMPLE_RATE, capacity=TAP_CAPACITY):
+        self.name = name
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+        self.buffer = np.zeros((channels, capacity), dtype=np.float32)
+        self._written = 0
+        self._read = 0
+
+    def push(self, block):
+        """Copy a (channels, frames) or mono (frames,) float block in. Never blocks."""
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 1:
+            block = block[np.newaxis]
+        frames = block.shape[1]
+        if frames > self.capacity:
+            block = block[:, -self.capacity:]
+        n = block.shape[1]
+        start = (self._written + frames - n) % self.capacity
+        first = min(n, self.capacity - start)
+        # A mono block is broadcast to every channel
+        self.buffer[:, start:start + first] = block[:self.channels, :first]
+        self.buffer[:, :n - first] = block[:self.channels, first:]
+        self._written += frames
+
+    def read(self, max_frames):
+        """Return the newest unread frames, at most max_frames, as a (channels, frames) copy."""
+        written = self._written
+        available = min(written - self._read, max_frames, self.capacity // 2)
+        self._read = written
+        return self._copy(written, available)
+
+    def latest(self, frames):
+        """Return the newest frames whether or not they were read before, e.g. for an FFT window."""
+        written = self._written
+        return self._copy(written, min(written, frames, self.capacity // 2))
+
+    def _copy(self, written, available):
+        start = (written - available) % self.capacity
+        first = min(available, self.capacity - start)
+        if first == available:
+            return self.buffer[:, start:start + available].copy()
+        return np.concatenate((self.buffer[:, start:], self.buffer[:, :available - first]), axis=1)
+
+
+class _TapState:
+    """Per-tap analysis state kept by the worker: ballistics, the loudness window and the last reading."""
+
+    def __init__(self, channels):
+        self.peak_hold = np.full(channels, FLOOR_DB)
+        self.loudness_blocks = deque()  # (frames, weighted mean square summed over channels)
+        self.loudness_frames = 0
+        self.spectrum = None
+        self.reading = None
+        self.last_update = None
+
+
+class MeterEngine(QObject):
+    """Analyses every tap on a worker thread and publishes readings at a fixed display rate.
+
+    Taps with the same channel count and sample rate are analysed together
+    as one stacked array, so each update is a handful of vectorized passes
+    rather than a loop over tracks. Spectra are computed round-robin for a
+    limited number of taps. When an update takes more than CPU_BUDGET of the
+    display period the FFT size, band count, spectra per update and loudness
+    frames step down; past the lowest step only every stride-th tap is
+    analysed per update, which keeps the cost bounded however many tracks
+    there are. Resolution steps back up once there is headroom again.
+    """
+    meters_updated = Signal(dict)  # tap name -> reading dict
+
+    def __init__(self, display_rate=DISPLAY_RATE):
+        super().__init__()
+        self.display_rate = display_rate
+        self.taps = {}
+        self.level = 0
+        self.stride = 1
+        self.load = 0.0  # Last update's analysis time as a fraction of the display period
+        self._states = {}
+        self._caches = {}
+        self._updates = 0
+        self._idle_updates = 0
+        self._busy_updates = 0
+        self._running = False
+        self._thread = None
+
+    @property
+    def max_stride(self):
+        # Skipped taps must not overflow their ring buffer before their next turn
+        return max(1, int(TAP_CAPACITY // 2 / (SAMPLE_RATE / self.display_rate)))
+
+    def tap(self, name, channels=2, sample_rate=SAMPLE_RATE):
+        """Return the tap called name, creating it on first use."""
+        tap = self.taps.get(name)
+        if tap is None:
+            tap = MeterTap(name, channels, sample_rate)
+            # Replace the dict rather than mutate it, the worker may be iterating the old one
+            self.taps = {**self.taps, name: tap}
+        return tap
+
+    def remove_tap(self, name):
+        self.taps = {key: tap for key, tap in self.taps.items() if key != name}
+
+    def _cache(self, kind, size, sample_rate, bands=None):
+        key = (kind, size, sample_rate, bands)
+        if key not in self._caches:
+            frequencies = np.fft.rfftfreq(size, 1.0 / sample_rate)
+            if kind == "k":
+                # Parseval weights of a one-sided spectrum, K-weighted
+                weights = 2.0 * k_weighting(frequencies, sample_rate)
+                weights[0] /= 2.0
+                weights[-1] /= 2.0
+                self._caches[key] = weights
+            else:
+                edges = np.geomspace(20.0, sample_rate / 2, bands + 1)
+                starts = np.unique(np.clip(np.searchsorted(frequencies, edges[:-1]), 1, len(frequencies) - 1))
+                window = np.hanning(size).astype(np.float32)
+                self._caches[key] = (window, starts, (window.sum() / 2) ** 2)
+        return self._caches[key]
+
+    def _analyse_group(self, taps, states, spectrum_names, level, now):
+        """Analyse taps sharing channel count and sample rate in one stacked pass."""
+        fft_size, bands, _, loudness_frames = level
+        channels, sample_rate = taps[0].channels, taps[0].sample_rate
+        blocks = [tap.read(TAP_CAPACITY) for tap in taps]
+        lengths = np.array([block.shape[1] for block in blocks])
+        longest = int(lengths.max())
+
+        # Right aligned so the newest frames of every tap share the same columns
+        stacked = np.zeros((len(taps), channels, max(longest, 1)), dtype=np.float32)
+        for i, block in enumerate(blocks):
+            if block.shape[1]:
+                stacked[i, :, longest - block.shape[1]:] = block
+        divisor = np.maximum(lengths, 1)[:, np.newaxis]
+        peaks = _db(np.max(np.abs(stacked), axis=2) ** 2)
+        rms = _db(np.sum(np.square(stacked, dtype=np.float64), axis=2) / divisor)
+
+        # Loudness: K-weighted mean square through one zero-padded FFT instead of filtering
+        m = min(loudness_frames or longest, longest) or 1
+        size = 1 << (m - 1).bit_length()
+        power = np.abs(np.fft.rfft(stacked[:, :, -m:], size, axis=2)) ** 2
+        weighted = (power @ self._cache("k", size, sample_rate)).sum(axis=1) / size
+        weighted /= np.minimum(np.maximum(lengths, 1), m)
+
+        spectra = {}
+        spectrum_taps = [i for i, tap in enumerate(taps) if tap.name in spectrum_names and lengths[i]]
+        if spectrum_taps:
+            window, starts, norm = self._cache("s", fft_size, sample_rate, bands)
+            mono = np.zeros((len(spectrum_taps), fft_size), dtype=np.float32)
+            for row, i in enumerate(spectrum_taps):
+                latest = taps[i].latest(fft_size).mean(axis=0)
+                mono[row, fft_size - len(latest):] = latest
+            bins = np.abs(np.fft.rfft(mono * window, axis=1)) ** 2 / norm
+            for row, band_power in zip(spectrum_taps, _db(np.maximum.reduceat(bins, starts, axis=1))):
+                spectra[row] = band_power.tolist()
+
+        window_frames = int(MOMENTARY_SECONDS * sample_rate)
+        for i, tap in enumerate(taps):
+            state = states[tap.name]
+            elapsed = now - state.last_update if state.last_update else 1.0 / self.display_rate
+            state.last_update = now
+            if lengths[i]:
+                state.loudness_blocks.append((int(lengths[i]), float(weighted[i])))
+                state.loudness_frames += int(lengths[i])
+            while state.loudness_blocks and state.loudness_frames - state.loudness_blocks[0][0] >= window_frames:
+                state.loudness_frames -= state.loudness_blocks.popleft()[0]
+            if state.loudness_blocks:
+                mean_square = sum(f * ms for f, ms in state.loudness_blocks) / max(state.loudness_frames, 1)
+                lufs = max(-0.691 + 10 * math.log10(max(mean_square, 1e-30)), FLOOR_DB)
+            else:
+                lufs = FLOOR_DB
+            if i in spectra:
+                state.spectrum = spectra[i]
+            elif not lengths[i] and tap.name in spectrum_names:
+                state.spectrum = None
+            state.peak_hold = np.maximum(peaks[i], state.peak_hold - PEAK_DECAY_DB * elapsed)
+            state.reading = {"channels": channels, "peak": peaks[i].tolist(), "rms": rms[i].tolist(),
+                             "peak_hold": state.peak_hold.tolist(), "lufs": lufs, "spectrum": state.spectrum}
+
+    def update(self, now=None):
+        """Run one analysis pass over the taps due this update and return {name: reading} for all taps."""
+        now = time.monotonic() if now is None else now
+        started = time.perf_counter()
+        level = LEVELS[self.level]
+        taps = list(self.taps.values())
+        self._states = {tap.name: self._states.get(tap.name) or _TapState(tap.channels) for tap in taps}
+
+        due = taps[self._updates % self.stride::self.stride]
+        spectra = level[2]
+        offset = (self._updates // self.stride) * spectra
+        spectrum_names = {due[(offset + i) % len(due)].name for i in range(min(spectra, len(due)))}
+        groups = {}
+        for tap in due:
+            groups.setdefault((tap.channels, tap.sample_rate), []).append(tap)
+        for group in groups.values():
+            self._analyse_group(group, self._states, spectrum_names, level, now)
+        self._updates += 1
+
+        self.load = (time.perf_counter() - started) * self.display_rate
+        self._adapt()
+        return {tap.name: self._states[tap.name].reading for tap in taps if self._states[tap.name].reading}
+
+    def _adapt(self):
+        if self.load > CPU_BUDGET:
+            # A single slow update (first use of an FFT size, a GC pause) is not load
+            self._idle_updates = 0
+            self._busy_updates += 1
+            if self._busy_updates < 3:
+                return
+            self._busy_updates = 0
+            if self.level < len(LEVELS) - 1:
+                self.level += 1
+            elif self.stride * 2 <= self.max_stride:
+                self.stride *= 2
+            else:
+                return
+            logger.debug(f"Meter load {self.load:.0%}, analysis resolution {LEVELS[self.level]}, stride {self.stride}")
+        elif self.load < CPU_BUDGET / 4 and (self.level or self.stride > 1):
+            self._busy_updates = 0
+            # Only step back up after a sustained quiet stretch so the resolution doesn't oscillate
+            self._idle_updates += 1
+            if self._idle_updates >= self.display_rate * 2:
+                if self.stride > 1:
+                    self.stride //= 2
+                else:
+                    self.level -= 1
+                self._idle_updates = 0
+        else:
+            self._idle_updates = 0
+            self._busy_updates = 0
+
+    def _run(self):
+        period = 1.0 / self.display_rate
+        next_update = time.monotonic() + period
+        shown = False
+        while self._running:
+            time.sleep(max(0.0, next_update - time.monotonic()))
+            now = time.monotonic()
+            readings = self.update(now)
+            next_update += period
+            if next_update < now:
+                next_update = now + period  # Skip missed updates instead of bursting
+            # An empty update is still sent once, so panels drop the meters of removed taps
+            if readings or shown:
+                self.meters_updated.emit(readings)
+            shown = bool(readings)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+class MeterWidget(QWidget):
+    """Level bars (RMS filled, peak line, peak hold tick), momentary loudness and a small spectrum."""
+
+    def __init__(self, name, parent=None):
+        super().__init__(parent)
+        self.name = name
+        self.reading = None
+        self.setMinimumSize(120, 140)
+        self.setToolTip(name)
+
+    def set_reading(self, reading):
+        self.reading = reading
+        self.update()
+
+    @staticmethod
+    def _fraction(db):
+        return min(max((db - FLOOR_DB) / -FLOOR_DB, 0.0), 1.0)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("#202020"))
+        painter.setPen(QColor("#d0d0d0"))
+        painter.drawText(4, 14, self.name)
+        if not self.reading:
+            return
+        top, bottom = 20, self.height() - 16
+        height = bottom - top
+
+        # Level bars
+        channels = self.reading["channels"]
+        bar_width = 10
+        for channel in range(channels):
+            x = 4 + channel * (bar_width + 2)
+            rms = self._fraction(self.reading["rms"][channel])
+            peak = self._fraction(self.reading["peak"][channel])
+            hold = self._fraction(self.reading["peak_hold"][channel])
+            painter.fillRect(QRectF(x, bottom - rms * height, bar_width, rms * height), QColor("#3cb371"))
+            painter.fillRect(QRectF(x, bottom - peak * height, bar_width, 2), QColor("#f0e68c"))
+            painter.fillRect(QRectF(x, bottom - hold * height, bar_width, 1),
+                             QColor("#ff4040") if self.reading["peak_hold"][channel] >= 0 else QColor("#ffffff"))
+
+        # Spectrum
+        spectrum = self.reading.get("spectrum")
+        left = 8 + channels * (bar_width + 2)
+        if spectrum:
+            band_width = (self.width() - left - 4) / len(spectrum)
+            for i, db in enumerate(spectrum):
+                value = self._fraction(db)
+                painter.fillRect(QRectF(left + i * band_width, bottom - value * height, max(band_width - 1, 1),
+                                        value * height), QColor("#4682b4"))
+
+        painter.setPen(QColor("#d0d0d0"))
+        painter.drawText(4, self.height() - 3, f"{self.reading['lufs']:.1f} LUFS")
+
+
+class MetersPanel(QWidget):
+    """Shows one MeterWidget per tap of a MeterEngine, adding and removing them as taps come and go."""
+
+    def __init__(self, engine, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.widgets = {}
+        self.layout = QHBoxLayout()
+        self.placeholder = QLabel("No audio to meter")
+        self.layout.addWidget(self.placeholder)
+        self.layout.addStretch()
+        self.setLayout(self.layout)
+        engine.meters_updated.connect(self.show_readings, Qt.QueuedConnection)
+
+    def show_readings(self, readings):
+        for name in list(self.widgets):
+            if name not in readings:
+                self.widgets.pop(name).deleteLater()
+        for name, reading in readings.items():
+            widget = self.widgets.get(name)
+            if widget is None:
+                widget = self.widgets[name] = MeterWidget(name)
+                self.layout.insertWidget(self.layout.count() - 1, widget)
+            widget.set_reading(reading)
+        self.placeholder.setVisible(not self.widgets)
@@ -1,6 +1,11 @@
+import math
+import time
+import threading
+import collections
 import mido
 from mido import MidiFile
 from logger import logger
+from transport import TransportSink
 
 def load_midi_file(midi_file_path):
     try:
@@ -9,3 +14,118 @@ def load_midi_file(midi_file_path):
             print(msg)
     except Exception as e:
         logger.error(f"Failed to load MIDI file: {e}")
+
+CLOCKS_PER_BEAT = 24  # MIDI beat clock resolution
+
+
+def open_clock_output(port_name=None):
+    """Open a MIDI output for the transport clock, or None when no MIDI backend/port is available."""
+    try:
+        names = mido.get_output_names()
+        if not names:
+            return None
+        return mido.open_output(port_name or names[0])
+    except Exception as e:
+        logger.warning(f"No MIDI output for the transport clock: {e}")
+        return None
+
+
+def open_note_input(instrument, port_name=None):
+    """Play an instrument with note_on(pitch, velocity)/note_off(pitch) from a MIDI input.
+
+    Messages arrive on mido's callback thread. Returns the open port, or
+    None when no MIDI backend/port is available.
+    """
+    def on_message(message):
+        if message.type == "note_on" and message.velocity:
+            instrument.note_on(message.note, message.velocity)
+        elif message.type in ("note_on", "note_off"):
+            instrument.note_off(message.note)
+
+    try:
+        names = mido.get_input_names()
+        if not names:
+            return None
+        return mido.open_input(port_name or names[0], callback=on_message)
+    except Exception as e:
+        logger.warning(f"No MIDI input for the sampler: {e}")
+        return None
+
+
+class MidiClockSink(TransportSink):
+    """Drives external MIDI gear from the transport: beat clock, song position, start and stop.
+
+    Clock ticks are scheduled against the tempo map at block boundaries, so a
+    tempo change moves the tick spacing on the next block. While playing, a
+    sender thread sends every tick at its own time within the block rather
+    than the whole block's ticks in one burst.
+    """
+
+    def __init__(self, port, tempo_map, sample_rate):
+        self.port = port
+        self.tempo_map = tempo_map
+        self.sample_rate = sample_rate
+        self.clocks = 0  # Ticks scheduled so far
+        self._due = collections.deque()  # (time.monotonic() to send at, tick)
+        self._last_sent = None  # (tick, time.monotonic() it went out)
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def on_tempo(self, bpm, sample_position):
+        # Ticks only land on 1/24 beat, so anything within one tick is in sync
+        self.drift_tolerance = self.sample_rate * 60.0 / bpm / CLOCKS_PER_BEAT
+
+    def on_position(self, sample_position, beat):
+        with self._condition:
+            self._due.clear()
+            self.clocks = math.ceil(beat * CLOCKS_PER_BEAT)
+            self._last_sent = None
+        # Song position pointer counts sixteenth notes
+        self.port.send(mido.Message("songpos", pos=min(int(beat * 4), 16383)))
+
+    def on_block(self, sample_position, beat, block_size):
+        # The block starts playing now, ticks inside it are offset by their distance from its start
+        started = time.monotonic()
+        end_beat = self.tempo_map.sample_to_beat(sample_position + block_size, self.sample_rate)
+        with self._condition:
+            while self.clocks < end_beat * CLOCKS_PER_BEAT:
+                tick = self.tempo_map.beat_to_sample(self.clocks / CLOCKS_PER_BEAT, self.sample_rate)
+                offset = tick - sample_position
+                self._due.append((started + max(offset, 0) / self.sample_rate, self.clocks))
+                self.clocks += 1
+            self._condition.notify()
+
+    def _send_clocks(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._due or self._due[0][0] > time.monotonic()):
+                    self._condition.wait(self._due[0][0] - time.monotonic() if self._due else None)
+                if not self._running:
+                    return
+                _, tick = self._due.popleft()
+            self.port.send(mido.Message("clock"))
+            self._last_sent = (tick, time.monotonic())
+
+    def on_play(self, playing):
+        if playing and not self._running:
+            self._running = True
+            self._thread = threading.Thread(target=self._send_clocks, daemon=True)
+            self._thread.start()
+        elif not playing and self._running:
+            with self._condition:
+                self._running = False
+                self._due.clear()
+                self._condition.notify()
+            self._thread.join()
+            self._thread = None
+        self.port.send(mido.Message("continue" if playing else "stop"))
+
+    def position(self):
+        """Where the clock output is, from the last tick sent and the time since."""
+        last = self._last_sent
+        if last is None:
+            return None
+        tick, sent = last
+        return (self.tempo_map.beat_to_sample(tick / CLOCKS_PER_BEAT, self.sample_rate)
+                + round((time.monotonic() - sent) * self.sample_rate))
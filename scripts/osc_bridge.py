@@ -0,0 +1,274 @@
+import socket
+import threading
+import time
+import statistics
+from pythonosc.osc_bundle_builder import OscBundleBuilder, IMMEDIATELY
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_packet import OscPacket
+from logger import logger
+
+OSC_HOST = "127.0.0.1"
+DEFAULT_CONTROL_RATE = 100  # Bundles per second per running script
+# Bundles are timetagged this far ahead so receivers apply them in step despite send jitter
+DEFAULT_SCHEDULE_AHEAD = 2.0 / DEFAULT_CONTROL_RATE
+
+PARAM_ADDRESS = "/pydaw/param/{}"
+NOTE_ADDRESS = "/pydaw/note"
+NOTE_OFF_ADDRESS = "/pydaw/note_off"
+PING_ADDRESS = "/pydaw/ping"
+POSITION_ADDRESS = "/pydaw/position"  # Scripts report (their OSC port, beat) back to reply_port
+
+
+def allocate_port(host=OSC_HOST, exclude=()):
+    """Return a currently unused UDP port on host that is not in exclude.
+
+    The port is free when this returns, not reserved: pass the ports handed
+    out but not yet bound by their script as exclude so two scripts never
+    get the same one.
+    """
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.bind((host, 0))
+            port = s.getsockname()[1]
+        if port not in exclude:
+            return port
+
+
+def _message(address, *args):
+    builder = OscMessageBuilder(address=address)
+    for arg in args:
+        builder.add_arg(arg)
+    return builder.build()
+
+
+class LoopbackEcho:
+    """UDP server that sends every datagram straight back to its sender.
+
+    Stands in for a running ChucK script when measuring control latency.
+    """
+
+    def __init__(self, host=OSC_HOST):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, 0))
+        self.port = self.socket.getsockname()[1]
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while self._running:
+            try:
+                data, address = self.socket.recvfrom(65536)
+            except OSError:
+                return
+            self.socket.sendto(data, address)
+
+    def close(self):
+        self._running = False
+        self.socket.close()
+
+
+class OscControlBridge:
+    """Sends parameter changes and note triggers to running ChucK scripts over OSC.
+
+    Parameter changes are coalesced: only the latest value per (script, name)
+    set within one control period is sent. The pending changes and notes of
+    each script go out as a single bundle at most once per control period,
+    timetagged schedule_ahead seconds after clock(), e.g. the wall time of the
+    transport position. The sender thread sleeps while nothing is queued.
+    Scripts that keep their own beat clock report it back to reply_port,
+    the latest report per script is kept in positions.
+    """
+
+    def __init__(self, host=OSC_HOST, control_rate=DEFAULT_CONTROL_RATE, schedule_ahead=DEFAULT_SCHEDULE_AHEAD,
+                 clock=time.time):
+        self.host = host
+        self.control_rate = control_rate
+        # Seconds added to bundle timetags so receivers can apply changes in sync, 0 sends them as IMMEDIATELY
+        self.schedule_ahead = schedule_ahead
+        self.clock = clock  # Wall time in seconds that timetags count from
+        self.targets = {}  # target (e.g. supervisor handle) -> OSC port
+        self._allocated = set()  # Ports handed out whose script has not been registered yet
+        self._pending_params = {}  # target -> {name: value}
+        self._pending_notes = {}  # target -> [OscMessage]
+        self._lock = threading.Lock()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, 0))
+        self.reply_port = self._socket.getsockname()[1]
+        self.positions = {}  # target -> (beat, time.monotonic() it arrived)
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+        self._listener = None
+        self.stats = {"updates": 0, "coalesced": 0, "bundles": 0, "messages": 0}
+
+    def allocate_port(self):
+        """A free UDP port for a new script, never one another script has been given."""
+        with self._lock:
+            port = allocate_port(self.host, set(self.targets.values()) | self._allocated)
+            self._allocated.add(port)
+            return port
+
+    def release_port(self, port):
+        """Give back a port from allocate_port whose script never started."""
+        with self._lock:
+            self._allocated.discard(port)
+
+    def register(self, target, port):
+        """Route controls for target to the given OSC port."""
+        with self._lock:
+            self.targets[target] = port
+            self._allocated.discard(port)
+        self.start()
+
+    def unregister(self, target):
+        with self._lock:
+            self.targets.pop(target, None)
+            self.positions.pop(target, None)
+            self._pending_params.pop(target, None)
+            self._pending_notes.pop(target, None)
+
+    def set_param(self, target, name, value):
+        """Queue a parameter change (gain, tempo, filter, ...) for the next control period."""
+        with self._lock:
+            if target not in self.targets:
+                return
+            params = self._pending_params.setdefault(target, {})
+            if name in params:
+                self.stats["coalesced"] += 1
+            params[name] = float(value)
+            self.stats["updates"] += 1
+        self._wake.set()
+
+    def trigger_note(self, target, pitch, velocity=100, duration=0.0):
+        """Queue a note for the next control period. A duration of 0 holds the note until note_off."""
+        self._queue_note(target, _message(NOTE_ADDRESS, int(pitch), int(velocity), float(duration)))
+
+    def note_off(self, target, pitch):
+        self._queue_note(target, _message(NOTE_OFF_ADDRESS, int(pitch)))
+
+    def _queue_note(self, target, message):
+        # Notes are events, so unlike parameters they are never coalesced
+        with self._lock:
+            if target in self.targets:
+                self._pending_notes.setdefault(target, []).append(message)
+        self._wake.set()
+
+    def _build_bundle(self, messages):
+        timestamp = self.clock() + self.schedule_ahead if self.schedule_ahead else IMMEDIATELY
+        builder = OscBundleBuilder(timestamp)
+        for message in messages:
+            builder.add_content(message)
+        return builder.build()
+
+    def flush(self):
+        """Send everything queued since the last flush, one bundle per script."""
+        with self._lock:
+            params, self._pending_params = self._pending_params, {}
+            notes, self._pending_notes = self._pending_notes, {}
+            targets = dict(self.targets)
+
+        for target in set(params) | set(notes):
+            port = targets.get(target)
+            if port is None:
+                continue
+            messages = [_message(PARAM_ADDRESS.format(name), value) for name, value in params.get(target, {}).items()]
+            messages.extend(notes.get(target, []))
+            try:
+                self._socket.sendto(self._build_bundle(messages).dgram, (self.host, port))
+            except OSError as e:
+                logger.error(f"Failed to send OSC bundle to {target}: {e}")
+                continue
+            self.stats["bundles"] += 1
+            self.stats["messages"] += len(messages)
+
+    def _run(self):
+        period = 1.0 / self.control_rate
+        while self._running:
+            self._wake.wait()
+            self._wake.clear()
+            if not self._running:
+                break
+            sent = time.monotonic()
+            self.flush()
+            # Changes made within the rest of the period coalesce into the next bundle
+            delay = period - (time.monotonic() - sent)
+            if delay > 0:
+                time.sleep(delay)
+
+    def _listen(self):
+        while self._running:
+            try:
+                data, _ = self._socket.recvfrom(65536)
+                packet = OscPacket(data)
+            except OSError:
+                return
+            except Exception:
+                continue  # Not OSC, e.g. the wake-up datagram from stop()
+            received = time.monotonic()
+            with self._lock:
+                ports = {port: target for target, port in self.targets.items()}
+                for timed in packet.messages:
+                    message = timed.message
+                    if message.address == POSITION_ADDRESS and len(message.params) == 2:
+                        target = ports.get(message.params[0])
+                        if target is not None:
+                            self.positions[target] = (float(message.params[1]), received)
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            self._listener = threading.Thread(target=self._listen, daemon=True)
+            self._listener.start()
+
+    def stop(self):
+        """Stop the sender and listener, send what is still queued and close the socket. Not restartable."""
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._listener:
+            self._socket.sendto(b"", (self.host, self.reply_port))  # Wake the blocking receive
+            self._listener.join()
+            self._listener = None
+        if self._socket.fileno() != -1:
+            self.flush()
+            self._socket.close()
+
+    def measure_latency(self, count=100, timeout=1.0):
+        """Measure bundle round-trip time in milliseconds against a LoopbackEcho."""
+        echo = LoopbackEcho(self.host)
+        samples = []
+        lost = 0
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.bind((self.host, 0))
+            s.settimeout(timeout)
+            for sequence in range(count):
+                sent = time.perf_counter()
+                s.sendto(self._build_bundle([_message(PING_ADDRESS, sequence)]).dgram, (self.host, echo.port))
+                try:
+                    data, _ = s.recvfrom(65536)
+                except socket.timeout:
+                    lost += 1
+                    continue
+                packet = OscPacket(data)
+                if packet.messages[0].message.params[0] == sequence:
+                    samples.append((time.perf_counter() - sent) * 1000.0)
+                else:
+                    lost += 1  # A late reply to an earlier ping
+        echo.close()
+
+        if not samples:
+            return {"count": 0, "lost": lost}
+        samples.sort()
+        return {
+            "count": len(samples),
+            "lost": lost,
+            "min_ms": samples[0],
+            "median_ms": statistics.median(samples),
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "max_ms": samples[-1],
+        }
@@ -0,0 +1,302 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from logger import logger
+from transport import SAMPLE_RATE, BLOCK_SIZE, CHANNELS
+
+MASTER = "master"
+
+
+def load_audio(file_path, sample_rate=SAMPLE_RATE):
+    """Decode an audio file into a (channels, frames) float32 array at sample_rate."""
+    from pydub import AudioSegment
+
+    segment = AudioSegment.from_file(file_path).set_frame_rate(sample_rate)
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    samples /= float(1 << (8 * segment.sample_width - 1))
+    return samples.reshape(-1, segment.channels).T
+
+
+def _attach(name, frames):
+    """Attach to a shared float32 (CHANNELS, frames) buffer. Returns (shm, array view).
+
+    Only the render's process owns and unlinks the segments, so workers
+    attach without registering them with the resource tracker.
+    """
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        # Before 3.13 attaching always registers. Unregistering afterwards isn't an option: the
+        # tracker is shared with the parent, which would then fail to unregister on unlink.
+        register = resource_tracker.register
+
+        def register_others(name, rtype):
+            if rtype != "shared_memory":
+                register(name, rtype)
+
+        resource_tracker.register = register_others
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+    return shm, np.ndarray((CHANNELS, frames), dtype=np.float32, buffer=shm.buf)
+
+
+def _render_node(job):
+    """Render one track or bus with its own RenderEngine and write it into shared memory.
+
+    Runs in a worker process. Buses read their already summed input from a
+    second shared buffer instead of receiving it through the pipe.
+    """
+    spec = job["spec"]
+    frames = job["frames"]
+    if spec.get("sampler"):
+        return _render_sampler(job)
+
+    import dawdreamer
+
+    engine = dawdreamer.RenderEngine(job["sample_rate"], job["block_size"])
+    engine.set_bpm(job["bpm"])
+
+    graph = []
+    source_shm = None
+    if job.get("input"):
+        source_shm, source = _attach(job["input"], frames)
+        graph.append((engine.make_playback_processor("input", np.ascontiguousarray(source)), []))
+    elif spec.get("audio"):
+        graph.append((engine.make_playback_processor("audio", load_audio(spec["audio"], job["sample_rate"])), []))
+
+    if spec.get("plugin"):
+        plugin = engine.make_plugin_processor("plugin", spec["plugin"])
+        if spec.get("clips"):
+            from sequencer import SequencerTrack
+            from transport import TempoMap
+
+            SequencerTrack.from_json(spec["clips"]).sync(plugin, TempoMap.from_json(job["tempo_map"], job["bpm"]))
+        elif spec.get("midi"):
+            plugin.load_midi(spec["midi"], clear_previous=True, beats=False, all_events=True)
+        graph.append((plugin, [graph[0][0].get_name()] if graph else []))
+
+    out_shm, out = _attach(job["output"], frames)
+    started = time.perf_counter()
+    if graph:
+        engine.load_graph(graph)
+        engine.render(frames / job["sample_rate"])
+        audio = engine.get_audio()[:, :frames]
+        # Mono sources are spread over both channels
+        out[:, :audio.shape[1]] = audio if audio.shape[0] == CHANNELS else audio[:1]
+    elapsed = time.perf_counter() - started
+
+    del out
+    out_shm.close()
+    if source_shm:
+        del source
+        source_shm.close()
+    return job["name"], elapsed
+
+
+def _render_sampler(job):
+    """Render a track played by the built-in sampler, which needs no plugin host."""
+    from sampler import sampler_from_spec, render_clips
+    from sequencer import SequencerTrack
+    from transport import TempoMap
+
+    spec = job["spec"]
+    sampler = sampler_from_spec(spec["sampler"], job["sample_rate"])
+    clips = SequencerTrack.from_json(spec.get("clips", [])).clips
+    out_shm, out = _attach(job["output"], job["frames"])
+    started = time.perf_counter()
+    out[:] = render_clips(sampler, clips, TempoMap.from_json(job["tempo_map"], job["bpm"]), job["frames"],
+                          job["block_size"])
+    elapsed = time.perf_counter() - started
+    del out
+    out_shm.close()
+    return job["name"], elapsed
+
+
+class RenderPlan:
+    """Dependency graph of tracks and buses for a parallel offline render.
+
+    tracks: [{"name", "audio" or "plugin" (+ "midi" file or "clips") or "sampler" zones + "clips", "gain", "output",
+              "sends": [{"bus", "gain"}]}]
+    buses:  [{"name", optional "plugin", "gain", "output"}]
+
+    Every node writes into its own shared float32 buffer. Tracks have no
+    dependencies and render concurrently; a bus is summed (and, if it has an
+    effect plugin, rendered) once all of its inputs are finished.
+    """
+
+    def __init__(self, tracks, buses=(), duration=10.0, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE, bpm=120,
+                 tempo_map=None):
+        self.tracks = {track["name"]: track for track in tracks}
+        self.buses = {bus["name"]: bus for bus in buses}
+        self.frames = int(duration * sample_rate)
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.bpm = bpm
+        self.tempo_map = tempo_map  # TempoMap.to_json() data, used for MIDI clips
+        # destination -> [(source, gain)]
+        self.inputs = {name: [] for name in list(self.buses) + [MASTER]}
+        for name, node in list(self.tracks.items()) + list(self.buses.items()):
+            routes = [(node.get("output", MASTER), node.get("gain", 1.0))]
+            routes += [(send["bus"], send.get("gain", 1.0)) for send in node.get("sends", [])]
+            for destination, gain in routes:
+                if destination not in self.inputs:
+                    raise ValueError(f"'{name}' is routed to unknown bus '{destination}'")
+                self.inputs[destination].append((name, gain))
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Bus routing loop through '{name}'")
+            visiting.add(name)
+            for source, _ in self.inputs.get(name, []):
+                visit(source)
+            visiting.discard(name)
+            done.add(name)
+
+        visit(MASTER)
+        for name in self.buses:
+            visit(name)
+
+    def _job(self, name, output, input_name=None):
+        spec = self.tracks.get(name) or self.buses.get(name, {})
+        return {"name": name, "spec": spec, "frames": self.frames, "sample_rate": self.sample_rate,
+                "block_size": self.block_size, "bpm": self.bpm, "tempo_map": self.tempo_map, "output": output,
+                "input": input_name}
+
+    def render(self, workers=None):
+        """Render the plan and return the (CHANNELS, frames) master mix."""
+        buffers = {}
+        views = {}
+        nbytes = CHANNELS * self.frames * np.dtype(np.float32).itemsize
+
+        def allocate(key):
+            shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+            buffers[key] = shm
+            views[key] = np.ndarray((CHANNELS, self.frames), dtype=np.float32, buffer=shm.buf)
+            views[key].fill(0.0)
+            return shm.name
+
+        scratch = np.empty((CHANNELS, self.frames), dtype=np.float32)
+
+        def mix_inputs(destination, into):
+            for source, gain in self.inputs[destination]:
+                if gain == 1.0:
+                    np.add(into, views[source], out=into)
+                else:
+                    np.multiply(views[source], gain, out=scratch)
+                    np.add(into, scratch, out=into)
+
+        try:
+            for name in list(self.tracks) + list(self.buses):
+                allocate(name)
+            allocate(MASTER)
+
+            finished = set()
+            pending_buses = set(self.buses)
+            render_times = {}
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                running = {executor.submit(_render_node, self._job(name, buffers[name].name)) for name in self.tracks}
+                while running or pending_buses:
+                    ready = [name for name in pending_buses
+                             if all(source in finished for source, _ in self.inputs[name])]
+                    for name in ready:
+                        pending_buses.discard(name)
+                        if self.buses[name].get("plugin"):
+                            input_key = f"{name}:input"
+                            allocate(input_key)
+                            mix_inputs(name, views[input_key])
+                            running.add(executor.submit(
+                                _render_node, self._job(name, buffers[name].name, buffers[input_key].name)))
+                        else:
+                            mix_inputs(name, views[name])
+                            finished.add(name)
+                    if ready and not running:
+                        continue
+                    if not running:
+                        break
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name, elapsed = future.result()
+                        render_times[name] = elapsed
+                        finished.add(name)
+
+            mix_inputs(MASTER, views[MASTER])
+            logger.debug(f"Node render times: {render_times}")
+            return views[MASTER].copy()
+        finally:
+            views.clear()
+            for shm in buffers.values():
+                shm.close()
+                shm.unlink()
+
+
+def benchmark(plan, max_workers=None):
+    """Render the plan with 1..max_workers processes and report the speedup over one worker."""
+    max_workers = max_workers or os.cpu_count() or 1
+    results = []
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        started = time.perf_counter()
+        plan.render(workers)
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        results.append({"workers": workers, "seconds": elapsed, "speedup": baseline / elapsed})
+        logger.info(f"{workers} worker(s): {elapsed:.2f} s, speedup {baseline / elapsed:.2f}x")
+    return results
+
+
+def plan_from_manifest(manifest_path, duration):
+    """Build a RenderPlan from a workspace manifest's "tracks" and optional "buses"."""
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    workspace_path = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(node):
+        node = dict(node)
+        for key in ("audio", "midi", "plugin"):
+            if node.get(key):
+                node[key] = os.path.join(workspace_path, node[key])
+        return node
+
+    return RenderPlan([resolve(track) for track in manifest.get("tracks", [])],
+                      [resolve(bus) for bus in manifest.get("buses", [])],
+                      duration, bpm=manifest.get("tempo", 120), tempo_map=manifest.get("tempo_map"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a workspace on several cores.")
+    parser.add_argument("manifest", help="Path to the workspace manifest.json")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to render")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--benchmark", action="store_true", help="Report speedup for 1..workers processes")
+    parser.add_argument("--output", help="Write the master mix to this WAV file")
+    args = parser.parse_args()
+
+    plan = plan_from_manifest(args.manifest, args.duration)
+    if args.benchmark:
+        for result in benchmark(plan, args.workers):
+            print(f"{result['workers']:>3} workers  {result['seconds']:8.2f} s  {result['speedup']:5.2f}x")
+        sys.exit(0)
+
+    mix = plan.render(args.workers)
+    if args.output:
+        import wave
+
+        pcm = (np.clip(mix.T, -1.0, 1.0) * 32767).astype("<i2")
+        with wave.open(args.output, "wb") as f:
+            f.setnchannels(CHANNELS)
+            f.setsampwidth(2)
+            f.setframerate(plan.sample_rate)
+            f.writeframes(pcm.tobytes())
@@ -0,0 +1,49 @@
+import struct
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def iter_chunks(f):
+    """Yield (chunk_id, offset, size) for every chunk of an open RIFF/WAVE file.
+
+    offset is the position of the chunk payload. Payloads are not read, so this
+    is cheap even for very large files.
+    """
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ValueError("not a RIFF/WAVE file")
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return
+        chunk_id, size = struct.unpack("<4sI", chunk_header)
+        offset = f.tell()
+        yield chunk_id, offset, size
+        # Chunks are word aligned
+        f.seek(offset + size + (size & 1))
+
+
+def read_format(path):
+    """Return the fmt chunk fields and data chunk location of a WAVE file."""
+    with open(path, "rb") as f:
+        fmt = None
+        data = None
+        for chunk_id, offset, size in iter_chunks(f):
+            if chunk_id == b"fmt ":
+                f.seek(offset)
+                format_tag, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", f.read(16))
+                fmt = {
+                    "format_tag": format_tag,
+                    "channels": channels,
+                    "sample_rate": sample_rate,
+                    "block_align": block_align,
+                    "bits_per_sample": bits,
+                }
+            elif chunk_id == b"data":
+                data = (offset, size)
+        if fmt is None or data is None:
+            raise ValueError("missing fmt or data chunk")
+    fmt["data_offset"], fmt["data_size"] = data
+    fmt["frames"] = data[1] // fmt["block_align"] if fmt["block_align"] else 0
+    return fmt
@@ -0,0 +1,565 @@
+import sys
+import time
+import argparse
+import threading
+import subprocess
+from collections import OrderedDict, deque
+import numpy as np
+from logger import logger
+from memory_accounting import default_accountant, MB
+from transport import SAMPLE_RATE, BLOCK_SIZE, CHANNELS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import sounddevice
+except (ImportError, OSError):  # Not installed, or no PortAudio library
+    sounddevice = None
+
+MAX_VOICES = 128
+SAMPLE_CACHE_BUDGET = 256 * MB
+# Blocks rendered ahead of real time for the live output. ffplay pulls FFPLAY_BUFFER_FRAMES at a time,
+# so the lead has to cover that or it plays silence in between
+OUTPUT_LEAD_BLOCKS = 4
+OUTPUT_DEVICE_LATENCY = "low"  # PortAudio latency hint for the callback output
+FFPLAY_BUFFER_FRAMES = 2048  # ffplay's audio callback size at 44.1 kHz: 2 << log2(rate / 30)
+OUTPUT_NICE = -5  # Only applied where the user may raise priority
+OUTPUT_MEMORY_LIMIT = 2048 * MB  # Address space of the ffplay output process
+OUTPUT_CPU_QUOTA = 0.5  # CPUs the ffplay output process may use, it only plays back the mix
+GUARD_FRAMES = 1  # Silence after every sample so interpolation never reads into the next one
+# Kinds of queued sampler events
+EVENT_NOTE_OFF = 0
+EVENT_NOTE_ON = 1
+EVENT_KILL_ALL = 2
+EVENT_RELEASE_ALL = 3
+EVENT_ZONES = 4
+
+_default_sample_cache = None
+_default_sample_cache_lock = threading.Lock()
+
+
+def default_sample_cache():
+    """The process-wide decoded sample cache shared by every sampler."""
+    global _default_sample_cache
+    with _default_sample_cache_lock:
+        if _default_sample_cache is None:
+            _default_sample_cache = SampleCache()
+            default_accountant().register("sampler/sample_cache", _default_sample_cache.memory_footprint,
+                                          budget=SAMPLE_CACHE_BUDGET)
+        return _default_sample_cache
+
+
+def decode(path, sample_rate=SAMPLE_RATE):
+    """Decode an audio file into a contiguous (CHANNELS, frames) float32 array, mono spread to both channels."""
+    from parallel_render import load_audio
+
+    data = load_audio(path, sample_rate)
+    return np.ascontiguousarray(np.broadcast_to(data, (CHANNELS, data.shape[1])) if data.shape[0] == 1
+                                else data[:CHANNELS], dtype=np.float32)
+
+
+class SampleCache:
+    """Decoded samples as (CHANNELS, frames) float32 arrays, keyed by content digest.
+
+    Identical files in different workspaces or library folders share one
+    entry. Least recently used entries are dropped beyond budget bytes.
+    """
+
+    def __init__(self, budget=SAMPLE_CACHE_BUDGET, sample_rate=SAMPLE_RATE):
+        self.budget = budget
+        self.sample_rate = sample_rate
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        from asset_store import default_store
+
+        digest = default_store().digest(path)
+        with self._lock:
+            data = self._entries.get(digest)
+            if data is not None:
+                self._entries.move_to_end(digest)
+                return data
+        data = decode(path, self.sample_rate)
+        with self._lock:
+            if digest not in self._entries:
+                self._entries[digest] = data
+                self._bytes += data.nbytes
+            while self._bytes > self.budget and len(self._entries) > 1:
+                self._bytes -= self._entries.popitem(last=False)[1].nbytes
+        return data
+
+    def memory_footprint(self):
+        return self._bytes, len(self._entries)
+
+
+class Sampler:
+    """Polyphonic sample player rendering whole blocks with NumPy.
+
+    All zones' audio lives in one flat buffer and every voice is a slot in
+    fixed-size arrays, so rendering a block is a handful of vectorized
+    gathers and multiplies over (voices, frames) with no per-voice Python.
+    Note events are queued from any thread and applied at the start of the
+    next block, optionally at a frame offset within it. When every voice is
+    busy the quietest released voice, or else the oldest, is stolen.
+    """
+
+    def __init__(self, max_voices=MAX_VOICES, sample_rate=SAMPLE_RATE, attack=0.002, decay=0.1, sustain=1.0,
+                 release=0.2, tap=None):
+        self.sample_rate = sample_rate
+        self.max_voices = max_voices
+        self.tap = tap  # Optional metering.MeterTap the output is pushed to
+        self.set_envelope(attack, decay, sustain, release)
+        self._events = deque()
+
+        # Zones: flat audio buffer, per zone columns and the key map. Edits build new objects into
+        # _staged and publish them through the event queue, so the render thread swaps them in
+        # between blocks and in order with the notes that use them.
+        self._buffer = np.zeros((CHANNELS, GUARD_FRAMES), dtype=np.float32)
+        self._zones = {name: np.zeros(0, dtype) for name, dtype in (
+            ("offset", np.int64), ("length", np.int64), ("loop_start", np.int64), ("loop_end", np.int64),
+            ("root", np.float64), ("rate", np.float64), ("gain", np.float32))}
+        self._key_zone = np.full(128, -1, dtype=np.int64)
+        self._staged = (self._buffer, self._zones, self._key_zone)
+
+        # Voice pool
+        self.active = np.zeros(max_voices, dtype=bool)
+        self.zone = np.zeros(max_voices, dtype=np.int64)
+        self.pitch = np.zeros(max_voices, dtype=np.int64)
+        self.position = np.zeros(max_voices, dtype=np.float64)
+        self.increment = np.zeros(max_voices, dtype=np.float64)
+        self.gain = np.zeros(max_voices, dtype=np.float32)
+        self.delay = np.zeros(max_voices, dtype=np.int64)  # Frames until the voice starts within the block
+        self.age = np.zeros(max_voices, dtype=np.int64)  # Frames since the voice started
+        self.release_at = np.full(max_voices, -1, dtype=np.int64)  # Age at which release began, -1 while held
+        self.started = np.zeros(max_voices, dtype=np.int64)  # Trigger order, for stealing the oldest
+        self._triggers = 0
+        self.stolen = 0
+
+    def set_envelope(self, attack, decay, sustain, release):
+        """ADSR envelope in seconds (sustain is a level 0-1)."""
+        self.attack = max(int(attack * self.sample_rate), 1)
+        self.decay = max(int(decay * self.sample_rate), 1)
+        self.sustain = float(sustain)
+        self.release = max(int(release * self.sample_rate), 1)
+
+    @staticmethod
+    def _as_stereo(data):
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim == 1:
+            data = data[np.newaxis]
+        if data.shape[0] == 1:
+            data = np.repeat(data, CHANNELS, axis=0)
+        return data[:CHANNELS]
+
+    def _publish(self, buffer, zones, key_zone, rescale=None):
+        self._staged = (buffer, zones, key_zone)
+        self._events.append((0, EVENT_ZONES, 0, (buffer, zones, key_zone, rescale)))
+
+    def add_zone(self, data, root=60, low=0, high=127, loop=None, gain=1.0, sample_rate=None):
+        """Map a (channels, frames) or mono sample to the keys low..high. Returns the zone id.
+
+        loop is an optional (start, end) frame range that repeats while the key is held.
+        """
+        data = self._as_stereo(data)
+        buffer, zones, key_zone = self._staged
+        offset = buffer.shape[1]
+        length = data.shape[1]
+        loop_start, loop_end = loop if loop else (0, 0)
+        if loop and not 0 <= loop_start < loop_end <= length:
+            raise ValueError(f"Loop {loop} outside of the sample's {length} frames")
+
+        zones = {key: np.append(column, value) for (key, column), value in zip(zones.items(), (
+            offset, length, loop_start, loop_end, root, (sample_rate or self.sample_rate) / self.sample_rate, gain))}
+        buffer = np.concatenate((buffer, data, np.zeros((CHANNELS, GUARD_FRAMES), np.float32)), axis=1)
+        zone = len(zones["offset"]) - 1
+        key_zone = key_zone.copy()
+        key_zone[low:high + 1] = zone
+        self._publish(buffer, zones, key_zone)
+        return zone
+
+    def replace_zone(self, zone, data):
+        """Swap the audio of a zone, e.g. for a time-stretched render of it.
+
+        Loop points and the positions of voices playing the zone are scaled
+        with the length, so held notes carry on from the same spot.
+        """
+        data = self._as_stereo(data)
+        buffer, zones, key_zone = self._staged
+        scale = data.shape[1] / max(zones["length"][zone], 1)
+        pieces = [np.zeros((CHANNELS, GUARD_FRAMES), np.float32)]
+        offsets = []
+        for index, (offset, length) in enumerate(zip(zones["offset"], zones["length"])):
+            offsets.append(sum(piece.shape[1] for piece in pieces))
+            pieces += [data if index == zone else buffer[:, offset:offset + length],
+                       np.zeros((CHANNELS, GUARD_FRAMES), np.float32)]
+        zones = {key: column.copy() for key, column in zones.items()}
+        zones["offset"][:] = offsets
+        zones["length"][zone] = data.shape[1]
+        zones["loop_start"][zone] = int(zones["loop_start"][zone] * scale)
+        zones["loop_end"][zone] = min(int(zones["loop_end"][zone] * scale), data.shape[1])
+        self._publish(np.concatenate(pieces, axis=1), zones, key_zone, (zone, scale))
+
+    def map_keys(self, zone, low=0, high=127):
+        """Point the keys low..high at an existing zone."""
+        buffer, zones, key_zone = self._staged
+        key_zone = key_zone.copy()
+        key_zone[low:high + 1] = zone
+        self._publish(buffer, zones, key_zone)
+
+    def load(self, path, **zone_args):
+        """Add a zone from an audio file through the shared sample cache."""
+        return self.add_zone(default_sample_cache().get(path), **zone_args)
+
+    def clear(self):
+        self.all_notes_off(immediate=True)
+        buffer, zones, key_zone = self._staged
+        self._publish(np.zeros((CHANNELS, GUARD_FRAMES), dtype=np.float32),
+                      {key: column[:0] for key, column in zones.items()}, np.full(128, -1, dtype=np.int64))
+
+    def memory_footprint(self):
+        return self._staged[0].nbytes, len(self._staged[1]["offset"])
+
+    def note_on(self, pitch, velocity=100, offset=0):
+        """Start a note at the next block, offset frames into it. Safe to call from any thread."""
+        self._events.append((offset, EVENT_NOTE_ON, pitch, velocity))
+
+    def note_off(self, pitch, offset=0):
+        self._events.append((offset, EVENT_NOTE_OFF, pitch, 0))
+
+    def all_notes_off(self, immediate=False):
+        self._events.append((0, EVENT_KILL_ALL if immediate else EVENT_RELEASE_ALL, 0, 0))
+
+    def _allocate(self):
+        free = np.flatnonzero(~self.active)
+        if len(free):
+            return free[0]
+        self.stolen += 1
+        released = np.flatnonzero(self.release_at >= 0)
+        if len(released):
+            # Furthest into its release is the quietest
+            return released[np.argmax(self.age[released] - self.release_at[released])]
+        return np.argmin(self.started)
+
+    def _apply_events(self):
+        while self._events:
+            offset, kind, pitch, value = self._events.popleft()
+            if kind == EVENT_NOTE_ON:
+                zone = self._key_zone[pitch] if 0 <= pitch < 128 else -1
+                if zone < 0:
+                    continue
+                voice = self._allocate()
+                zones = self._zones
+                self.active[voice] = True
+                self.zone[voice] = zone
+                self.pitch[voice] = pitch
+                self.position[voice] = 0.0
+                self.increment[voice] = 2.0 ** ((pitch - zones["root"][zone]) / 12.0) * zones["rate"][zone]
+                self.gain[voice] = zones["gain"][zone] * value / 127.0
+                self.delay[voice] = offset
+                self.age[voice] = -offset
+                self.release_at[voice] = -1
+                self._triggers += 1
+                self.started[voice] = self._triggers
+            elif kind == EVENT_NOTE_OFF:
+                held = self.active & (self.pitch == pitch) & (self.release_at < 0)
+                self.release_at[held] = self.age[held] + offset
+            elif kind == EVENT_KILL_ALL:
+                self.active[:] = False
+            elif kind == EVENT_RELEASE_ALL:
+                held = self.active & (self.release_at < 0)
+                self.release_at[held] = self.age[held]
+            else:
+                self._buffer, self._zones, self._key_zone, rescale = value
+                if rescale:
+                    zone, scale = rescale
+                    self.position[self.active & (self.zone == zone)] *= scale
+
+    def _envelope(self, age):
+        """Attack/decay/sustain level at the given ages (before any release)."""
+        # The attack ramp is below the decay line until the attack ends and above it afterwards
+        decay = 1.0 - (1.0 - self.sustain) / self.decay * (age - self.attack)
+        return np.minimum(age * (1.0 / self.attack), np.maximum(decay, self.sustain))
+
+    def render(self, frames=BLOCK_SIZE):
+        """Render the next block as a (CHANNELS, frames) float32 array."""
+        self._apply_events()
+        out = np.zeros((CHANNELS, frames), dtype=np.float32)
+        voices = np.flatnonzero(self.active)
+        if len(voices):
+            self._render_voices(voices, frames, out)
+        if self.tap is not None:
+            self.tap.push(out)
+        return out
+
+    def _render_voices(self, voices, frames, out):
+        buffer, zones = self._buffer, self._zones
+        zone = self.zone[voices]
+        offset, length = zones["offset"][zone], zones["length"][zone]
+        loop_start, loop_end = zones["loop_start"][zone], zones["loop_end"][zone]
+        looping = loop_end > loop_start
+
+        # (voices, frames) grids of sample position and voice age
+        t = np.arange(frames)
+        started = t[np.newaxis] - self.delay[voices, np.newaxis]
+        running = np.maximum(started, 0)
+        position = self.position[voices, np.newaxis] + self.increment[voices, np.newaxis] * running
+        index = position.astype(np.int64)
+        next_index = index + 1
+        # Only voices whose loop end falls inside this block need wrapping
+        wrapping = np.flatnonzero(looping & (position[:, -1] + 1 >= loop_end))
+        if len(wrapping):
+            start, end = loop_start[wrapping, np.newaxis], loop_end[wrapping, np.newaxis]
+            rows = position[wrapping]
+            rows = np.where(rows >= end, start + (rows - start) % (end - start), rows)
+            position[wrapping] = rows
+            index[wrapping] = rows.astype(np.int64)
+            following = index[wrapping] + 1
+            next_index[wrapping] = np.where(following >= end, start, following)
+
+        fraction = (position - index).astype(np.float32)
+        playing = (started >= 0) & (index < length[:, np.newaxis])
+        index = np.minimum(index, length[:, np.newaxis]) + offset[:, np.newaxis]
+        next_index = np.minimum(next_index, length[:, np.newaxis]) + offset[:, np.newaxis]
+
+        # Envelope
+        age = (self.age[voices, np.newaxis] + t[np.newaxis]).astype(np.float32)
+        release_at = self.release_at[voices]
+        envelope = self._envelope(age)
+        released = release_at >= 0
+        if released.any():
+            release_level = self._envelope(np.maximum(release_at, 0))[:, np.newaxis]
+            since_release = age - release_at[:, np.newaxis]
+            fade = release_level * np.maximum(0.0, 1.0 - since_release / self.release)
+            envelope = np.where(released[:, np.newaxis] & (since_release >= 0), fade, envelope)
+        weight = (envelope * playing).astype(np.float32) * self.gain[voices, np.newaxis]
+
+        for channel in range(CHANNELS):
+            current = buffer[channel].take(index)
+            following = buffer[channel].take(next_index)
+            out[channel] = np.einsum("vf,vf->f", current + fraction * (following - current), weight)
+
+        # Advance the voices past this block and free the finished ones
+        advanced = np.maximum(frames - self.delay[voices], 0)
+        new_position = self.position[voices] + self.increment[voices] * advanced
+        new_position = np.where(looping & (new_position >= loop_end),
+                                loop_start + (new_position - loop_start) % np.maximum(loop_end - loop_start, 1),
+                                new_position)
+        self.position[voices] = new_position
+        self.age[voices] += frames
+        self.delay[voices] = np.maximum(self.delay[voices] - frames, 0)
+        finished = (~looping & (new_position >= length)) | (released & (self.age[voices] - release_at >= self.release))
+        self.active[voices[finished]] = False
+
+
+class SamplerOutput:
+    """Plays samplers live, mixing every added sampler (e.g. one per open workspace) into one stream.
+
+    With sounddevice installed the mix is rendered in PortAudio's callback,
+    one BLOCK_SIZE block at a time, so a note is heard one block after it
+    is played plus the device's own buffer. Otherwise a thread writes raw
+    PCM to one long-running ffplay, paced by the clock and at most
+    OUTPUT_LEAD_BLOCKS ahead: the lead plus ffplay's own buffer, about
+    90 ms at the defaults, however many notes are played. The pipe is
+    shrunk to the lead so a stalled ffplay can't queue more.
+    """
+
+    def __init__(self, supervisor, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE):
+        self.supervisor = supervisor
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.samplers = ()
+        self.use_device = sounddevice is not None  # Callback output; False plays through ffplay instead
+        self.handle = None  # Supervisor handle of ffplay while playing through it
+        self.xruns = 0  # Blocks that were rendered late
+        self._stream = None
+        self._running = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def latency(self):
+        """Seconds from note_on to the note leaving the callback or ffplay, not counting the audio device itself."""
+        if self._stream is not None:
+            return self.block_size / self.sample_rate
+        return (OUTPUT_LEAD_BLOCKS * self.block_size + FFPLAY_BUFFER_FRAMES) / self.sample_rate
+
+    def add(self, sampler):
+        # Replace the tuple rather than mutate it, the render thread may be iterating the old one
+        self.samplers = self.samplers + (sampler,)
+
+    def remove(self, sampler):
+        self.samplers = tuple(other for other in self.samplers if other is not sampler)
+        if not self.samplers:
+            self.stop()
+
+    def _mix(self, frames):
+        block = np.zeros((CHANNELS, frames), dtype=np.float32)
+        for sampler in self.samplers:
+            block += sampler.render(frames)
+        return np.clip(block.T, -1.0, 1.0)
+
+    def start(self):
+        """Start streaming unless already running. Safe to call from any thread, e.g. for every note."""
+        with self._lock:
+            if self._stream is not None or (self._thread and self._thread.is_alive()):
+                return
+            if self.use_device:
+                try:
+                    self._stream = sounddevice.OutputStream(
+                        samplerate=self.sample_rate, blocksize=self.block_size, channels=CHANNELS,
+                        dtype="float32", latency=OUTPUT_DEVICE_LATENCY, callback=self._callback)
+                    self._stream.start()
+                    return
+                except Exception as e:
+                    logger.warning(f"Could not open the audio device, playing samplers through ffplay: {e}")
+                    self._stream = None
+                    self.use_device = False
+            self._start_ffplay()
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.xruns += 1
+        outdata[:] = self._mix(frames)
+
+    def _start_ffplay(self):
+        from supervisor import audio_affinity, priority_allowed
+
+        self.handle = self.supervisor.spawn(
+            ["ffplay", "-nodisp", "-loglevel", "error", "-fflags", "nobuffer", "-f", "s16le",
+             "-ar", str(self.sample_rate), "-ch_layout", "stereo", "-i", "pipe:0"],
+            name="sampler-output",
+            nice=OUTPUT_NICE if priority_allowed(OUTPUT_NICE) else None,
+            affinity=audio_affinity(),
+            memory_limit=OUTPUT_MEMORY_LIMIT,
+            cpu_quota=OUTPUT_CPU_QUOTA,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        self._shrink_pipe()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _shrink_pipe(self):
+        """Limit the pipe to the lead, the default 64 KiB would hold several hundred ms of audio."""
+        if fcntl is None or not hasattr(fcntl, "F_SETPIPE_SZ"):
+            return
+        child = self.supervisor.get(self.handle)
+        try:
+            fcntl.fcntl(child.process.stdin.fileno(), fcntl.F_SETPIPE_SZ,
+                        OUTPUT_LEAD_BLOCKS * self.block_size * CHANNELS * 2)
+        except OSError as e:
+            logger.debug(f"Could not shrink the sampler output pipe: {e}")
+
+    def _run(self):
+        child = self.supervisor.get(self.handle)
+        block_seconds = self.block_size / self.sample_rate
+        started = time.monotonic()
+        blocks = 0
+        while self._running and child is not None and child.running():
+            ahead = blocks * block_seconds - (time.monotonic() - started)
+            if ahead > OUTPUT_LEAD_BLOCKS * block_seconds:
+                time.sleep(ahead - OUTPUT_LEAD_BLOCKS * block_seconds)
+            elif ahead < 0:
+                self.xruns += 1
+                # Fell behind: restart the clock rather than bursting to catch up
+                started, blocks = time.monotonic(), 0
+            pcm = (self._mix(self.block_size) * 32767).astype("<i2")
+            try:
+                child.process.stdin.write(pcm.tobytes())
+            except (BrokenPipeError, ValueError, OSError):
+                break
+            blocks += 1
+        if self._running:
+            logger.warning("Sampler output ended, ffplay exited")
+
+    def stop(self):
+        with self._lock:
+            if self._stream is not None:
+                self._stream.stop()
+                self._stream.close()
+                self._stream = None
+            self._running = False
+            # Stopping ffplay first unblocks a render thread stuck writing to a full pipe
+            if self.handle is not None:
+                self.supervisor.stop(self.handle)
+                self.handle = None
+            if self._thread:
+                self._thread.join()
+                self._thread = None
+
+
+def render_clips(sampler, clips, tempo_map, frames, block_size=BLOCK_SIZE):
+    """Render sequencer clips through a sampler offline. Returns (CHANNELS, frames) float32.
+
+    Note events are placed at their exact frame within each block.
+    """
+    starts, ends, pitches, velocities = [], [], [], []
+    for clip in clips:
+        notes = clip.notes
+        starts.append(tempo_map.beats_to_seconds(clip.to_beats(notes["start"], tempo_map)))
+        ends.append(tempo_map.beats_to_seconds(clip.to_beats(notes["start"] + notes["duration"], tempo_map)))
+        pitches.append(notes["pitch"])
+        velocities.append(notes["velocity"])
+    if clips:
+        on_frames = np.rint(np.concatenate(starts) * sampler.sample_rate).astype(np.int64)
+        off_frames = np.maximum(np.rint(np.concatenate(ends) * sampler.sample_rate).astype(np.int64), on_frames + 1)
+        pitch = np.concatenate(pitches).astype(np.int64)
+        velocity = np.concatenate(velocities).astype(np.int64)
+        # Offs sort before ons at the same frame, so a repeated note retriggers
+        event_frames = np.concatenate((off_frames, on_frames))
+        kinds = np.concatenate((np.zeros(len(off_frames), np.int64), np.ones(len(on_frames), np.int64)))
+        event_pitch = np.concatenate((pitch, pitch))
+        event_velocity = np.concatenate((np.zeros_like(velocity), velocity))
+        order = np.lexsort((kinds, event_frames))
+        events = np.stack((event_frames, kinds, event_pitch, event_velocity), axis=1)[order]
+    else:
+        events = np.zeros((0, 4), np.int64)
+
+    out = np.zeros((CHANNELS, frames), dtype=np.float32)
+    boundaries = np.searchsorted(events[:, 0], np.arange(0, frames + block_size, block_size))
+    for block, start in enumerate(range(0, frames, block_size)):
+        for frame, kind, pitch, velocity in events[boundaries[block]:boundaries[block + 1]].tolist():
+            if kind:
+                sampler.note_on(pitch, velocity, frame - start)
+            else:
+                sampler.note_off(pitch, frame - start)
+        count = min(block_size, frames - start)
+        out[:, start:start + count] = sampler.render(count)
+    return out
+
+
+def sampler_from_spec(zones, sample_rate=SAMPLE_RATE):
+    """Build a sampler from manifest zones: [{"audio", "root", "low", "high", "loop": [start, end], "gain"}]."""
+    sampler = Sampler(sample_rate=sample_rate)
+    for zone in zones:
+        sampler.load(zone["audio"], root=zone.get("root", 60), low=zone.get("low", 0), high=zone.get("high", 127),
+                     loop=tuple(zone["loop"]) if zone.get("loop") else None, gain=zone.get("gain", 1.0))
+    return sampler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the sampler's block rendering.")
+    parser.add_argument("--voices", type=int, default=MAX_VOICES, help="Simultaneous voices to hold")
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    args = parser.parse_args()
+
+    sampler = Sampler(max_voices=args.voices)
+    tone = np.sin(2 * np.pi * 440 * np.arange(SAMPLE_RATE) / SAMPLE_RATE).astype(np.float32)
+    sampler.add_zone(tone, root=69, loop=(0, SAMPLE_RATE // 2))
+    for voice in range(args.voices):
+        sampler.note_on(36 + voice % 72, 100)
+    started = time.perf_counter()
+    for _ in range(args.blocks):
+        sampler.render(args.block_size)
+    elapsed = (time.perf_counter() - started) / args.blocks
+    budget = args.block_size / SAMPLE_RATE
+    print(f"{int(sampler.active.sum())} voices: {elapsed * 1000:.3f} ms per {args.block_size}-frame block, "
+          f"{elapsed / budget:.0%} of one core in real time")
+    sys.exit(0)
@@ -0,0 +1,363 @@
+import os
+import sys
+import time
+import struct
+import argparse
+import tempfile
+import itertools
+import numpy as np
+from logger import logger
+from transport import TempoMap
+
+PPQ = 960  # Ticks per quarter note in written MIDI files
+NOTE_DTYPE = np.dtype([("start", "f8"), ("duration", "f8"), ("pitch", "u1"), ("velocity", "u1"), ("channel", "u1")])
+CC_DTYPE = np.dtype([("time", "f8"), ("controller", "u1"), ("value", "u1"), ("channel", "u1")])
+# Appending at most this many notes to an already loaded clip is sent note by note, more reloads the track
+INCREMENTAL_LIMIT = 64
+
+# Sort order of simultaneous events: note offs first so a repeated note is not cut short, then CCs, then note ons
+ORDER_NOTE_OFF, ORDER_CC, ORDER_NOTE_ON = 0, 1, 2
+
+_clip_ids = itertools.count()
+
+
+def _as_records(values, dtype):
+    """Structured array from an existing one or a sequence of tuples/lists (missing trailing fields are 0)."""
+    if isinstance(values, np.ndarray) and values.dtype == dtype:
+        return values.copy()
+    records = np.zeros(len(values), dtype=dtype)
+    for column, name in enumerate(dtype.names):
+        column_values = [row[column] if column < len(row) else 0 for row in values]
+        records[name] = column_values
+    return records
+
+
+class MidiClip:
+    """A region of notes and controller changes on a track, held as NumPy structured arrays.
+
+    Times are relative to the clip start and in beats, or in seconds when
+    beats is False. Every edit bumps version so encoded data can be cached
+    per clip and only edited clips are re-encoded. Caches key clips by uid,
+    which unlike id() is never reused by a later clip.
+    """
+
+    def __init__(self, notes=(), ccs=(), start=0.0, beats=True, name=""):
+        self.name = name
+        self.start = float(start)
+        self.beats = beats
+        self.notes = _as_records(notes, NOTE_DTYPE)
+        self.ccs = _as_records(ccs, CC_DTYPE)
+        self.uid = next(_clip_ids)
+        self.version = 0
+        self._appended_from = None  # (version before the appends, first appended note index)
+
+    @classmethod
+    def from_arrays(cls, start, duration, pitch, velocity, channel=0, **kwargs):
+        notes = np.zeros(len(start), dtype=NOTE_DTYPE)
+        notes["start"], notes["duration"], notes["pitch"], notes["velocity"], notes["channel"] = \
+            start, duration, pitch, velocity, channel
+        return cls(notes, **kwargs)
+
+    def _edited(self):
+        self.version += 1
+        self._appended_from = None
+
+    def set_notes(self, notes):
+        self.notes = _as_records(notes, NOTE_DTYPE)
+        self._edited()
+
+    def add_notes(self, notes):
+        """Append notes. A track can send just these to an already loaded plugin."""
+        appended_from = self._appended_from or (self.version, len(self.notes))
+        self.notes = np.concatenate((self.notes, _as_records(notes, NOTE_DTYPE)))
+        self.version += 1
+        self._appended_from = appended_from
+
+    def remove_notes(self, mask):
+        """Remove the notes where the boolean mask is True."""
+        self.notes = self.notes[~np.asarray(mask, dtype=bool)]
+        self._edited()
+
+    def set_ccs(self, ccs):
+        self.ccs = _as_records(ccs, CC_DTYPE)
+        self._edited()
+
+    def move(self, start):
+        self.start = float(start)
+        self._edited()
+
+    def appended_since(self, version):
+        """Notes appended since version, or None if anything else changed since then."""
+        if self.version == version:
+            return self.notes[:0]
+        if self._appended_from and self._appended_from[0] == version:
+            return self.notes[self._appended_from[1]:]
+        return None
+
+    def to_beats(self, times, tempo_map):
+        """Absolute beats of clip-relative times."""
+        times = np.asarray(times, dtype=np.float64) + self.start
+        return times if self.beats else tempo_map.seconds_to_beats(times)
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "start": self.start,
+            "beats": self.beats,
+            "notes": [list(note) for note in self.notes.tolist()],
+            "ccs": [list(cc) for cc in self.ccs.tolist()],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get("notes", []), data.get("ccs", []), data.get("start", 0.0), data.get("beats", True),
+                   data.get("name", ""))
+
+
+def encode_clip(clip, tempo_map, ppq=PPQ):
+    """Encode a clip into (ticks, order, messages) arrays of 3-byte channel messages."""
+    notes = clip.notes
+    note_on_ticks = np.rint(clip.to_beats(notes["start"], tempo_map) * ppq).astype(np.int64)
+    note_off_ticks = np.rint(clip.to_beats(notes["start"] + notes["duration"], tempo_map) * ppq).astype(np.int64)
+    # Zero length notes would have their off sorted before their on
+    note_off_ticks = np.maximum(note_off_ticks, note_on_ticks + 1)
+    channels = notes["channel"] & 0x0F
+
+    ccs = clip.ccs
+    cc_ticks = np.rint(clip.to_beats(ccs["time"], tempo_map) * ppq).astype(np.int64)
+
+    n, c = len(notes), len(ccs)
+    messages = np.empty((2 * n + c, 3), dtype=np.uint8)
+    messages[:n, 0] = 0x90 | channels
+    messages[:n, 1] = notes["pitch"] & 0x7F
+    messages[:n, 2] = np.clip(notes["velocity"], 1, 127)  # Velocity 0 would mean note off
+    messages[n:2 * n, 0] = 0x80 | channels
+    messages[n:2 * n, 1] = notes["pitch"] & 0x7F
+    messages[n:2 * n, 2] = 0
+    messages[2 * n:, 0] = 0xB0 | (ccs["channel"] & 0x0F)
+    messages[2 * n:, 1] = ccs["controller"] & 0x7F
+    messages[2 * n:, 2] = ccs["value"] & 0x7F
+
+    ticks = np.concatenate((note_on_ticks, note_off_ticks, cc_ticks))
+    order = np.concatenate((np.full(n, ORDER_NOTE_ON, np.uint8), np.full(n, ORDER_NOTE_OFF, np.uint8),
+                            np.full(c, ORDER_CC, np.uint8)))
+    return np.maximum(ticks, 0), order, messages
+
+
+def _vlq_lengths(values):
+    return 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+
+
+def encode_track_chunk(ticks, messages):
+    """An MTrk chunk of 3-byte messages at absolute ticks (already sorted), delta times VLQ encoded with NumPy."""
+    deltas = np.diff(ticks, prepend=0).astype(np.int64)
+    if len(deltas) and deltas.max() >= 1 << 28:
+        raise ValueError("MIDI event delta too large")
+    lengths = _vlq_lengths(deltas)
+    sizes = lengths + messages.shape[1]
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+    body = np.zeros(int(sizes.sum()) + 4, dtype=np.uint8)
+
+    # Delta time bytes, most significant group first, continuation bit on all but the last
+    for k in range(4):
+        has_byte = lengths > k
+        shift = 7 * (lengths[has_byte] - 1 - k)
+        byte = (deltas[has_byte] >> shift) & 0x7F
+        byte |= np.where(k < lengths[has_byte] - 1, 0x80, 0)
+        body[offsets[has_byte] + k] = byte
+    for column in range(messages.shape[1]):
+        body[offsets + lengths + column] = messages[:, column]
+    body[-4:] = (0x00, 0xFF, 0x2F, 0x00)  # End of track
+    return b"MTrk" + struct.pack(">I", len(body)) + body.tobytes()
+
+
+def _vlq(value):
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def encode_tempo_chunk(tempo_map, ppq=PPQ):
+    """An MTrk chunk with the tempo map's tempo and time signature changes."""
+    events = []
+    for beat, bpm in tempo_map.tempo_changes():
+        events.append((round(beat * ppq), b"\xFF\x51\x03" + struct.pack(">I", round(60_000_000 / bpm))[1:]))
+    for beat, numerator, denominator in tempo_map.time_signatures():
+        events.append((round(beat * ppq), b"\xFF\x58\x04" + bytes((numerator, denominator.bit_length() - 1, 24, 8))))
+    events.sort(key=lambda event: event[0])
+    body, last = b"", 0
+    for tick, data in events:
+        body += _vlq(tick - last) + data
+        last = tick
+    body += b"\x00\xFF\x2F\x00"
+    return b"MTrk" + struct.pack(">I", len(body)) + body
+
+
+class SequencerTrack:
+    """The MIDI clips of one instrument track and their delivery to a DAWDreamer plugin processor.
+
+    Each clip's encoded events are cached by its version (and the tempo map
+    version for seconds-based clips), so an edit re-encodes only that clip.
+    The track is written as one MIDI file with the tempo map in its first
+    chunk and loaded with a single load_midi call. Notes merely appended
+    since the last sync are sent individually instead of reloading.
+    """
+
+    def __init__(self, clips=(), name=""):
+        self.name = name
+        self.clips = list(clips)
+        self._encoded = {}  # clip uid -> (cache key, encoded arrays)
+        self._synced = None  # (plugin, tempo map version, {clip uid: version}, beats) of the last sync
+
+    @classmethod
+    def from_json(cls, clips, name=""):
+        return cls([MidiClip.from_json(clip) for clip in clips], name)
+
+    def add_clip(self, clip):
+        self.clips.append(clip)
+        return clip
+
+    def remove_clip(self, clip):
+        self.clips.remove(clip)
+        self._encoded.pop(clip.uid, None)
+
+    def _encode_clip(self, clip, tempo_map):
+        key = (clip.version, None if clip.beats else tempo_map.version)
+        cached = self._encoded.get(clip.uid)
+        if cached and cached[0] == key:
+            return cached[1]
+        encoded = encode_clip(clip, tempo_map)
+        self._encoded[clip.uid] = (key, encoded)
+        return encoded
+
+    def events(self, tempo_map):
+        """All clips' events merged and sorted: (ticks, messages)."""
+        encoded = [self._encode_clip(clip, tempo_map) for clip in self.clips]
+        if not encoded:
+            return np.zeros(0, np.int64), np.zeros((0, 3), np.uint8)
+        ticks = np.concatenate([e[0] for e in encoded])
+        order = np.concatenate([e[1] for e in encoded])
+        messages = np.concatenate([e[2] for e in encoded])
+        sort = np.lexsort((order, ticks))
+        return ticks[sort], messages[sort]
+
+    def to_midi_bytes(self, tempo_map):
+        """The whole track as a format 1 standard MIDI file."""
+        ticks, messages = self.events(tempo_map)
+        header = b"MThd" + struct.pack(">IHHH", 6, 1, 2, PPQ)
+        return header + encode_tempo_chunk(tempo_map) + encode_track_chunk(ticks, messages)
+
+    def write_midi(self, path, tempo_map):
+        with open(path, "wb") as f:
+            f.write(self.to_midi_bytes(tempo_map))
+
+    def sync(self, plugin, tempo_map, beats=False):
+        """Bring a DAWDreamer plugin processor's MIDI up to date with the clips. Returns the notes sent.
+
+        With beats=False (the default) the file's tempo chunk places events
+        in seconds according to tempo_map. With beats=True DAWDreamer places
+        them by beat at the engine's tempo. Only the plugin synced last is
+        tracked, syncing another one loads it in full.
+        """
+        versions = {clip.uid: clip.version for clip in self.clips}
+        # The plugin itself is kept, an id() could be reused by another processor after this one is gone
+        previous = self._synced
+        if previous and previous[0] is plugin and previous[1] == tempo_map.version and previous[3] == beats \
+                and previous[2].keys() == versions.keys():
+            appended = [clip.appended_since(previous[2][clip.uid]) for clip in self.clips]
+            if all(notes is not None for notes in appended) \
+                    and sum(len(notes) for notes in appended) <= INCREMENTAL_LIMIT:
+                sent = 0
+                for clip, notes in zip(self.clips, appended):
+                    sent += self._add_notes(plugin, clip, notes, tempo_map, beats)
+                self._synced = (plugin, tempo_map.version, versions, beats)
+                return sent
+
+        fd, path = tempfile.mkstemp(suffix=".mid", prefix="pydaw-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.to_midi_bytes(tempo_map))
+            plugin.load_midi(path, clear_previous=True, beats=beats, all_events=True)
+        finally:
+            os.remove(path)
+        self._synced = (plugin, tempo_map.version, versions, beats)
+        return sum(len(clip.notes) for clip in self.clips)
+
+    @staticmethod
+    def _add_notes(plugin, clip, notes, tempo_map, beats):
+        starts = clip.to_beats(notes["start"], tempo_map)
+        ends = clip.to_beats(notes["start"] + notes["duration"], tempo_map)
+        if not beats:
+            starts, ends = tempo_map.beats_to_seconds(starts), tempo_map.beats_to_seconds(ends)
+        for note, start, end in zip(notes.tolist(), starts.tolist(), ends.tolist()):
+            plugin.add_midi_note(note[2], max(note[3], 1), start, end - start, beats=beats)
+        return len(notes)
+
+
+def clip_from_midi_file(path, track=None):
+    """Read notes and controller changes of a MIDI file into a beat-based clip (requires mido)."""
+    import mido
+
+    midi = mido.MidiFile(path)
+    notes, ccs, held = [], [], {}
+    tracks = midi.tracks if track is None else [midi.tracks[track]]
+    for midi_track in tracks:
+        tick = 0
+        for message in midi_track:
+            tick += message.time
+            beat = tick / midi.ticks_per_beat
+            if message.type == "note_on" and message.velocity:
+                held[(message.channel, message.note)] = (beat, message.velocity)
+            elif message.type in ("note_off", "note_on"):
+                started = held.pop((message.channel, message.note), None)
+                if started:
+                    notes.append((started[0], beat - started[0], message.note, started[1], message.channel))
+            elif message.type == "control_change":
+                ccs.append((beat, message.control, message.value, message.channel))
+    return MidiClip(notes, ccs, name=os.path.basename(path))
+
+
+def random_clip(count, seed=0):
+    """A dense clip of random notes, for benchmarks."""
+    rng = np.random.default_rng(seed)
+    starts = np.sort(rng.uniform(0, count / 8, count))
+    return MidiClip.from_arrays(starts, rng.uniform(0.05, 1.0, count), rng.integers(36, 96, count),
+                                rng.integers(40, 127, count), name=f"random-{count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encode MIDI clips and optionally render them through a plugin.")
+    parser.add_argument("--notes", type=int, default=10000, help="Random notes to generate")
+    parser.add_argument("--bpm", type=float, default=120.0)
+    parser.add_argument("--output", help="Write the encoded MIDI file here")
+    parser.add_argument("--plugin", help="Render through this instrument plugin with DAWDreamer")
+    args = parser.parse_args()
+
+    tempo_map = TempoMap(args.bpm)
+    sequencer_track = SequencerTrack([random_clip(args.notes)])
+    started = time.perf_counter()
+    data = sequencer_track.to_midi_bytes(tempo_map)
+    logger.info(f"Encoded {args.notes} notes into {len(data)} bytes in {(time.perf_counter() - started) * 1000:.1f} ms")
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(data)
+    if args.plugin:
+        import dawdreamer
+        from transport import SAMPLE_RATE, BLOCK_SIZE
+
+        engine = dawdreamer.RenderEngine(SAMPLE_RATE, BLOCK_SIZE)
+        engine.set_bpm(args.bpm)
+        plugin = engine.make_plugin_processor("instrument", args.plugin)
+        started = time.perf_counter()
+        sequencer_track.sync(plugin, tempo_map)
+        loaded = time.perf_counter() - started
+        engine.load_graph([(plugin, [])])
+        duration = tempo_map.beat_to_seconds(float(sequencer_track.clips[0].notes["start"].max()) + 1)
+        started = time.perf_counter()
+        engine.render(duration)
+        logger.info(f"Loaded notes in {loaded * 1000:.1f} ms, rendered {duration:.0f} s in "
+                    f"{time.perf_counter() - started:.2f} s")
+    sys.exit(0)
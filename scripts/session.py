@@ -0,0 +1,168 @@
+import os
+import time
+import threading
+from logger import logger
+from supervisor import ProcessSupervisor
+from osc_bridge import OscControlBridge
+from instrument_index import InstrumentIndex
+from sampler import SamplerOutput
+from timestretch import default_stretcher
+from midi_handler import open_clock_output, open_note_input
+from memory_accounting import default_accountant, MB
+
+GLOBAL_INSTRUMENTS_DIR = "~/pydaw/instruments"
+# Budgets of the shared subsystems in bytes, per-workspace ones are in workspace.MEMORY_BUDGETS
+MEMORY_BUDGETS = {
+    "supervisor": 16 * MB,
+    "instrument_index": 128 * MB,
+}
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def default_session():
+    """The process-wide session every workspace window joins."""
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = Session()
+        return _default_session
+
+
+class Session:
+    """Engine and caches shared by every workspace open in this process.
+
+    One supervisor, OSC control bridge and sampler output serve all
+    workspaces, and a single instrument index covers the global library
+    plus the instruments folder of each open workspace, so opening another
+    workspace only indexes what is new. Project history, transport, the
+    scripts a workspace started and its sampler stay with its window. The
+    DAWDreamer engine, MIDI clock output and MIDI input follow the active
+    workspace only, so two transports never drive them at once.
+    """
+
+    def __init__(self, global_instruments_dir=GLOBAL_INSTRUMENTS_DIR):
+        self.global_instruments_dir = os.path.expanduser(global_instruments_dir)
+        self.supervisor = ProcessSupervisor()
+        self.control = OscControlBridge()
+        self.sampler_output = SamplerOutput(self.supervisor)
+        self.windows = []  # Open workspace windows, oldest first
+        self.active_window = None  # The window driving the shared engine, MIDI clock and MIDI input
+        # The index is rebuilt into a new object and swapped in, so windows showing results
+        # from the previous one are never disturbed by another window's rescan
+        self.index = InstrumentIndex()
+        self._library_dirs = []
+        self._index_lock = threading.Lock()
+        self._clock_port = None
+        self._midi_input = None
+        self._midi_opened = False
+        self.register_memory_accounting()
+
+    def register_memory_accounting(self):
+        accountant = default_accountant()
+        sizers = {
+            "supervisor": self.supervisor.memory_footprint,
+            "instrument_index": lambda: self.index.memory_footprint(),
+        }
+        for name, sizer in sizers.items():
+            accountant.register(f"session/{name}", sizer, MEMORY_BUDGETS.get(name))
+
+    def window_for(self, workspace_path):
+        """The open window of a workspace, or None."""
+        for window in self.windows:
+            if os.path.normpath(window.workspace_path) == os.path.normpath(workspace_path):
+                return window
+        return None
+
+    def add_window(self, window):
+        self.windows.append(window)
+        self._open_midi()
+        self.activate(window)
+
+    def remove_window(self, window):
+        if window in self.windows:
+            self.windows.remove(window)
+        if self.active_window is window:
+            self.activate(self.windows[-1] if self.windows else None)
+
+    def activate(self, window):
+        """Hand the shared engine, MIDI clock and OSC timetags over to window's transport."""
+        if window is self.active_window:
+            return
+        previous, self.active_window = self.active_window, window
+        if previous is not None:
+            previous.set_engine_active(False)
+        if window is not None:
+            window.set_engine_active(True)
+        # Control bundles are timetagged against the transport that drives the engine
+        self.control.clock = window.transport.wall_time if window is not None else time.time
+
+    def add_library_dir(self, directory):
+        """Include a workspace's instruments folder in the shared index from the next rebuild on."""
+        self._library_dirs.append(os.path.expanduser(directory))
+
+    def remove_library_dir(self, directory):
+        directory = os.path.expanduser(directory)
+        if directory in self._library_dirs:
+            self._library_dirs.remove(directory)
+
+    def index_roots(self):
+        roots = [("Global", self.global_instruments_dir)]
+        # The same folder open twice is indexed once
+        for directory in dict.fromkeys(self._library_dirs):
+            roots.append(("Workspace", directory))
+        return roots
+
+    def rebuild_index(self):
+        """Index the global library and every open workspace's folder, reusing all metadata extracted so far.
+
+        Runs on whichever worker thread calls it; concurrent calls are serialized.
+        """
+        with self._index_lock:
+            self.index = self.index.build(self.index_roots())
+            return self.index
+
+    def clock_port(self):
+        """The MIDI clock output shared by all transports, or None."""
+        self._open_midi()
+        return self._clock_port
+
+    def _open_midi(self):
+        if self._midi_opened:
+            return
+        self._midi_opened = True
+        self._clock_port = open_clock_output()
+        # MIDI notes play the sampler of the workspace that was active last
+        self._midi_input = open_note_input(self)
+
+    def note_on(self, pitch, velocity=100):
+        window = self.active_window
+        if window is not None:
+            self.sampler_output.start()
+            window.sampler.note_on(pitch, velocity)
+
+    def note_off(self, pitch):
+        window = self.active_window
+        if window is not None:
+            window.sampler.note_off(pitch)
+
+    def shutdown(self):
+        """Stop the shared engine once the last window is gone, the next window starts a new session."""
+        global _default_session
+        self.sampler_output.stop()
+        self.control.stop()
+        self.supervisor.shutdown()
+        default_stretcher().shutdown()
+        default_accountant().unregister("session")
+        for port in (self._midi_input, self._clock_port):
+            if port:
+                try:
+                    port.close()
+                except Exception as e:
+                    logger.warning(f"Error closing MIDI port: {e}")
+        self._clock_port = self._midi_input = None
+        self._midi_opened = False
+        with _default_session_lock:
+            if _default_session is self:
+                _default_session = None
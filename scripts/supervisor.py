@@ -0,0 +1,413 @@
+import os
+import sys
+import math
+import time
+import itertools
+import threading
+import subprocess
+from collections import deque
+from logger import logger
+from memory_accounting import deep_size
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+RESTART_NEVER = "never"
+RESTART_ON_FAILURE = "on-failure"
+RESTART_ALWAYS = "always"
+
+REAP_INTERVAL = 0.2  # Seconds between checks for exited children
+OUTPUT_LINES = 500  # Lines of output kept per child
+CGROUP_ROOT = "/sys/fs/cgroup"
+CGROUP_PERIOD = 100000  # Microseconds, cpu.max quotas are given per period
+
+# psutil raises NoSuchProcess/AccessDenied, which are not OSErrors
+PROCESS_ERRORS = (OSError, ValueError) + ((psutil.Error,) if psutil else ())
+
+
+def audio_affinity():
+    """CPUs for audio children: every core except the first, which is left to the GUI."""
+    count = os.cpu_count() or 1
+    return set(range(1, count)) if count > 1 else None
+
+
+def priority_allowed(nice):
+    """Whether this process may start children at the given nice level.
+
+    Lowering the nice value below our own needs root, CAP_SYS_NICE or a
+    large enough RLIMIT_NICE; raising it is always allowed.
+    """
+    if not hasattr(os, "getpriority"):
+        return nice >= 0
+    if nice >= os.getpriority(os.PRIO_PROCESS, 0) or os.geteuid() == 0:
+        return True
+    if resource is not None and hasattr(resource, "RLIMIT_NICE"):
+        # The soft limit r allows nice values down to 20 - r
+        soft = resource.getrlimit(resource.RLIMIT_NICE)[0]
+        return soft == resource.RLIM_INFINITY or 20 - soft <= nice
+    return False
+
+
+def _own_cgroup():
+    """This process's cgroup v2 directory, or None without a unified hierarchy."""
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return os.path.join(CGROUP_ROOT, line.strip()[3:].lstrip("/"))
+    except OSError:
+        pass
+    return None
+
+
+class ChildProcess:
+    """Bookkeeping for one supervised child process."""
+
+    def __init__(self, handle, name, args, restart, max_restarts, nice, affinity, memory_limit, cpu_quota,
+                 on_exit, popen_kwargs):
+        self.handle = handle
+        self.name = name
+        self.args = args
+        self.restart = restart
+        self.max_restarts = max_restarts
+        self.nice = nice
+        self.affinity = affinity
+        self.memory_limit = memory_limit  # Bytes of address space
+        self.cpu_quota = cpu_quota  # CPUs worth of time the child may use, e.g. 0.5
+        self.cgroup = None  # cgroup directory enforcing cpu_quota, if one could be created
+        self.on_exit = on_exit
+        self.popen_kwargs = popen_kwargs
+        self.process = None
+        self.restarts = 0
+        self.returncode = None
+        self.started_at = None
+        self.stopping = False
+        self.output = deque(maxlen=OUTPUT_LINES)
+        self._last_cpu = None  # (wall time, cpu seconds) of the previous usage sample
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+
+class ProcessSupervisor:
+    """Starts, tracks and reaps child processes such as ChucK scripts and ffplay.
+
+    Children are addressed by an integer handle, so starting the same command
+    twice yields two independent children. A background thread reaps exited
+    children and restarts them according to their restart policy.
+    """
+
+    def __init__(self):
+        self.children = {}
+        self._handles = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = True
+        self._reaper = threading.Thread(target=self._reap_loop, daemon=True)
+        self._reaper.start()
+
+    def spawn(self, args, name=None, restart=RESTART_NEVER, max_restarts=3, nice=None, affinity=None,
+              memory_limit=None, cpu_quota=None, on_exit=None, **popen_kwargs):
+        """Start a supervised child and return its handle.
+
+        cpu_quota caps the share of CPU time (in CPUs) rather than the total,
+        so long-running instruments are throttled, never killed.
+
+        on_exit(child) is called from the reaper thread once the child has exited
+        for good, i.e. after any restarts.
+        If stdout is a pipe its output is drained into child.output so the child
+        can never block on a full pipe.
+        """
+        child = ChildProcess(next(self._handles), name or os.path.basename(args[0]), list(args), restart,
+                             max_restarts, nice, affinity, memory_limit, cpu_quota, on_exit, popen_kwargs)
+        self._start(child)
+        with self._lock:
+            self.children[child.handle] = child
+        return child.handle
+
+    def _start(self, child):
+        kwargs = dict(child.popen_kwargs)
+        if os.name == "posix":
+            # Limits are in place before exec, so the child never runs a single instruction without them
+            kwargs["preexec_fn"] = self._preexec(child, *self._prepare_policy(child), kwargs.get("preexec_fn"))
+        child.process = subprocess.Popen(child.args, **kwargs)
+        child.started_at = time.monotonic()
+        child.returncode = None
+        child._last_cpu = None
+        if os.name == "posix":
+            self._check_cgroup(child)
+        else:
+            self._apply_policy(child)
+        for stream in (child.process.stdout, child.process.stderr):
+            if stream is not None:
+                threading.Thread(target=self._drain, args=(child, stream), daemon=True).start()
+
+    def _drain(self, child, stream):
+        for line in stream:
+            child.output.append(line.rstrip("\n") if isinstance(line, str) else line.rstrip(b"\n"))
+        stream.close()
+
+    def _prepare_policy(self, child):
+        """Work out the (nice, cpus, memory limit) a child can be started with, in the parent."""
+        nice = child.nice
+        if nice is not None and not priority_allowed(nice):
+            logger.warning(f"Not allowed to start {child.name} at priority {nice}")
+            nice = None
+        affinity = child.affinity
+        if child.cpu_quota and not self._cap_cpu(child):
+            # Without a cgroup, cap how many cores the child can run on at once
+            cores = affinity or (os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None)
+            if cores:
+                affinity = set(sorted(cores)[:max(1, math.ceil(child.cpu_quota))])
+        if affinity and not hasattr(os, "sched_setaffinity"):
+            affinity = None
+        memory_limit = child.memory_limit
+        if memory_limit:
+            if resource is None or not hasattr(resource, "RLIMIT_AS"):
+                logger.debug(f"Resource limits are not supported on {sys.platform}")
+                memory_limit = None
+            else:
+                # Children inherit our hard limit and can't go above it
+                hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+                if hard != resource.RLIM_INFINITY:
+                    memory_limit = min(memory_limit, hard)
+        return nice, affinity, memory_limit
+
+    @staticmethod
+    def _preexec(child, nice, affinity, memory_limit, preexec_fn=None):
+        """The function Popen runs in the child between fork and exec to apply its policy."""
+        procs = os.path.join(child.cgroup, "cgroup.procs") if child.cgroup else None
+
+        def apply():
+            # No logging between fork and exec, anything that fails leaves the inherited setting in place
+            if nice is not None:
+                try:
+                    os.setpriority(os.PRIO_PROCESS, 0, nice)
+                except OSError:
+                    pass
+            if affinity:
+                try:
+                    os.sched_setaffinity(0, affinity)
+                except OSError:
+                    pass
+            if memory_limit:
+                try:
+                    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+                except (OSError, ValueError):
+                    pass
+            if procs:
+                try:
+                    fd = os.open(procs, os.O_WRONLY)
+                    try:
+                        os.write(fd, b"0")  # 0 moves the writing process
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+            if preexec_fn:
+                preexec_fn()
+
+        return apply
+
+    def _check_cgroup(self, child):
+        """Move the child into its cgroup from here if it could not join it before exec."""
+        if not child.cgroup:
+            return
+        try:
+            with open(f"/proc/{child.pid}/cgroup") as f:
+                if any(line.strip().endswith("/" + os.path.basename(child.cgroup)) for line in f):
+                    return
+            with open(os.path.join(child.cgroup, "cgroup.procs"), "w") as f:
+                f.write(str(child.pid))
+        except OSError as e:
+            logger.warning(f"Could not move {child.name} into {child.cgroup}, its CPU time is not capped: {e}")
+
+    def _apply_policy(self, child):
+        """Apply priority and CPU affinity to a freshly started child where there is no fork to do it before exec."""
+        if not psutil:
+            return
+        try:
+            process = psutil.Process(child.pid)
+            if child.nice is not None:
+                process.nice(child.nice)
+            if child.affinity and hasattr(process, "cpu_affinity"):
+                process.cpu_affinity(sorted(child.affinity))
+        except PROCESS_ERRORS as e:
+            logger.warning(f"Could not set priority or CPU affinity for {child.name}: {e}")
+
+    def _cap_cpu(self, child):
+        """Create a cgroup v2 with a cpu.max quota for the child to join. Returns False where that isn't allowed."""
+        own = _own_cgroup()
+        if own is None:
+            return False
+        # Next to our own cgroup: a cgroup holding processes can't enable controllers for children.
+        # Only the root may do both
+        own = own.rstrip("/")
+        parent = own if own == CGROUP_ROOT else os.path.dirname(own)
+        path = child.cgroup or os.path.join(parent, f"pydaw-{os.getpid()}-{child.handle}")
+        try:
+            with open(os.path.join(parent, "cgroup.subtree_control")) as f:
+                if "cpu" not in f.read().split():
+                    return False
+            if not os.path.isdir(path):
+                os.mkdir(path)
+            # Open without creating, a missing file means path is not a cgroup after all
+            with open(os.path.join(path, "cpu.max"), "r+") as f:
+                f.write(f"{int(child.cpu_quota * CGROUP_PERIOD)} {CGROUP_PERIOD}")
+        except OSError as e:
+            logger.debug(f"No cgroup for {child.name}, capping its cores instead: {e}")
+            self._remove_cgroup(path)
+            return False
+        child.cgroup = path
+        return True
+
+    @staticmethod
+    def _remove_cgroup(path):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+    def _reap_loop(self):
+        while self._running:
+            self._wakeup.wait(REAP_INTERVAL)
+            self._wakeup.clear()
+            with self._lock:
+                children = list(self.children.values())
+            for child in children:
+                if child.returncode is None and child.process.poll() is not None:
+                    self._handle_exit(child)
+
+    def _handle_exit(self, child):
+        child.returncode = child.process.returncode
+        logger.debug(f"{child.name} (pid {child.pid}) exited with code {child.returncode}")
+        should_restart = not child.stopping and child.restarts < child.max_restarts and (
+            child.restart == RESTART_ALWAYS or (child.restart == RESTART_ON_FAILURE and child.returncode != 0)
+        )
+        if should_restart:
+            child.restarts += 1
+            logger.info(f"Restarting {child.name} ({child.restarts}/{child.max_restarts})")
+            try:
+                self._start(child)
+                return
+            except OSError as e:
+                logger.error(f"Failed to restart {child.name}: {e}")
+
+        with self._lock:
+            self.children.pop(child.handle, None)
+        if child.cgroup:
+            self._remove_cgroup(child.cgroup)
+        if child.on_exit:
+            try:
+                child.on_exit(child)
+            except Exception as e:
+                logger.error(f"Exit callback for {child.name} failed: {e}")
+
+    def stop(self, handle, kill=False, timeout=2.0):
+        """Stop a child. Terminates politely unless kill is set, killing after timeout if needed."""
+        with self._lock:
+            child = self.children.get(handle)
+        if child is None:
+            return False
+        child.stopping = True
+        if child.running():
+            if kill:
+                child.process.kill()
+            else:
+                child.process.terminate()
+            try:
+                child.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                child.process.kill()
+                child.process.wait()
+        self._wakeup.set()
+        return True
+
+    def stop_all(self, kill=False, name=None):
+        for handle in self.handles(name):
+            self.stop(handle, kill=kill)
+
+    def shutdown(self):
+        """Kill every child and stop the reaper thread. The supervisor can't be used afterwards."""
+        self.stop_all(kill=True)
+        self._running = False
+        self._wakeup.set()
+        if self._reaper is not threading.current_thread():
+            self._reaper.join()
+
+    def handles(self, name=None):
+        """Handles of live children, optionally only those with the given name."""
+        with self._lock:
+            return [handle for handle, child in self.children.items() if name is None or child.name == name]
+
+    def get(self, handle):
+        with self._lock:
+            return self.children.get(handle)
+
+    def is_running(self, handle):
+        child = self.get(handle)
+        return child is not None and child.running()
+
+    def usage(self, handle):
+        """Current resource usage of a child: CPU percent since the previous call, RSS bytes, threads."""
+        child = self.get(handle)
+        if child is None or not child.running():
+            return None
+        stats = {"handle": handle, "name": child.name, "pid": child.pid, "restarts": child.restarts,
+                 "uptime": time.monotonic() - child.started_at}
+        try:
+            if psutil:
+                process = psutil.Process(child.pid)
+                times = process.cpu_times()
+                cpu_seconds = times.user + times.system
+                stats["rss"] = process.memory_info().rss
+                stats["threads"] = process.num_threads()
+            elif os.path.exists(f"/proc/{child.pid}/stat"):
+                cpu_seconds, stats["rss"], stats["threads"] = self._proc_stat(child.pid)
+            else:
+                return stats
+        except PROCESS_ERRORS as e:
+            logger.debug(f"Could not read usage for {child.name}: {e}")
+            return stats
+
+        now = time.monotonic()
+        if child._last_cpu:
+            elapsed = now - child._last_cpu[0]
+            stats["cpu_percent"] = 100.0 * (cpu_seconds - child._last_cpu[1]) / elapsed if elapsed > 0 else 0.0
+        child._last_cpu = (now, cpu_seconds)
+        return stats
+
+    def memory_footprint(self):
+        """(bytes, children) of the output kept for every child.
+
+        Measured on copies: children come and go under the lock, and
+        drain threads keep appending output while deep_size walks.
+        """
+        with self._lock:
+            outputs = [child.output.copy() for child in self.children.values()]
+        return deep_size(outputs), len(outputs)
+
+    def usage_all(self):
+        return [stats for stats in (self.usage(handle) for handle in self.handles()) if stats]
+
+    @staticmethod
+    def _proc_stat(pid):
+        """(cpu seconds, rss bytes, threads) from /proc, for Linux without psutil."""
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces, fields are counted after its closing parenthesis
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+        return cpu_seconds, int(fields[21]) * page_size, int(fields[17])
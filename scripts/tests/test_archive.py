@@ -0,0 +1,138 @@
+import io
+import os
+import sys
+import json
+import wave
+import stat
+import hashlib
+import tarfile
+import pytest
+from archive import export_workspace, import_workspace, PAX_PREFIX, BLOBS_PREFIX, CODEC_FLAC
+from asset_store import AssetStore
+from history import BLOB_KEY
+
+# Stands in for ffmpeg: passes PCM through unchanged, which is all the archive relies on
+FAKE_FFMPEG = """#!{python}
+import sys, shutil
+shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)
+"""
+
+
+def write_wav(path, frames=4410):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(bytes(range(256)) * (frames * 4 // 256))
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    root = tmp_path / "workspace"
+    (root / "audio").mkdir(parents=True)
+    (root / "instruments").mkdir()
+    manifest = {"tracks": [{"name": "drums", "audio": "audio/drums.wav"},
+                           {"name": "bass", "audio": "audio/bass.wav"}]}
+    (root / "manifest.json").write_text(json.dumps(manifest))
+    write_wav(str(root / "audio" / "drums.wav"))
+    write_wav(str(root / "audio" / "bass.wav"), 2205)
+    (root / "instruments" / "sine.ck").write_text("SinOsc s => dac; 1::second => now;")
+    (root / "instruments" / "noise.bin").write_bytes(os.urandom(3 * 1024 * 1024))  # Spans several chunks
+    return root
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AssetStore(str(tmp_path / "store"), [])
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    ffmpeg = bin_dir / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+def files(root):
+    return {os.path.relpath(os.path.join(directory, name), root): open(os.path.join(directory, name), "rb").read()
+            for directory, _, names in os.walk(root) for name in names}
+
+
+def test_round_trip(workspace, store, tmp_path):
+    archive = str(tmp_path / "workspace.pydaw")
+    assert export_workspace(str(workspace), archive, workers=2, store=store) == 5
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+    with tarfile.open(archive) as tar:
+        members = tar.getmembers()
+        names = [member.name for member in members]
+        assert names[0] == "manifest.json"
+        for member in members:
+            assert member.size == len(tar.extractfile(member).read())
+            assert int(member.pax_headers[PAX_PREFIX + "size"]) == os.path.getsize(workspace / member.name)
+
+    imported = tmp_path / "imported"
+    assert sorted(import_workspace(archive, str(imported), workers=2, store=store)) == sorted(names)
+    assert files(imported) == files(workspace)
+
+
+def test_wav_data_streams_through_ffmpeg(workspace, store, tmp_path, fake_ffmpeg):
+    archive = str(tmp_path / "workspace.pydaw")
+    export_workspace(str(workspace), archive, workers=2, store=store)
+    with tarfile.open(archive) as tar:
+        codecs = {member.name: member.pax_headers[PAX_PREFIX + "codec"] for member in tar.getmembers()}
+    assert codecs["audio/drums.wav"] == codecs["audio/bass.wav"] == CODEC_FLAC
+
+    imported = tmp_path / "imported"
+    import_workspace(archive, str(imported), workers=2, store=store)
+    assert files(imported) == files(workspace)
+
+
+def test_history_blobs_travel_with_the_manifest(workspace, tmp_path):
+    source = AssetStore(str(tmp_path / "source-store"), [])
+    take, unused = b"recorded take" * 1000, b"another take"
+    for payload in (take, unused):
+        source.put_bytes(hashlib.sha256(payload).hexdigest(), payload)
+    manifest = json.loads((workspace / "manifest.json").read_text())
+    manifest["tracks"][0]["edit"] = {BLOB_KEY: hashlib.sha256(take).hexdigest(), "size": len(take)}
+    manifest["tracks"][1]["edit"] = {BLOB_KEY: hashlib.sha256(unused).hexdigest(), "size": len(unused)}
+    (workspace / "manifest.json").write_text(json.dumps(manifest))
+    archive = str(tmp_path / "workspace.pydaw")
+    assert export_workspace(str(workspace), archive, workers=2, store=source) == 7
+
+    target = AssetStore(str(tmp_path / "target-store"), [])
+    names = import_workspace(archive, str(tmp_path / "imported"), tracks=["drums"], workers=2, store=target)
+    assert BLOBS_PREFIX + hashlib.sha256(take).hexdigest() in names
+    assert target.read_bytes(hashlib.sha256(take).hexdigest()) == take
+    assert not target.has_blob(hashlib.sha256(unused).hexdigest())
+
+
+def test_import_selected_tracks(workspace, store, tmp_path):
+    archive = str(tmp_path / "workspace.pydaw")
+    export_workspace(str(workspace), archive, workers=2, store=store)
+    imported = tmp_path / "imported"
+    import_workspace(archive, str(imported), tracks=["bass"], workers=2, store=store)
+    manifest = json.loads((imported / "manifest.json").read_text())
+    assert [track["name"] for track in manifest["tracks"]] == ["bass"]
+    assert (imported / "audio" / "bass.wav").exists()
+    assert not (imported / "audio" / "drums.wav").exists()
+    assert (imported / "instruments" / "sine.ck").exists()
+
+
+def test_corrupted_entry_is_rejected(workspace, store, tmp_path):
+    archive = str(tmp_path / "workspace.pydaw")
+    export_workspace(str(workspace), archive, workers=2, store=store)
+    with tarfile.open(archive) as tar:
+        members = [(member, tar.extractfile(member).read()) for member in tar.getmembers()]
+    tampered = str(tmp_path / "tampered.pydaw")
+    with tarfile.open(tampered, "w", format=tarfile.PAX_FORMAT) as tar:
+        for member, payload in members:
+            member.pax_headers = dict(member.pax_headers)
+            if member.name == "instruments/sine.ck":
+                member.pax_headers[PAX_PREFIX + "sha256"] = "0" * 64
+            tar.addfile(member, io.BytesIO(payload))
+    with pytest.raises(ValueError, match="Integrity"):
+        import_workspace(tampered, str(tmp_path / "imported"), workers=2, store=store)
+    assert not (tmp_path / "imported" / "instruments" / "sine.ck").exists()
@@ -0,0 +1,106 @@
+import os
+import json
+import stat
+import hashlib
+import pytest
+import asset_store
+from asset_store import AssetStore, ASSETS_FILE, MANIFEST_FILE
+from history import BLOB_KEY
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AssetStore(str(tmp_path / "store"), [str(tmp_path / "workspaces")])
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    path = tmp_path / "workspaces" / "song"
+    (path / "instruments").mkdir(parents=True)
+    return path
+
+
+@pytest.fixture
+def no_reflink(monkeypatch):
+    monkeypatch.setattr(asset_store, "_reflink", lambda src, dst: False)
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_count(store):
+    return sum(len(files) for _, _, files in os.walk(store.blobs_dir))
+
+
+def test_garbage_collection_keeps_every_reachable_blob(store, workspace, tmp_path):
+    kept_by_assets = store.put_bytes(digest(b"sample"), b"sample")
+    kept_by_history = store.put_bytes(digest(b"take"), b"take")
+    kept_by_outside = store.put_bytes(digest(b"outside"), b"outside")
+    linked = store.put_bytes(digest(b"linked"), b"linked")
+    garbage = store.put_bytes(digest(b"garbage"), b"garbage")
+    (workspace / ASSETS_FILE).write_text(json.dumps({"instruments/sample.wav": kept_by_assets}))
+    (workspace / MANIFEST_FILE).write_text(json.dumps({"tracks": [{"edit": {BLOB_KEY: kept_by_history, "size": 4}}]}))
+    # A workspace outside the workspace roots counts once it registered itself
+    outside = tmp_path / "elsewhere"
+    outside.mkdir()
+    store.register_workspace(str(outside))
+    (outside / ASSETS_FILE).write_text(json.dumps({"instruments/x.wav": kept_by_outside}))
+    # Deleting a blob that is still hardlinked somewhere frees nothing
+    os.link(store.blob_path(linked), tmp_path / "linked.wav")
+
+    assert store.collect_garbage(dry_run=True) == (1, len(b"garbage"))
+    assert store.has_blob(garbage)
+    assert store.collect_garbage() == (1, len(b"garbage"))
+    assert not store.has_blob(garbage)
+    assert all(store.has_blob(kept) for kept in (kept_by_assets, kept_by_history, kept_by_outside, linked))
+
+
+def test_dedupe_hardlinks_without_reflink_support(store, workspace, no_reflink):
+    data = os.urandom(4096)
+    first = write(workspace / "instruments" / "a.wav", data)
+    second = write(workspace / "instruments" / "drums" / "b.wav", data)
+
+    assert store.dedupe_workspace(str(workspace)) == len(data)
+    blob = store.blob_path(digest(data))
+    assert os.path.samefile(blob, first) and os.path.samefile(blob, second)
+    assert blob_count(store) == 1
+    assert not os.stat(first).st_mode & stat.S_IWUSR
+    assert store.read_assets(str(workspace)) == {os.path.join("instruments", "a.wav"): digest(data),
+                                                 os.path.join("instruments", "drums", "b.wav"): digest(data)}
+    # A second pass finds nothing left to do
+    assert store.dedupe_workspace(str(workspace)) == 0
+
+
+def test_detach_breaks_the_link_before_an_edit(store, workspace, no_reflink):
+    data = b"RIFF" + bytes(100)
+    path = write(workspace / "instruments" / "a.wav", data)
+    store.dedupe_workspace(str(workspace))
+
+    assert store.detach(path)
+    assert not os.path.samefile(path, store.blob_path(digest(data)))
+    assert os.stat(path).st_mode & stat.S_IWUSR
+    with open(path, "r+b") as f:
+        f.write(b"EDIT")
+    assert store.read_bytes(digest(data)) == data
+    assert not store.detach(path)
+
+
+def test_dedupe_leaves_files_alone_when_nothing_can_be_shared(store, workspace, no_reflink, monkeypatch):
+    monkeypatch.setattr(asset_store, "_hardlink", lambda src, dst: False)
+    write(workspace / "instruments" / "a.wav", b"audio")
+    assert store.dedupe_workspace(str(workspace)) == 0
+    assert blob_count(store) == 0
+    assert store.read_assets(str(workspace)) == {}
+
+
+def test_materialize_falls_back_to_a_hardlink(store, tmp_path, no_reflink):
+    stored = store.put_bytes(digest(b"payload"), b"payload")
+    assert store.materialize(stored, str(tmp_path / "out" / "payload.bin")) == "hardlink"
+    assert (tmp_path / "out" / "payload.bin").read_bytes() == b"payload"
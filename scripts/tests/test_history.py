@@ -0,0 +1,100 @@
+from history import ProjectHistory, Blob, thaw, BLOB_KEY
+
+
+def test_undo_redo():
+    history = ProjectHistory({"tempo": 120, "tracks": [{"name": "drums"}]})
+    history.set("Change Tempo", ("tempo",), 140)
+    history.set("Rename Track", ("tracks", 0, "name"), "beat")
+    assert history.get(("tracks", 0, "name")) == "beat"
+    assert history.undo_label() == "Rename Track"
+
+    assert history.undo()
+    assert history.get(("tracks", 0, "name")) == "drums"
+    assert history.undo()
+    assert history.get(("tempo",)) == 120
+    assert not history.undo()
+
+    assert history.redo()
+    assert history.get(("tempo",)) == 140
+    assert history.redo_label() == "Rename Track"
+    # A new edit discards the redo branch
+    history.append("Add Track", ("tracks",), {"name": "bass"})
+    assert not history.can_redo()
+    assert len(history) == 2
+    assert thaw(history.state) == {"tempo": 140, "tracks": [{"name": "drums"}, {"name": "bass"}]}
+
+
+def test_snapshots_share_untouched_values():
+    history = ProjectHistory({"a": {"x": 1}, "b": {"y": 2}})
+    before = history.state
+    history.set("Edit", ("a", "x"), 3)
+    assert history.state["b"] is before["b"]
+    assert before["a"]["x"] == 1
+
+
+def test_memory_budget_drops_oldest_steps():
+    history = ProjectHistory({"audio": b""}, memory_budget=10_000)
+    for i in range(20):
+        history.set(f"Edit {i}", ("audio",), bytes([i]) * 4000)
+    assert history.memory_used <= 10_000
+    assert 1 <= len(history) < 20
+    assert history.undo_label() == "Edit 19"
+    while history.undo():
+        pass
+    # The oldest steps are gone, undo stops at the oldest one kept
+    assert history.get(("audio",)).data == bytes([19 - len(history)]) * 4000
+
+
+def test_blobs_still_referenced_keep_counting_against_the_budget():
+    history = ProjectHistory({"name": ""}, memory_budget=20_000)
+    history.set("Record", ("take",), b"x" * 16_000)
+    for i in range(200):
+        history.set(f"Rename {i}", ("name",), f"take {i}")
+    # The recording step is long gone, but the current state still holds the take
+    assert history.memory_used >= 16_000
+    assert history.memory_used <= 20_000 or len(history) == 1
+    assert len(history.blobs) == 1
+
+
+def test_dropped_blobs_stop_counting():
+    history = ProjectHistory({}, memory_budget=10_000)
+    for i in range(5):
+        history.set(f"Record {i}", ("take",), bytes([i]) * 4000)
+    assert len(history.blobs) == len(history) + 1  # One take per kept step plus the one before the oldest
+    assert history.memory_used < 3 * 4100
+
+
+def test_update_is_one_step():
+    history = ProjectHistory({"tempo": 120, "tempo_map": None})
+    history.update("Change Tempo", {("tempo",): 90, ("tempo_map",): {"tempos": [[0.0, 90.0]]}})
+    assert len(history) == 1
+    assert thaw(history.state) == {"tempo": 90, "tempo_map": {"tempos": [[0.0, 90.0]]}}
+    history.undo()
+    assert thaw(history.state) == {"tempo": 120, "tempo_map": None}
+
+
+def test_newest_step_kept_over_budget():
+    history = ProjectHistory({}, memory_budget=1)
+    history.set("Big", ("data",), b"x" * 1000)
+    assert len(history) == 1
+    assert history.undo()
+
+
+def test_identical_payloads_are_stored_once():
+    history = ProjectHistory({})
+    history.set("One", ("a",), b"payload")
+    history.set("Two", ("b",), b"payload")
+    assert history.get(("a",)) is history.get(("b",))
+    assert len(history.blobs) == 1
+
+
+def test_blobs_round_trip_through_save_and_load():
+    saved = {}
+    history = ProjectHistory({})
+    history.set("Record", ("take",), b"\x00\x01" * 100)
+    state = thaw(history.state, save_blob=saved.__setitem__)
+    assert set(state["take"]) == {BLOB_KEY, "size"}
+
+    loaded = ProjectHistory(state, load_blob=saved.get)
+    take = loaded.get(("take",))
+    assert isinstance(take, Blob) and take.data == b"\x00\x01" * 100
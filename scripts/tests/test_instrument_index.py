@@ -0,0 +1,124 @@
+import os
+import time
+import wave
+import random
+import pytest
+import instrument_index
+from instrument_index import InstrumentIndex
+
+
+def write_wav(path, seconds, channels):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(8000)
+        f.writeframes(b"\x10\x00" * int(seconds * 8000) * channels)
+
+
+@pytest.fixture
+def library(tmp_path):
+    workspace, shared = tmp_path / "workspace", tmp_path / "global"
+    workspace.mkdir()
+    (shared / "drums").mkdir(parents=True)
+    (workspace / "GranularPad.ck").write_text("// Granular pad\nLiSa lisa => dac;\nSinOsc lfo;\n")
+    (workspace / "bass.ck").write_text("// Sub bass\nTriOsc t => LPF f => dac; 1::second => now;\n")
+    write_wav(shared / "drums" / "kick.wav", 0.5, 1)
+    write_wav(shared / "drums" / "loop.wav", 4, 2)
+    write_wav(shared / "pad.wav", 12, 2)
+    return [("Workspace", str(workspace)), ("Global", str(shared))]
+
+
+def names(index, query, sources=None):
+    return sorted(os.path.basename(index.path(i)) for i in index.search(query, sources))
+
+
+def test_search(library):
+    index = InstrumentIndex().build(library)
+    assert len(index) == 5
+    assert names(index, "") == ["GranularPad.ck", "bass.ck", "kick.wav", "loop.wav", "pad.wav"]
+    assert names(index, "uses LiSa") == ["GranularPad.ck"]
+    assert names(index, "uses triosc") == ["bass.ck"]
+    assert names(index, "pad") == ["GranularPad.ck", "pad.wav"]  # CamelCase parts are words too
+    assert names(index, "gran") == ["GranularPad.ck"]  # Prefix match
+    assert names(index, "drums") == ["kick.wav", "loop.wav"]
+    assert names(index, "stereo") == ["loop.wav", "pad.wav"]
+    assert names(index, "mono") == ["kick.wav"]
+    assert names(index, "stereo, >10 s") == ["pad.wav"]
+    assert names(index, "< 600 ms") == ["kick.wav"]
+    assert names(index, ">= 4s, <=4s") == ["loop.wav"]
+    assert names(index, "stereo drums") == ["loop.wav"]
+    assert names(index, "nothing like this") == []
+    assert names(index, "", index.source_ids([library[0][1]])) == ["GranularPad.ck", "bass.ck"]
+
+
+def test_describe(library):
+    index = InstrumentIndex().build(library)
+    by_name = {os.path.basename(index.path(i)): i for i in range(len(index))}
+    assert index.describe(by_name["GranularPad.ck"]).startswith("ChucK: LiSa, SinOsc\nGranular pad")
+    assert index.describe(by_name["loop.wav"]).startswith("4.00 s, stereo, 8000 Hz")
+    assert index.source_label(by_name["pad.wav"]) == "Global"
+    assert index.relative_path(by_name["kick.wav"]) == os.path.join("drums", "kick.wav")
+
+
+def test_rebuild_returns_a_new_index(library, monkeypatch):
+    extracted = []
+    extract = instrument_index.extract_metadata
+    monkeypatch.setattr(instrument_index, "extract_metadata", lambda path: extracted.append(path) or extract(path))
+
+    index = InstrumentIndex().build(library)
+    assert len(extracted) == 5
+    new_file = os.path.join(library[0][1], "lead.ck")
+    with open(new_file, "w") as f:
+        f.write("SawOsc s => dac;")
+    rebuilt = index.build(library)
+    # The index being searched is left alone, the new one only extracted the new file
+    assert rebuilt is not index
+    assert len(index) == 5 and len(rebuilt) == 6
+    assert names(index, "uses SawOsc") == []
+    assert names(rebuilt, "uses SawOsc") == ["lead.ck"]
+    assert extracted[5:] == [new_file]
+
+
+SEARCH_ENTRIES = 50_000
+SEARCH_LIMIT = 0.010  # Seconds a search may take at SEARCH_ENTRIES
+WORDS = ["kick", "snare", "hat", "pad", "bass", "lead", "vox", "fx", "loop", "shot", "amb", "drone", "bell",
+         "pluck", "string", "brass", "synth", "perc", "clap", "tom"]
+UGENS = ["SinOsc", "SawOsc", "LiSa", "TriOsc", "Gain", "JCRev", "ADSR", "Noise", "Pan2", "Phasor"]
+
+
+@pytest.fixture(scope="module")
+def large_index():
+    rng = random.Random(0)
+    index = InstrumentIndex()
+    index.roots = [("Global", "/library"), ("Workspace", "/workspace")]
+    for i in range(SEARCH_ENTRIES):
+        name = f"{rng.choice(WORDS)}/{rng.choice(WORDS)}_{rng.choice(WORDS)}{i}"
+        source = i % 2
+        if i % 3 == 0:
+            index._add_entry(source, f"{index.roots[source][1]}/{name}.ck",
+                             {"ugens": rng.sample(UGENS, 3), "excerpt": " ".join(rng.sample(WORDS, 6))})
+        else:
+            index._add_entry(source, f"{index.roots[source][1]}/{name}.wav",
+                             {"duration": rng.random() * 30, "channels": rng.choice((1, 2)), "sample_rate": 44100})
+    index._finalize()
+    return index
+
+
+@pytest.mark.parametrize("query", ["", "s", "b", "k", "ki", "1", "stereo", "mono", ">10 s", "uses SinOsc",
+                                   "s, >1 s", "b stereo", "kick snare", "p, <= 500 ms, mono"])
+def test_search_speed_at_50k_entries(large_index, query):
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        large_index.search(query, sources={0})
+        best = min(best, time.perf_counter() - started)
+    assert best < SEARCH_LIMIT, f"{query!r} took {best * 1000:.1f} ms"
+
+
+def test_large_search_matches_a_scan(large_index):
+    result = large_index.search("s stereo, >1 s", sources={1})
+    expected = [i for i in range(len(large_index)) if large_index.sources[i] == 1
+                and large_index.channels[i] == 2 and large_index.durations[i] > 1
+                and any(token.startswith("s") for token in
+                        instrument_index._tokenize(large_index.relative_path(i)))]
+    assert result == expected
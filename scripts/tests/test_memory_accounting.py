@@ -0,0 +1,77 @@
+import sys
+import numpy as np
+from memory_accounting import MemoryAccountant, deep_size, format_report, MB
+
+
+class Plain:
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class Slotted:
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+def test_deep_size_counts_shared_objects_once():
+    payload = b"x" * 100000
+    assert deep_size([payload, payload]) == sys.getsizeof([payload, payload]) + sys.getsizeof(payload)
+    assert deep_size({"a": Plain(payload), "b": Slotted(payload)}) > 100000
+    assert deep_size({"a": Plain(payload), "b": Slotted(payload)}) < 200000
+
+
+def test_deep_size_counts_array_buffers_they_own():
+    data = np.zeros(100000)
+    assert deep_size(data) >= data.nbytes
+    assert deep_size(data[::2]) < 1000
+    # A view and its base in one structure count the buffer once
+    assert deep_size([data, data[:10]]) < data.nbytes + 1000
+
+
+def test_measure_sorts_and_reports_errors():
+    accountant = MemoryAccountant()
+    accountant.register("small", lambda: 10)
+    accountant.register("large", lambda: (5 * MB, 3), budget=1 * MB)
+    accountant.register("broken", lambda: 1 / 0)
+    entries = accountant.measure()
+    assert [entry["name"] for entry in entries] == ["large", "small", "broken"]
+    assert entries[0]["items"] == 3 and entries[0]["over_budget"]
+    assert "division" in entries[2]["error"]
+    text = format_report({"rss": MB, "open_descriptors": 4, "threads": 1, "subsystems": entries})
+    assert "OVER BUDGET" in text and "error:" in text
+
+
+def test_check_warns_once_per_overrun():
+    accountant = MemoryAccountant()
+    size = [2 * MB]
+    accountant.register("cache", lambda: size[0], budget=MB)
+    assert [entry["name"] for entry in accountant.check()] == ["cache"]
+    assert accountant.check() == []
+    size[0] = MB // 2
+    assert accountant.check() == []
+    size[0] = 2 * MB
+    assert len(accountant.check()) == 1
+
+
+def test_unregister_prefix():
+    accountant = MemoryAccountant()
+    for name in ("ws1/sampler", "ws1/history", "ws10/sampler", "ws1"):
+        accountant.register(name, lambda: 1)
+    accountant.unregister("ws1")
+    assert [entry["name"] for entry in accountant.measure()] == ["ws10/sampler"]
+
+
+def test_snapshot_diff_finds_growth():
+    accountant = MemoryAccountant()
+    accountant.start_tracing()
+    try:
+        kept = [bytearray(1000) for _ in range(1000)]
+        growth = accountant.snapshot_diff()
+        assert growth[0]["size_diff"] >= 1000 * 1000
+        assert growth[0]["traceback"][0].startswith(__file__)
+        assert accountant.report()["traced"]["current"] > 0
+    finally:
+        accountant.stop_tracing()
+    assert accountant.snapshot_diff() == [] and len(kept) == 1000
@@ -0,0 +1,74 @@
+import threading
+import numpy as np
+import pytest
+from metering import MeterTap, MeterEngine
+
+
+def ramp(start, frames):
+    return np.arange(start, start + frames, dtype=np.float32)
+
+
+def test_read_across_the_wrap():
+    tap = MeterTap("t", channels=2, capacity=16)
+    tap.push(ramp(0, 6))
+    assert tap.read(16)[0].tolist() == list(range(6))
+    # Written from frame 6 to 17, wrapping past the end of the buffer
+    tap.push(np.stack([ramp(6, 6), -ramp(6, 6)]))
+    block = tap.read(16)
+    assert block[0].tolist() == list(range(6, 12))
+    assert block[1].tolist() == [-x for x in range(6, 12)]
+    tap.push(ramp(12, 7))
+    assert tap.read(16)[0].tolist() == list(range(12, 19))
+
+
+def test_consumer_behind_gets_the_newest_frames():
+    tap = MeterTap("t", channels=1, capacity=16)
+    for start in range(0, 40, 5):
+        tap.push(ramp(start, 5))
+    # At most half the ring is handed out, the rest may already be overwritten
+    assert tap.read(16)[0].tolist() == list(range(32, 40))
+    assert tap.read(16).shape == (1, 0)
+
+
+def test_block_larger_than_the_ring():
+    tap = MeterTap("t", channels=1, capacity=16)
+    tap.push(ramp(0, 3))
+    tap.push(ramp(3, 37))
+    assert tap.latest(8)[0].tolist() == list(range(32, 40))
+
+
+def test_concurrent_producer_and_consumer():
+    tap = MeterTap("t", channels=1, capacity=64)
+    total = 20000
+    done = threading.Event()
+
+    def produce():
+        for start in range(0, total, 7):
+            tap.push(ramp(start, min(7, total - start)))
+        done.set()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    last = -1
+    while not done.is_set() or tap._read < tap._written:
+        block = tap.read(64)[0]
+        if len(block):
+            # Every read is a contiguous run of newer frames, never a torn mix of old and new
+            assert np.array_equal(block, ramp(block[0], len(block)))
+            assert block[0] > last
+            last = block[-1]
+    producer.join()
+    assert last == total - 1
+
+
+def test_engine_reads_levels():
+    engine = MeterEngine()
+    t = np.arange(4096) / 44100
+    engine.tap("sine").push(0.5 * np.sin(2 * np.pi * 1000 * t))
+    engine.tap("silence").push(np.zeros(4096))
+    readings = engine.update(now=0.0)
+    assert readings["sine"]["peak"][0] == pytest.approx(20 * np.log10(0.5), abs=0.1)
+    assert readings["sine"]["rms"][0] == pytest.approx(20 * np.log10(0.5 / np.sqrt(2)), abs=0.1)
+    assert readings["silence"]["peak"][0] == -90.0
+    engine.remove_tap("silence")
+    assert set(engine.update(now=0.1)) == {"sine"}
@@ -0,0 +1,92 @@
+import socket
+import pytest
+from pythonosc.osc_packet import OscPacket
+import osc_bridge
+from osc_bridge import OscControlBridge, PARAM_ADDRESS, NOTE_ADDRESS
+
+
+@pytest.fixture
+def receiver():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind((osc_bridge.OSC_HOST, 0))
+    s.settimeout(1.0)
+    yield s
+    s.close()
+
+
+@pytest.fixture
+def bridge(monkeypatch):
+    bridge = OscControlBridge(schedule_ahead=0)
+    # Without the sender thread bundles only go out on an explicit flush
+    monkeypatch.setattr(bridge, "start", lambda: None)
+    yield bridge
+    bridge.stop()
+
+
+def received(s):
+    packet = OscPacket(s.recv(65536))
+    return [(timed.message.address, timed.message.params) for timed in packet.messages]
+
+
+def test_params_coalesce_into_one_bundle(bridge, receiver):
+    bridge.register("script", receiver.getsockname()[1])
+    bridge.set_param("script", "gain", 0.1)
+    bridge.set_param("script", "cutoff", 800)
+    bridge.set_param("script", "gain", 0.5)
+    bridge.flush()
+    assert sorted(received(receiver)) == [(PARAM_ADDRESS.format("cutoff"), [800.0]),
+                                          (PARAM_ADDRESS.format("gain"), [0.5])]
+    assert bridge.stats["coalesced"] == 1
+    assert bridge.stats["bundles"] == 1
+
+
+def test_notes_are_never_coalesced(bridge, receiver):
+    bridge.register("script", receiver.getsockname()[1])
+    bridge.trigger_note("script", 60)
+    bridge.trigger_note("script", 60, velocity=80)
+    bridge.flush()
+    assert received(receiver) == [(NOTE_ADDRESS, [60, 100, 0.0]), (NOTE_ADDRESS, [60, 80, 0.0])]
+
+
+def test_unregistered_targets_are_dropped(bridge, receiver):
+    bridge.set_param("missing", "gain", 1.0)
+    bridge.flush()
+    assert bridge.stats["updates"] == 0 and bridge.stats["bundles"] == 0
+
+
+def test_allocated_ports_are_never_handed_out_twice(bridge, monkeypatch):
+    free = iter([5000, 5001, 5000, 5002])
+    monkeypatch.setattr(osc_bridge.socket, "socket", lambda *args: FakeSocket(next(free)))
+    first = bridge.allocate_port()
+    bridge.register("a", first)
+    second = bridge.allocate_port()
+    assert (first, second) == (5000, 5001)
+    # 5000 is registered and 5001 allocated but not registered yet, so both are skipped
+    assert bridge.allocate_port() == 5002
+    bridge.release_port(second)
+    assert bridge._allocated == {5002}
+
+
+def test_stop_closes_the_socket():
+    bridge = OscControlBridge()
+    bridge.register("script", osc_bridge.allocate_port())
+    bridge.stop()
+    assert bridge._socket.fileno() == -1
+    bridge.stop()
+
+
+class FakeSocket:
+    def __init__(self, port):
+        self.port = port
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def bind(self, address):
+        pass
+
+    def getsockname(self):
+        return osc_bridge.OSC_HOST, self.port
@@ -0,0 +1,59 @@
+import wave
+import numpy as np
+import pytest
+from parallel_render import RenderPlan, MASTER
+from sampler import sampler_from_spec, render_clips
+from sequencer import SequencerTrack
+from transport import TempoMap, CHANNELS
+
+SAMPLE_RATE = 8000
+DURATION = 1.0
+
+
+@pytest.fixture
+def tone(tmp_path):
+    path = tmp_path / "tone.wav"
+    pcm = (np.sin(2 * np.pi * 220 * np.arange(SAMPLE_RATE) / SAMPLE_RATE) * 16000).astype("<i2")
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+    return str(path)
+
+
+def sampler_track(name, tone, pitches, **routing):
+    notes = [[i * 0.25, 0.5, pitch, 100, 0] for i, pitch in enumerate(pitches)]
+    return dict({"name": name, "sampler": [{"audio": tone, "root": 60}],
+                 "clips": [{"name": name, "start": 0.0, "beats": True, "notes": notes}]}, **routing)
+
+
+def serial_render(plan, name):
+    spec = plan.tracks[name]
+    sampler = sampler_from_spec(spec["sampler"], plan.sample_rate)
+    return render_clips(sampler, SequencerTrack.from_json(spec["clips"]).clips, TempoMap.from_json(None, plan.bpm),
+                        plan.frames, plan.block_size)
+
+
+def test_parallel_mix_matches_a_serial_mix(tone):
+    plan = RenderPlan([sampler_track("lead", tone, [60, 64, 67], gain=0.5, sends=[{"bus": "verb", "gain": 0.25}]),
+                       sampler_track("bass", tone, [36, 43], output="group"),
+                       sampler_track("keys", tone, [72, 76], output="group", gain=2.0)],
+                      [{"name": "group", "gain": 0.8}, {"name": "verb", "output": "group"}],
+                      duration=DURATION, sample_rate=SAMPLE_RATE, block_size=64)
+    lead, bass, keys = (serial_render(plan, name) for name in ("lead", "bass", "keys"))
+    group = bass + 2.0 * keys + 0.25 * lead
+    expected = 0.5 * lead + 0.8 * group
+
+    mix = plan.render(workers=2)
+    assert mix.shape == (CHANNELS, plan.frames)
+    assert np.abs(mix).max() > 0
+    np.testing.assert_allclose(mix, expected, atol=1e-5)
+    assert plan.inputs[MASTER] == [("lead", 0.5), ("group", 0.8)]
+
+
+def test_routing_loops_and_unknown_buses_are_rejected(tone):
+    with pytest.raises(ValueError, match="loop"):
+        RenderPlan([], [{"name": "a", "output": "b"}, {"name": "b", "output": "a"}])
+    with pytest.raises(ValueError, match="unknown bus"):
+        RenderPlan([sampler_track("lead", tone, [60], output="missing")])
@@ -0,0 +1,136 @@
+import types
+import numpy as np
+import pytest
+import sampler as sampler_module
+from sampler import Sampler, SamplerOutput, BLOCK_SIZE, CHANNELS
+
+FRAMES = 64
+
+
+def sampler(voices=4):
+    sampler = Sampler(max_voices=voices, attack=0.0, decay=0.0, sustain=1.0, release=0.01)
+    sampler.add_zone(np.full(44100, 0.1, dtype=np.float32))
+    return sampler
+
+
+def voices_by_pitch(sampler):
+    return {int(sampler.pitch[voice]): voice for voice in np.flatnonzero(sampler.active)}
+
+
+def test_free_voices_are_used_first():
+    s = sampler()
+    for pitch in (60, 62, 64):
+        s.note_on(pitch)
+    s.render(FRAMES)
+    assert sorted(voices_by_pitch(s)) == [60, 62, 64]
+    assert s.stolen == 0
+
+
+def test_oldest_voice_is_stolen_when_all_are_held():
+    s = sampler()
+    for pitch in (60, 62, 64, 65):
+        s.note_on(pitch)
+        s.render(FRAMES)
+    s.note_on(67)
+    s.render(FRAMES)
+    assert sorted(voices_by_pitch(s)) == [62, 64, 65, 67]
+    assert s.stolen == 1
+
+
+def test_released_voice_is_stolen_before_held_ones():
+    s = sampler()
+    for pitch in (60, 62, 64, 65):
+        s.note_on(pitch)
+    s.render(FRAMES)
+    s.note_off(64)
+    s.render(FRAMES)
+    s.note_off(62)
+    s.render(FRAMES)
+    s.note_on(67)
+    s.render(FRAMES)
+    # 64 is further into its release than 62, so it is the quietest
+    assert sorted(voices_by_pitch(s)) == [60, 62, 65, 67]
+    assert s.stolen == 1
+
+
+def test_stolen_voice_restarts_its_sample():
+    s = sampler(voices=1)
+    s.note_on(60)
+    s.render(FRAMES * 10)
+    s.note_on(72)
+    out = s.render(FRAMES)
+    voice = np.flatnonzero(s.active)[0]
+    assert s.pitch[voice] == 72
+    assert s.age[voice] == FRAMES
+    assert out.shape == (2, FRAMES) and np.all(out[:, 1:] > 0)
+
+
+def test_events_from_one_block_keep_their_order():
+    s = sampler(voices=2)
+    s.note_on(60)
+    s.note_off(60)
+    s.note_on(62)
+    s.render(FRAMES)
+    held = s.active & (s.release_at < 0)
+    assert s.pitch[held].tolist() == [62]
+
+
+class FakeStream:
+    """Stands in for sounddevice.OutputStream, calling back by hand instead of from PortAudio."""
+    opened = []
+
+    def __init__(self, samplerate, blocksize, channels, dtype, latency, callback):
+        self.blocksize, self.channels, self.latency, self.callback = blocksize, channels, latency, callback
+        self.started = self.closed = False
+        FakeStream.opened.append(self)
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.closed = True
+
+    def pull(self, underflow=False):
+        out = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+        self.callback(out, self.blocksize, None, types.SimpleNamespace(output_underflow=underflow))
+        return out
+
+
+@pytest.fixture
+def fake_device(monkeypatch):
+    FakeStream.opened = []
+    monkeypatch.setattr(sampler_module, "sounddevice", types.SimpleNamespace(OutputStream=FakeStream))
+    return FakeStream.opened
+
+
+def test_device_output_plays_a_note_in_the_next_block(fake_device):
+    output = SamplerOutput(supervisor=None)
+    s = sampler()
+    output.add(s)
+    output.start()
+    output.start()
+    stream, = fake_device
+    assert stream.blocksize == BLOCK_SIZE and stream.channels == CHANNELS and stream.latency == "low"
+    assert output.latency() == BLOCK_SIZE / 44100
+    assert not stream.pull().any()
+    s.note_on(60)
+    assert (stream.pull()[1:] > 0).all()
+    stream.pull(underflow=True)
+    assert output.xruns == 1
+    output.remove(s)
+    assert stream.closed and output.handle is None
+
+
+def test_falls_back_to_ffplay_without_a_device(monkeypatch):
+    def no_device(**kwargs):
+        raise OSError("no default output device")
+
+    monkeypatch.setattr(sampler_module, "sounddevice", types.SimpleNamespace(OutputStream=no_device))
+    output = SamplerOutput(supervisor=None)
+    started = []
+    monkeypatch.setattr(output, "_start_ffplay", lambda: started.append(True))
+    output.start()
+    assert started and not output.use_device
@@ -0,0 +1,76 @@
+import struct
+import numpy as np
+import pytest
+from sequencer import MidiClip, SequencerTrack, encode_track_chunk, _vlq, PPQ
+from transport import TempoMap
+
+
+def read_vlq(data, i):
+    value = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, i
+
+
+def read_track(chunk):
+    """(absolute tick, message bytes) of every channel message in an MTrk chunk."""
+    assert chunk[:4] == b"MTrk"
+    length = struct.unpack(">I", chunk[4:8])[0]
+    body = chunk[8:8 + length]
+    events, i, tick = [], 0, 0
+    while i < len(body):
+        delta, i = read_vlq(body, i)
+        tick += delta
+        if body[i] == 0xFF:
+            events.append((tick, bytes(body[i:i + 3 + body[i + 2]])))
+            i += 3 + body[i + 2]
+        else:
+            events.append((tick, bytes(body[i:i + 3])))
+            i += 3
+    return events
+
+
+@pytest.mark.parametrize("value, encoded", [
+    (0, b"\x00"), (0x7F, b"\x7F"), (0x80, b"\x81\x00"), (0x2000, b"\xC0\x00"), (0x3FFF, b"\xFF\x7F"),
+    (0x4000, b"\x81\x80\x00"), (0x1FFFFF, b"\xFF\xFF\x7F"), (0x200000, b"\x81\x80\x80\x00"),
+    (0x0FFFFFFF, b"\xFF\xFF\xFF\x7F"),
+])
+def test_vlq(value, encoded):
+    assert _vlq(value) == encoded
+    # The vectorized track encoder writes the same bytes as the scalar one
+    chunk = encode_track_chunk(np.array([value]), np.array([[0x90, 60, 100]], dtype=np.uint8))
+    assert chunk[8:8 + len(encoded)] == encoded
+    assert read_track(chunk)[0] == (value, b"\x90\x3C\x64")
+
+
+def test_track_chunk_rejects_huge_delta():
+    with pytest.raises(ValueError):
+        encode_track_chunk(np.array([1 << 28]), np.array([[0x90, 60, 100]], dtype=np.uint8))
+
+
+def test_track_events_sorted_with_note_off_first():
+    clip = MidiClip([(0, 1, 60, 100), (1, 1, 60, 90)], ccs=[(0.5, 7, 64)])
+    data = SequencerTrack([clip]).to_midi_bytes(TempoMap(120))
+    header_length = 14
+    tempo_length = struct.unpack(">I", data[header_length + 4:header_length + 8])[0]
+    events = read_track(data[header_length + 8 + tempo_length:])
+    assert events == [
+        (0, b"\x90\x3C\x64"),
+        (PPQ // 2, b"\xB0\x07\x40"),
+        (PPQ, b"\x80\x3C\x00"),  # The repeated note is released before it starts again
+        (PPQ, b"\x90\x3C\x5A"),
+        (2 * PPQ, b"\x80\x3C\x00"),
+        (2 * PPQ, b"\xFF\x2F\x00"),
+    ]
+
+
+def test_tempo_chunk():
+    tempo_map = TempoMap(120)
+    tempo_map.set_tempo(4, 60)
+    data = SequencerTrack().to_midi_bytes(tempo_map)
+    events = read_track(data[14:])
+    assert (0, b"\xFF\x51\x03\x07\xA1\x20") in events  # 500000 us per quarter
+    assert (4 * PPQ, b"\xFF\x51\x03\x0F\x42\x40") in events
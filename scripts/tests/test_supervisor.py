@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+import pytest
+from supervisor import ProcessSupervisor, RESTART_NEVER, RESTART_ON_FAILURE, RESTART_ALWAYS
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+@pytest.fixture
+def supervisor():
+    supervisor = ProcessSupervisor()
+    yield supervisor
+    supervisor.shutdown()
+
+
+def run(supervisor, code, **kwargs):
+    """Spawn python -c code and wait until the supervisor gives up on it."""
+    exited = threading.Event()
+    finished = []
+
+    def on_exit(child):
+        finished.append(child)
+        exited.set()
+
+    supervisor.spawn([sys.executable, "-c", code], on_exit=on_exit, **kwargs)
+    assert exited.wait(10)
+    return finished[0]
+
+
+@pytest.mark.parametrize("restart, code, restarts", [
+    (RESTART_NEVER, 1, 0),
+    (RESTART_ON_FAILURE, 0, 0),
+    (RESTART_ON_FAILURE, 1, 2),
+    (RESTART_ALWAYS, 0, 2),
+])
+def test_restart_policies(supervisor, restart, code, restarts):
+    child = run(supervisor, f"raise SystemExit({code})", restart=restart, max_restarts=2)
+    assert child.restarts == restarts
+    assert child.returncode == code
+    assert child.handle not in supervisor.handles()
+
+
+def test_stopped_children_are_not_restarted(supervisor):
+    exited = threading.Event()
+    handle = supervisor.spawn([sys.executable, "-c", "import time; time.sleep(30)"], restart=RESTART_ALWAYS,
+                              on_exit=lambda child: exited.set())
+    assert supervisor.is_running(handle)
+    supervisor.stop(handle)
+    assert exited.wait(10)
+    assert supervisor.get(handle) is None
+
+
+@pytest.mark.skipif(os.name != "posix" or resource is None, reason="needs fork, nice and rlimits")
+def test_policy_is_in_place_before_exec(supervisor):
+    nice = min(19, os.getpriority(os.PRIO_PROCESS, 0) + 5)
+    limit = 1024 * 1024 * 1024
+    child = run(supervisor, "import os, resource; print(os.getpriority(os.PRIO_PROCESS, 0)); "
+                            "print(resource.getrlimit(resource.RLIMIT_AS)[0])",
+                nice=nice, memory_limit=limit, stdout=subprocess.PIPE, text=True)
+    # Output is drained by a separate thread, which may still be reading
+    deadline = time.monotonic() + 5
+    while len(child.output) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert list(child.output) == [str(nice), str(limit)]
+
+
+def test_memory_footprint_while_output_arrives(supervisor):
+    handle = supervisor.spawn([sys.executable, "-u", "-c", "while True: print('x' * 100)"],
+                              stdout=subprocess.PIPE, text=True)
+    deadline = time.monotonic() + 10
+    while len(supervisor.get(handle).output) < 500 and time.monotonic() < deadline:
+        size, children = supervisor.memory_footprint()
+    # Sized on copies taken while the drain thread keeps appending, never the live deque
+    size, children = supervisor.memory_footprint()
+    assert children == 1 and size > 500 * 100
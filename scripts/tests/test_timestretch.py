@@ -0,0 +1,101 @@
+import wave
+from concurrent.futures import Future
+import numpy as np
+import pytest
+import asset_store
+import sampler
+import timestretch
+from asset_store import AssetStore
+from timestretch import TimeStretcher, stretch, ALGORITHM_PREVIEW
+
+FRAMES = 8820
+
+
+class FakeExecutor:
+    """Queues renders until the test runs them, in this process."""
+    created = []
+
+    def __init__(self, **kwargs):
+        self.jobs = []
+        self.shut_down = False
+        FakeExecutor.created.append(self)
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.jobs.append((future, fn, args))
+        return future
+
+    def run_all(self):
+        for future, fn, args in self.jobs:
+            if future.set_running_or_notify_cancel():
+                future.set_result(fn(*args))
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+        for future, _, _ in self.jobs:
+            future.cancel()
+
+
+@pytest.fixture
+def loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(asset_store, "_default_store", AssetStore(str(tmp_path / "store"), []))
+    monkeypatch.setattr(sampler, "_default_sample_cache", sampler.SampleCache())
+    FakeExecutor.created = []
+    monkeypatch.setattr(timestretch, "ProcessPoolExecutor", FakeExecutor)
+    path = str(tmp_path / "loop_120bpm.wav")
+    t = np.arange(FRAMES) / 44100
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes((np.sin(2 * np.pi * 440 * t) * 16000).astype("<i2").tobytes())
+    return path
+
+
+def test_identity_and_preview_stretches():
+    data = np.random.default_rng(0).standard_normal((2, FRAMES)).astype(np.float32)
+    assert stretch(data, 1.5, algorithm=ALGORITHM_PREVIEW).shape == (2, round(FRAMES * 1.5))
+    assert stretch(data, 0.5).shape == (2, FRAMES // 2)
+    assert stretch(data, 1.0, semitones=12).shape == (2, FRAMES)
+    assert timestretch.source_tempo("beat_92bpm.wav") == 92.0
+
+
+def test_render_is_cached_in_memory_and_on_disk(loop, tmp_path):
+    stretcher = TimeStretcher(cache_dir=str(tmp_path / "cache"))
+    (tmp_path / "cache").mkdir()
+    ready = []
+    preview, final = stretcher.get(loop, 1.5, on_ready=ready.append)
+    assert not final and preview.shape[1] == round(FRAMES * 1.5)
+    assert stretcher.pending() == 1
+    FakeExecutor.created[0].run_all()
+    assert len(ready) == 1 and stretcher.pending() == 0
+    audio, final = stretcher.get(loop, 1.5)
+    assert final and audio is ready[0]
+
+    # Another stretcher over the same directory, e.g. after a restart, loads the render from disk
+    restarted = TimeStretcher(cache_dir=str(tmp_path / "cache"))
+    audio, final = restarted.get(loop, 1.5)
+    assert final and np.array_equal(audio, ready[0])
+    assert restarted.pending() == 0
+
+
+def test_superseded_renders_are_cancelled(loop, tmp_path):
+    stretcher = TimeStretcher(cache_dir=str(tmp_path))
+    ready = []
+    stretcher.get(loop, 1.5, on_ready=lambda audio: ready.append(1.5))
+    stretcher.get(loop, 1.5, on_ready=lambda audio: ready.append(1.5))
+    stretcher.get(loop, 2.0, on_ready=lambda audio: ready.append(2.0))
+    executor = FakeExecutor.created[0]
+    assert len(executor.jobs) == 2 and executor.jobs[0][0].cancelled()
+    executor.run_all()
+    assert ready == [2.0] and stretcher.pending() == 0
+
+
+def test_shutdown_cancels_queued_renders(loop, tmp_path):
+    stretcher = TimeStretcher(cache_dir=str(tmp_path))
+    stretcher.get(loop, 1.5)
+    stretcher.shutdown()
+    assert FakeExecutor.created[0].shut_down and stretcher.pending() == 0
+    # The stretcher outlives a session, the next render starts new workers
+    stretcher.get(loop, 2.0)
+    assert len(FakeExecutor.created) == 2 and stretcher.pending() == 1
@@ -0,0 +1,131 @@
+import threading
+import numpy as np
+import pytest
+from transport import TempoMap, Transport, TransportSink, SAMPLE_RATE, BLOCK_SIZE
+
+
+def tempo_map():
+    """120 BPM, 60 BPM from beat 4, 240 BPM from beat 8."""
+    tempo_map = TempoMap(120)
+    tempo_map.set_tempo(4, 60)
+    tempo_map.set_tempo(8, 240)
+    return tempo_map
+
+
+@pytest.mark.parametrize("beat, seconds", [(0, 0.0), (2, 1.0), (4, 2.0), (6, 4.0), (8, 6.0), (12, 7.0)])
+def test_beats_and_seconds(beat, seconds):
+    assert tempo_map().beat_to_seconds(beat) == pytest.approx(seconds)
+    assert tempo_map().seconds_to_beat(seconds) == pytest.approx(beat)
+
+
+def test_vectorized_conversions_match():
+    beats = np.linspace(0, 16, 97)
+    expected = [tempo_map().beat_to_seconds(beat) for beat in beats]
+    assert np.allclose(tempo_map().beats_to_seconds(beats), expected)
+    assert np.allclose(tempo_map().seconds_to_beats(expected), beats)
+
+
+def test_samples():
+    assert tempo_map().beat_to_sample(6) == 4 * SAMPLE_RATE
+    assert tempo_map().sample_to_beat(4 * SAMPLE_RATE) == pytest.approx(6)
+
+
+def test_clear_after_and_json():
+    changed = tempo_map()
+    changed.clear_after(5)
+    assert changed.tempo_changes() == [(0.0, 120.0), (4.0, 60.0)]
+    restored = TempoMap.from_json(tempo_map().to_json())
+    assert restored.tempo_changes() == tempo_map().tempo_changes()
+
+
+def test_bar_and_beat_with_signature_change():
+    changed = TempoMap(120)
+    changed.set_time_signature(8, 3, 4)
+    assert changed.bar_and_beat(5) == (1, 1.0)
+    assert changed.bar_and_beat(8) == (2, 0.0)
+    assert changed.bar_and_beat(12) == (3, 1.0)
+
+
+class RecordingSink(TransportSink):
+    def __init__(self):
+        self.positions = []
+        self.tempos = []
+
+    def on_position(self, sample_position, beat):
+        self.positions.append((sample_position, beat))
+
+    def on_tempo(self, bpm, sample_position):
+        self.tempos.append((bpm, sample_position))
+
+
+def test_seek_while_stopped():
+    transport = Transport(tempo_map())
+    sink = RecordingSink()
+    transport.add_sink(sink)
+    transport.seek(6)
+    assert transport.sample_position == 4 * SAMPLE_RATE
+    assert transport.beat == pytest.approx(6)
+    assert sink.positions[-1] == (4 * SAMPLE_RATE, pytest.approx(6))
+    assert transport.bpm == 60
+
+
+def test_tempo_change_applies_at_the_next_block():
+    transport = Transport(TempoMap(120))
+    sink = RecordingSink()
+    transport.add_sink(sink)
+    transport.process_block()
+    transport.playing = True  # Queue like the clock thread would see it, without starting one
+    transport.set_tempo(90)
+    assert transport.bpm == 120
+    transport.process_block()
+    assert transport.bpm == 90
+    assert sink.tempos[-1] == (90.0, BLOCK_SIZE)
+    assert transport.sample_position == 2 * BLOCK_SIZE
+
+
+def test_tempo_map_replaced_at_the_next_block():
+    transport = Transport(TempoMap(120))
+    sink = RecordingSink()
+    transport.add_sink(sink)
+    tempo_map = TempoMap(120)
+    tempo_map.set_tempo(4, 60)
+    transport.set_tempo_map(tempo_map)
+    # The transport keeps its own map object, which sinks hold on to
+    assert transport.tempo_map is not tempo_map
+    assert transport.tempo_map.tempo_changes() == [(0.0, 120.0), (4.0, 60.0)]
+    assert len(sink.tempos) == 2
+    tempo_map.set_tempo(8, 90)
+    assert len(transport.tempo_map.tempo_changes()) == 2
+
+
+def test_map_read_while_edited():
+    edited = TempoMap(120)
+    done = threading.Event()
+
+    def edit():
+        for i in range(2000):
+            edited.clear_after(0)
+            edited.set_tempo(1 + i % 7, 60 + i % 100)
+        done.set()
+
+    thread = threading.Thread(target=edit)
+    thread.start()
+    while not done.is_set():
+        # Every read sees one whole version of the map, never segments of two
+        assert edited.seconds_to_beat(edited.beat_to_seconds(16)) == pytest.approx(16)
+    thread.join()
+
+
+def test_sinks_changed_while_playing():
+    transport = Transport(TempoMap(120))
+    sinks = [RecordingSink() for _ in range(50)]
+    transport.play()
+    try:
+        for sink in sinks:
+            transport.add_sink(sink)
+        for sink in sinks[::2]:
+            transport.remove_sink(sink)
+        transport.remove_sink(sinks[0])
+    finally:
+        transport.stop()
+    assert transport.sinks == tuple(sinks[1::2])
@@ -0,0 +1,323 @@
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from logger import logger
+from memory_accounting import default_accountant, MB
+from config import STRETCH_CACHE_DIR
+from transport import SAMPLE_RATE
+
+ALGORITHM_PREVIEW = "ola"  # Plain overlap-add: instant, pitch preserving, audibly grainy
+ALGORITHM_PHASE_VOCODER = "phase_vocoder"  # Phase vocoder with identity phase locking
+FFT_SIZE = 2048
+OVERLAP = 4  # Phase vocoder frames per FFT_SIZE, the Hann window squared sums to 1.5 at this overlap
+PREVIEW_GRAIN = 2048
+RATIO_DIGITS = 4  # Ratios and semitones are rounded to this many decimals for cache keys
+MEMORY_BUDGET = 256 * MB
+DISK_BUDGET = 2048 * MB
+TEMPO_PATTERN = re.compile(r"(?<![\d.])(\d{2,3}(?:\.\d+)?)\s*bpm", re.I)
+
+_default_stretcher = None
+_default_stretcher_lock = threading.Lock()
+
+
+def default_stretcher():
+    """The process-wide stretcher, its caches are shared by every workspace."""
+    global _default_stretcher
+    with _default_stretcher_lock:
+        if _default_stretcher is None:
+            _default_stretcher = TimeStretcher()
+            default_accountant().register("timestretch/renders", _default_stretcher.memory_footprint,
+                                          budget=MEMORY_BUDGET)
+        return _default_stretcher
+
+
+def source_tempo(path):
+    """Tempo a loop was recorded at if its file name says so ("beat_92bpm.wav"), else None."""
+    match = TEMPO_PATTERN.search(os.path.basename(path))
+    return float(match.group(1)) if match else None
+
+
+def _frames(data, positions, size):
+    """(channels, len(positions), size) windows of data starting at positions."""
+    return data[:, positions[:, np.newaxis] + np.arange(size)]
+
+
+def _overlap_add(frames, hop, length):
+    """Sum (channels, count, size) frames spaced hop apart into (channels, length)."""
+    channels, count, size = frames.shape
+    overlap = size // hop
+    out = np.zeros((channels, (count + overlap) * hop), dtype=np.float32)
+    # Every overlap-th frame tiles the output without overlapping, so each phase is a single reshape
+    for phase in range(overlap):
+        tiles = frames[:, phase::overlap].reshape(channels, -1)
+        out[:, phase * hop:phase * hop + tiles.shape[1]] += tiles
+    return out[:, :length]
+
+
+def ola_stretch(data, ratio, grain=PREVIEW_GRAIN):
+    """Stretch by ratio with windowed grains laid out at a new spacing, no phase correction."""
+    hop = grain // 2
+    frames = int(round(data.shape[1] * ratio))
+    count = frames // hop + 2
+    padded = np.pad(data, ((0, 0), (hop, grain + hop)))
+    positions = np.minimum(np.rint(np.arange(count) * hop / ratio).astype(np.int64), padded.shape[1] - grain)
+    # A Hann window at half overlap sums to one
+    window = np.hanning(grain + 1)[:-1].astype(np.float32)
+    return _overlap_add(_frames(padded, positions, grain) * window, hop, frames + hop)[:, hop:]
+
+
+def phase_vocoder(data, ratio, fft_size=FFT_SIZE):
+    """Stretch by ratio keeping the pitch, with a phase vocoder.
+
+    Analysis frames are taken every hop / ratio samples and resynthesized
+    every hop samples. Each bin's phase advances by its measured frequency;
+    bins around a spectral peak keep their phase offset to the peak so
+    partials stay coherent (identity phase locking).
+    """
+    hop = fft_size // OVERLAP
+    frames = int(round(data.shape[1] * ratio))
+    count = frames // hop + OVERLAP + 1
+    half = fft_size // 2
+    padded = np.pad(data, ((0, 0), (half, fft_size + half)))
+    positions = np.minimum(np.rint(np.arange(count) * hop / ratio).astype(np.int64), padded.shape[1] - fft_size)
+    window = np.hanning(fft_size + 1)[:-1]
+    bins = np.arange(half + 1)
+    expected = 2 * np.pi * bins / fft_size  # Phase advance per sample of each bin's center frequency
+
+    out = np.empty((data.shape[0], count, fft_size), dtype=np.float32)
+    for channel in range(data.shape[0]):
+        spectrum = np.fft.rfft(_frames(padded[channel:channel + 1], positions, fft_size)[0] * window, axis=-1)
+        magnitude, phase = np.abs(spectrum), np.angle(spectrum)
+
+        # Measured frequency from the phase difference between analysis frames
+        step = np.maximum(np.diff(positions), 1)[:, np.newaxis]
+        deviation = np.diff(phase, axis=0) - expected * step
+        deviation = (deviation + np.pi) % (2 * np.pi) - np.pi
+        advance = (expected + deviation / step) * hop
+        synthesis = np.concatenate((phase[:1], phase[:1] + np.cumsum(advance, axis=0)))
+
+        # Lock every bin to the phase of the nearest peak in its frame
+        peaks = (magnitude >= np.roll(magnitude, 1, axis=1)) & (magnitude > np.roll(magnitude, -1, axis=1))
+        peaks[:, 0] = peaks[:, -1] = True
+        left = np.maximum.accumulate(np.where(peaks, bins, 0), axis=1)
+        right = np.minimum.accumulate(np.where(peaks, bins, half)[:, ::-1], axis=1)[:, ::-1]
+        nearest = np.where(bins - left <= right - bins, left, right)
+        rows = np.arange(count)[:, np.newaxis]
+        synthesis = synthesis[rows, nearest] + phase - phase[rows, nearest]
+
+        out[channel] = np.fft.irfft(magnitude * np.exp(1j * synthesis), n=fft_size, axis=-1) * (window / 1.5)
+    return _overlap_add(out, hop, frames + half)[:, half:]
+
+
+def resample(data, factor):
+    """Play data factor times faster with linear interpolation (changes pitch and length)."""
+    frames = max(int(round(data.shape[1] / factor)), 1)
+    source = np.arange(frames) * factor
+    return np.stack([np.interp(source, np.arange(data.shape[1]), channel) for channel in data]).astype(np.float32)
+
+
+def stretch(data, ratio, semitones=0.0, algorithm=ALGORITHM_PHASE_VOCODER):
+    """Make (channels, frames) audio ratio times as long and shift it by semitones."""
+    data = np.asarray(data, dtype=np.float32)
+    factor = 2.0 ** (semitones / 12.0)
+    stretcher = ola_stretch if algorithm == ALGORITHM_PREVIEW else phase_vocoder
+    # Stretch further by the pitch factor, then resampling brings the length back and moves the pitch
+    stretched = stretcher(data, ratio * factor) if ratio * factor != 1.0 else data
+    return resample(stretched, factor) if factor != 1.0 else stretched
+
+
+def _render_to_file(path, ratio, semitones, algorithm, sample_rate, cache_path):
+    """Decode, stretch and save a render as .npy. Runs in a worker process."""
+    from sampler import decode
+
+    audio = stretch(decode(path, sample_rate), ratio, semitones, algorithm)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), prefix=".tmp-", suffix=".npy")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, audio)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+class TimeStretcher:
+    """Time-stretched and pitch-shifted renders of audio files, cached in memory and on disk.
+
+    Renders are keyed by the source's content digest, ratio, semitones and
+    algorithm, so returning to an earlier tempo, or the same loop under
+    another name, is a cache hit. High-quality renders run in worker
+    processes; until one is ready callers get a cheap overlap-add preview.
+    """
+
+    def __init__(self, cache_dir=STRETCH_CACHE_DIR, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET,
+                 max_workers=None, sample_rate=SAMPLE_RATE):
+        self.cache_dir = cache_dir
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.sample_rate = sample_rate
+        self._renders = OrderedDict()  # key -> (channels, frames) float32, least recently used first
+        self._bytes = 0
+        self._pending = {}  # key -> (future, [on_ready callbacks])
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def key(self, path, ratio, semitones=0.0, algorithm=ALGORITHM_PHASE_VOCODER):
+        from asset_store import default_store
+
+        return default_store().digest(path), round(ratio, RATIO_DIGITS), round(semitones, RATIO_DIGITS), algorithm
+
+    def _cache_path(self, key):
+        digest, ratio, semitones, algorithm = key
+        return os.path.join(self.cache_dir, f"{digest}-{ratio:.{RATIO_DIGITS}f}-{semitones:+.{RATIO_DIGITS}f}-"
+                                            f"{algorithm}-{self.sample_rate}.npy")
+
+    def _remember(self, key, audio):
+        with self._lock:
+            if key not in self._renders:
+                self._renders[key] = audio
+                self._bytes += audio.nbytes
+            self._renders.move_to_end(key)
+            while self._bytes > self.memory_budget and len(self._renders) > 1:
+                self._bytes -= self._renders.popitem(last=False)[1].nbytes
+
+    def _cached(self, key):
+        with self._lock:
+            audio = self._renders.get(key)
+            if audio is not None:
+                self._renders.move_to_end(key)
+                return audio
+        try:
+            audio = np.load(self._cache_path(key))
+        except (OSError, ValueError):
+            return None
+        os.utime(self._cache_path(key))  # Disk pruning drops the least recently used renders
+        self._remember(key, audio)
+        return audio
+
+    def get(self, path, ratio, semitones=0.0, on_ready=None):
+        """Return (audio, final) for path stretched by ratio and shifted by semitones.
+
+        On a cache miss a high-quality render is started in the background,
+        a preview is returned with final False, and on_ready(audio) is called
+        from a worker thread once the render is done.
+        """
+        from sampler import default_sample_cache
+
+        if round(ratio, RATIO_DIGITS) == 1.0 and round(semitones, RATIO_DIGITS) == 0.0:
+            return default_sample_cache().get(path), True
+        key = self.key(path, ratio, semitones)
+        audio = self._cached(key)
+        if audio is not None:
+            return audio, True
+
+        self._submit(path, key, on_ready)
+        preview_key = self.key(path, ratio, semitones, ALGORITHM_PREVIEW)
+        preview = self._cached(preview_key)
+        if preview is None:
+            preview = stretch(default_sample_cache().get(path), ratio, semitones, ALGORITHM_PREVIEW)
+            self._remember(preview_key, preview)
+        return preview, False
+
+    def _submit(self, path, key, on_ready):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending:
+                if on_ready:
+                    pending[1].append(on_ready)
+                return
+            # Renders of this source for other ratios that have not started yet are no longer wanted
+            superseded = [future for other, (future, _) in self._pending.items() if other[0] == key[0]]
+            if self._executor is None:
+                # Spawned rather than forked, the GUI process has Qt and audio threads running
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            _, ratio, semitones, algorithm = key
+            future = self._executor.submit(_render_to_file, path, ratio, semitones, algorithm, self.sample_rate,
+                                           self._cache_path(key))
+            self._pending[key] = (future, [on_ready] if on_ready else [])
+        future.add_done_callback(lambda future: self._finished(key, future))
+        # Outside the lock: cancelling runs _finished right away, which drops them from _pending
+        for other in superseded:
+            other.cancel()
+
+    def _finished(self, key, future):
+        with self._lock:
+            _, callbacks = self._pending.pop(key, (None, []))
+        if future.cancelled():
+            return
+        try:
+            audio = np.load(future.result())
+        except Exception as e:
+            logger.error(f"Time-stretch render failed: {e}")
+            return
+        self._remember(key, audio)
+        self.prune_disk()
+        for callback in callbacks:
+            callback(audio)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def prune_disk(self):
+        """Delete the least recently used renders beyond the disk budget."""
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".npy")
+                       and not entry.name.startswith(".tmp-")]
+        except OSError:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.disk_budget:
+                break
+            try:
+                os.remove(entry.path)
+                total -= entry.stat().st_size
+            except OSError:
+                pass
+
+    def memory_footprint(self):
+        return self._bytes, len(self._renders)
+
+    def shutdown(self):
+        """Cancel queued renders and let the worker processes exit. Caches stay, a later get() starts new workers."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time-stretch an audio file and time the algorithms.")
+    parser.add_argument("audio")
+    parser.add_argument("--ratio", type=float, default=1.25, help="Output length / input length")
+    parser.add_argument("--semitones", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the high-quality render to this .wav file")
+    args = parser.parse_args()
+
+    from sampler import decode
+
+    source = decode(args.audio, SAMPLE_RATE)
+    seconds = source.shape[1] / SAMPLE_RATE
+    for algorithm in (ALGORITHM_PREVIEW, ALGORITHM_PHASE_VOCODER):
+        started = time.perf_counter()
+        result = stretch(source, args.ratio, args.semitones, algorithm)
+        elapsed = time.perf_counter() - started
+        print(f"{algorithm:<14} {elapsed * 1000:8.1f} ms for {seconds:.1f} s of audio ({elapsed / seconds:.1%})")
+    if args.output:
+        import wave
+
+        with wave.open(args.output, "wb") as f:
+            f.setnchannels(result.shape[0])
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes((np.clip(result.T, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+    sys.exit(0)
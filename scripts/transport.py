@@ -0,0 +1,433 @@
+import time
+import bisect
+import threading
+import itertools
+import numpy as np
+from logger import logger
+
+SAMPLE_RATE = 44100
+BLOCK_SIZE = 512
+CHANNELS = 2
+DRIFT_CHECK_BLOCKS = 32  # Compare engine positions every this many blocks
+DRIFT_TOLERANCE = BLOCK_SIZE  # Samples an engine may be off before it is resynced
+POSITION_REPORT_MAX_AGE = 0.5  # Seconds after which a script's position report is ignored
+DAWDREAMER_PPQN = 960  # Resolution of the tempo automation handed to DAWDreamer
+
+_tempo_versions = itertools.count()  # Shared by every map, so no two maps or edits ever have the same version
+
+
+class TempoMap:
+    """Tempo changes and time signatures over time, indexed by beat.
+
+    Segment start times are precomputed so converting between beats, seconds
+    and samples is a binary search plus one multiplication. Edits build new
+    segment lists and swap them in with a single assignment, so the clock
+    thread can edit the map while the GUI reads it.
+    """
+
+    def __init__(self, bpm=120.0, numerator=4, denominator=4):
+        self._segments = ([0.0], [float(bpm)], [0.0])  # (beats, bpms, seconds) each tempo segment starts at
+        self._signatures = [(0.0, numerator, denominator)]
+        self.version = next(_tempo_versions)  # Changes on every edit so derived data (e.g. encoded MIDI) can refresh
+
+    def _set_segments(self, tempo_beats, tempo_bpms):
+        tempo_seconds = [0.0]
+        for i in range(1, len(tempo_beats)):
+            beats = tempo_beats[i] - tempo_beats[i - 1]
+            tempo_seconds.append(tempo_seconds[-1] + beats * 60.0 / tempo_bpms[i - 1])
+        self._segments = (tempo_beats, tempo_bpms, tempo_seconds)
+        self.version = next(_tempo_versions)
+
+    def set_tempo(self, beat, bpm):
+        """Set the tempo from beat onwards (until the next tempo change)."""
+        tempo_beats, tempo_bpms = list(self._segments[0]), list(self._segments[1])
+        i = bisect.bisect_left(tempo_beats, beat)
+        if i < len(tempo_beats) and tempo_beats[i] == beat:
+            tempo_bpms[i] = float(bpm)
+        else:
+            tempo_beats.insert(i, float(beat))
+            tempo_bpms.insert(i, float(bpm))
+        self._set_segments(tempo_beats, tempo_bpms)
+
+    def set_time_signature(self, beat, numerator, denominator):
+        signatures = [s for s in self._signatures if s[0] != beat] + [(float(beat), numerator, denominator)]
+        self._signatures = sorted(signatures)
+        self.version = next(_tempo_versions)
+
+    def assign(self, other):
+        """Take over every tempo change and time signature of another map, e.g. one restored by undo."""
+        tempo_beats, tempo_bpms, _ = other._segments
+        self._signatures = list(other._signatures)
+        self._set_segments(list(tempo_beats), list(tempo_bpms))
+
+    def clear_after(self, beat):
+        """Drop tempo changes after beat, e.g. before recording a new tempo live."""
+        tempo_beats, tempo_bpms, _ = self._segments
+        i = max(bisect.bisect_right(tempo_beats, beat), 1)
+        self._set_segments(tempo_beats[:i], tempo_bpms[:i])
+
+    def tempo_at(self, beat):
+        tempo_beats, tempo_bpms, _ = self._segments
+        return tempo_bpms[bisect.bisect_right(tempo_beats, beat) - 1]
+
+    def time_signature_at(self, beat):
+        signatures = self._signatures
+        i = bisect.bisect_right([s[0] for s in signatures], beat) - 1
+        return signatures[i][1:]
+
+    def beat_to_seconds(self, beat):
+        tempo_beats, tempo_bpms, tempo_seconds = self._segments
+        i = bisect.bisect_right(tempo_beats, beat) - 1
+        return tempo_seconds[i] + (beat - tempo_beats[i]) * 60.0 / tempo_bpms[i]
+
+    def seconds_to_beat(self, seconds):
+        tempo_beats, tempo_bpms, tempo_seconds = self._segments
+        i = bisect.bisect_right(tempo_seconds, seconds) - 1
+        return tempo_beats[i] + (seconds - tempo_seconds[i]) * tempo_bpms[i] / 60.0
+
+    def beats_to_seconds(self, beats):
+        """Vectorized beat_to_seconds for a NumPy array of beats."""
+        tempo_beats, tempo_bpms, tempo_seconds = self._segments
+        beats = np.asarray(beats, dtype=np.float64)
+        i = np.searchsorted(tempo_beats, beats, side="right") - 1
+        bpms = np.take(tempo_bpms, i)
+        return np.take(tempo_seconds, i) + (beats - np.take(tempo_beats, i)) * 60.0 / bpms
+
+    def seconds_to_beats(self, seconds):
+        """Vectorized seconds_to_beat for a NumPy array of seconds."""
+        tempo_beats, tempo_bpms, tempo_seconds = self._segments
+        seconds = np.asarray(seconds, dtype=np.float64)
+        i = np.searchsorted(tempo_seconds, seconds, side="right") - 1
+        bpms = np.take(tempo_bpms, i)
+        return np.take(tempo_beats, i) + (seconds - np.take(tempo_seconds, i)) * bpms / 60.0
+
+    def tempo_changes(self):
+        """[(beat, bpm)] of every tempo change, the first at beat 0."""
+        tempo_beats, tempo_bpms, _ = self._segments
+        return list(zip(tempo_beats, tempo_bpms))
+
+    def time_signatures(self):
+        """[(beat, numerator, denominator)] of every time signature change."""
+        return list(self._signatures)
+
+    def beat_to_sample(self, beat, sample_rate=SAMPLE_RATE):
+        return round(self.beat_to_seconds(beat) * sample_rate)
+
+    def sample_to_beat(self, sample, sample_rate=SAMPLE_RATE):
+        return self.seconds_to_beat(sample / sample_rate)
+
+    def bar_and_beat(self, beat):
+        """(bar, beat in bar), both zero based, honouring time signature changes."""
+        bar = 0
+        signatures = self._signatures
+        for i, (start, numerator, denominator) in enumerate(signatures):
+            end = signatures[i + 1][0] if i + 1 < len(signatures) else float("inf")
+            beats_per_bar = numerator * 4.0 / denominator
+            if beat < end:
+                return bar + int((beat - start) // beats_per_bar), (beat - start) % beats_per_bar
+            bar += int((end - start) // beats_per_bar)
+        return bar, 0.0
+
+    def to_json(self):
+        return {
+            "tempos": [list(change) for change in self.tempo_changes()],
+            "time_signatures": [list(s) for s in self.time_signatures()],
+        }
+
+    @classmethod
+    def from_json(cls, data, default_bpm=120.0):
+        tempo_map = cls(default_bpm)
+        for beat, bpm in (data or {}).get("tempos", []):
+            tempo_map.set_tempo(beat, bpm)
+        for beat, numerator, denominator in (data or {}).get("time_signatures", []):
+            tempo_map.set_time_signature(beat, numerator, denominator)
+        return tempo_map
+
+
+class TransportSink:
+    """Something that follows the transport: an audio engine, the MIDI clock, ChucK scripts.
+
+    on_tempo and on_position are called from the transport thread at block
+    boundaries. Sinks that run their own clock can implement position(),
+    returning the sample their clock is at right now, so the transport can
+    measure their drift and resync them once it exceeds drift_tolerance
+    samples.
+    """
+    drift_tolerance = DRIFT_TOLERANCE
+
+    def on_tempo(self, bpm, sample_position):
+        pass
+
+    def on_position(self, sample_position, beat):
+        pass
+
+    def on_block(self, sample_position, beat, block_size):
+        pass
+
+    def on_play(self, playing):
+        pass
+
+    def position(self):
+        return None
+
+
+class Transport:
+    """Central play position and tempo shared by every engine.
+
+    The position advances in whole blocks. Tempo changes requested at any time
+    are applied at the next block boundary and pushed to all sinks.
+    """
+
+    def __init__(self, tempo_map=None, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE):
+        self.tempo_map = tempo_map or TempoMap()
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.sample_position = 0
+        self.playing = False
+        self.sinks = ()  # Replaced rather than changed, so the clock thread can iterate it while the GUI edits
+        self.blocks = 0
+        self.max_drift = {}  # sink -> largest drift in samples seen
+        self.corrections = 0
+        self._pending_tempo = None
+        self._pending_map = None
+        self._pending_seek = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._origin = None  # (time.time(), sample position) the clock thread schedules from
+
+    @property
+    def beat(self):
+        return self.tempo_map.sample_to_beat(self.sample_position, self.sample_rate)
+
+    @property
+    def bpm(self):
+        return self.tempo_map.tempo_at(self.beat)
+
+    def add_sink(self, sink):
+        with self._lock:
+            self.sinks += (sink,)
+        sink.on_tempo(self.bpm, self.sample_position)
+        sink.on_position(self.sample_position, self.beat)
+        if self.playing:
+            sink.on_play(True)
+
+    def remove_sink(self, sink):
+        with self._lock:
+            sinks = self.sinks
+            self.sinks = tuple(s for s in sinks if s is not sink)
+        if sink in sinks:
+            if self.playing:
+                sink.on_play(False)
+
+    def set_tempo(self, bpm):
+        """Change the tempo from the next block boundary on."""
+        with self._lock:
+            self._pending_tempo = float(bpm)
+        if not self.playing:
+            self._apply_pending()
+
+    def set_tempo_map(self, tempo_map):
+        """Replace the tempo map's contents with those of tempo_map from the next block boundary on."""
+        with self._lock:
+            self._pending_map = tempo_map
+        if not self.playing:
+            self._apply_pending()
+
+    def seek(self, beat):
+        with self._lock:
+            self._pending_seek = self.tempo_map.beat_to_sample(beat, self.sample_rate)
+        if not self.playing:
+            self._apply_pending()
+
+    def _apply_pending(self):
+        """Apply a queued seek and tempo change. Returns whether the position jumped."""
+        with self._lock:
+            tempo, self._pending_tempo = self._pending_tempo, None
+            tempo_map, self._pending_map = self._pending_map, None
+            seek, self._pending_seek = self._pending_seek, None
+        if seek is not None:
+            self.sample_position = seek
+            for sink in self.sinks:
+                sink.on_position(self.sample_position, self.beat)
+        if tempo_map is not None:
+            self.tempo_map.assign(tempo_map)
+            for sink in self.sinks:
+                sink.on_tempo(self.bpm, self.sample_position)
+        if tempo is not None:
+            beat = self.beat
+            # Later changes of the previous map would no longer line up with the new tempo
+            self.tempo_map.clear_after(beat)
+            self.tempo_map.set_tempo(beat, tempo)
+            for sink in self.sinks:
+                sink.on_tempo(tempo, self.sample_position)
+        return seek is not None
+
+    def process_block(self):
+        """Advance by one block. Called by the clock thread or an offline renderer."""
+        self._apply_pending()
+        beat = self.beat
+        for sink in self.sinks:
+            sink.on_block(self.sample_position, beat, self.block_size)
+        self.sample_position += self.block_size
+        self.blocks += 1
+        if self.blocks % DRIFT_CHECK_BLOCKS == 0:
+            self.check_drift()
+
+    def check_drift(self):
+        """Measure each sink's distance from the transport position and resync those too far off."""
+        # Sinks get a block when it starts playing, so the wall clock is at the start of the last block
+        reference = self.sample_position - self.block_size
+        drift = {}
+        for sink in self.sinks:
+            position = sink.position()
+            if position is None:
+                continue
+            drift[sink] = position - reference
+            self.max_drift[sink] = max(self.max_drift.get(sink, 0), abs(drift[sink]))
+            if abs(drift[sink]) > sink.drift_tolerance:
+                logger.debug(f"Resyncing {type(sink).__name__}, drift {drift[sink]} samples")
+                sink.on_position(self.sample_position, self.beat)
+                self.corrections += 1
+        return drift
+
+    def wall_time(self):
+        """Wall clock time (time.time()) of the block the transport is playing, e.g. for OSC timetags."""
+        origin = self._origin
+        if not self.playing or origin is None:
+            return time.time()
+        # The first block is handed out one block after the clock starts, as it starts playing
+        return origin[0] + (self.sample_position - origin[1]) / self.sample_rate
+
+    def _run(self):
+        block_seconds = self.block_size / self.sample_rate
+        started = time.monotonic()
+        start_sample = self.sample_position
+        self._origin = (time.time(), start_sample)
+        while self.playing:
+            # Schedule against the start time rather than sleeping a fixed amount,
+            # so timer jitter never accumulates into drift against the wall clock
+            due = (time.monotonic() - started) / block_seconds - (self.sample_position - start_sample) / self.block_size
+            if due >= 1:
+                if self._apply_pending():
+                    # A seek starts a new timeline, measured from the moment it was applied
+                    started, start_sample = time.monotonic(), self.sample_position
+                    self._origin = (time.time(), start_sample)
+                    continue
+                self.process_block()
+            else:
+                time.sleep(block_seconds * (1 - due))
+
+    def play(self):
+        if self.playing:
+            return
+        self.playing = True
+        for sink in self.sinks:
+            sink.on_play(True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.playing:
+            return
+        self.playing = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        for sink in self.sinks:
+            sink.on_play(False)
+
+
+class ChucKTransportSink(TransportSink):
+    """Sends tempo and beat position to running ChucK scripts through the OSC control bridge.
+
+    ChucK keeps its own time. Scripts report the beat they are at back to
+    the bridge, which gives the transport their real position; scripts that
+    never report are re-sent the beat every resync_blocks blocks instead.
+    Scripts started later are caught up on the next block.
+    """
+
+    def __init__(self, chuck_manager, tempo_map=None, sample_rate=SAMPLE_RATE, resync_blocks=DRIFT_CHECK_BLOCKS):
+        self.chuck_manager = chuck_manager
+        self.tempo_map = tempo_map
+        self.sample_rate = sample_rate
+        self.resync_blocks = resync_blocks
+        self.bpm = None
+        self._blocks = 0
+        self._synced = set()
+        self._synced_at = 0.0  # Reports sent before the scripts got the last beat are stale
+        self._block_start = None
+
+    def _send(self, handles, name, value):
+        for handle in handles:
+            self.chuck_manager.control.set_param(handle, name, value)
+
+    def on_tempo(self, bpm, sample_position):
+        self.bpm = bpm
+        self._send(list(self.chuck_manager.processes), "tempo", bpm)
+
+    def on_position(self, sample_position, beat):
+        self._send(list(self.chuck_manager.processes), "beat", beat)
+        self._synced_at = time.monotonic()
+
+    def on_block(self, sample_position, beat, block_size):
+        self._block_start = sample_position
+        handles = set(self.chuck_manager.processes)
+        new = handles - self._synced
+        self._synced = handles
+        self._blocks += 1
+        if self._blocks % self.resync_blocks == 0:
+            new = handles - set(self.chuck_manager.control.positions)
+        if new and self.bpm is not None:
+            self._send(new, "tempo", self.bpm)
+        self._send(new, "beat", beat)
+
+    def position(self):
+        """Where the script furthest off is, extrapolated from its last position report."""
+        if self.tempo_map is None or self._block_start is None:
+            return None
+        now = time.monotonic()
+        settle = self._synced_at + 2.0 / self.chuck_manager.control.control_rate
+        positions = []
+        for handle in list(self.chuck_manager.processes):
+            report = self.chuck_manager.control.positions.get(handle)
+            if report is None:
+                continue
+            beat, received = report
+            if received < settle or now - received > POSITION_REPORT_MAX_AGE:
+                continue
+            positions.append(self.tempo_map.beat_to_sample(beat, self.sample_rate)
+                             + round((now - received) * self.sample_rate))
+        if not positions:
+            return None
+        return max(positions, key=lambda position: abs(position - self._block_start))
+
+
+class DawDreamerTransportSink(TransportSink):
+    """Keeps a DAWDreamer RenderEngine's tempo in step with the transport.
+
+    The whole tempo map is handed over as bpm automation, so renders follow
+    tempo changes. DAWDreamer renders offline and has no clock of its own
+    running alongside the transport, so there is no position to measure
+    drift against.
+    """
+
+    def __init__(self, engine, tempo_map, sample_rate=SAMPLE_RATE, ppqn=DAWDREAMER_PPQN):
+        self.engine = engine
+        self.tempo_map = tempo_map
+        self.sample_rate = sample_rate
+        self.ppqn = ppqn
+
+    def _send_tempo_map(self):
+        changes = self.tempo_map.tempo_changes()
+        if len(changes) == 1:
+            self.engine.set_bpm(changes[0][1])
+        else:
+            beats, bpms = np.array(changes).T
+            ticks = np.arange(int(beats[-1] * self.ppqn) + 1) / self.ppqn
+            self.engine.set_bpm(bpms[np.searchsorted(beats, ticks, side="right") - 1], ppqn=self.ppqn)
+
+    def on_tempo(self, bpm, sample_position):
+        self._send_tempo_map()
+
+    def on_position(self, sample_position, beat):
+        self._send_tempo_map()
@@ -9,6 +9,7 @@ sys.path.append(os.path.expanduser("~/pydaw/scripts"))
 from PySide6.QtWidgets import QFileDialog, QInputDialog, QMessageBox, QApplication, QWidget, QVBoxLayout, QListWidget, QLabel, QPushButton
 from workspace import open_workspace_window  # Import the function from workspace.py
 from config import WORKSPACES_DIR
+from asset_store import default_store
 
 app = QApplication(sys.argv)
 
@@ -26,6 +27,8 @@ def create_new_workspace():
             manifest_data = {"tracks": [], "vst_plugins": [], "chuck_scripts": []}
             with open(os.path.join(workspace_path, "manifest.json"), "w") as f:
                 json.dump(manifest_data, f, indent=4)
+            # Instruments are added through the shared asset store, whose GC must know the workspace
+            default_store().register_workspace(workspace_path)
 
             open_workspace_window(workspace_name, workspace_path)
         except FileExistsError:
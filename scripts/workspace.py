@@ -1,15 +1,72 @@
 import os
+import json
+import html
 import subprocess
 import wave
 import threading
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from PySide6.QtWidgets import (
-    QApplication, QMainWindow, QDockWidget, QToolBar, QLineEdit, QMenu, QListWidget,
-    QVBoxLayout, QLabel, QWidget, QPushButton, QDialog, QSpinBox, QTextEdit, QSizePolicy, QSlider
+    QApplication, QMainWindow, QFileDialog, QDockWidget, QToolBar, QLineEdit, QMenu, QListWidget, QListView,
+    QVBoxLayout, QLabel, QWidget, QPushButton, QDialog, QSpinBox, QTextEdit, QSizePolicy, QSlider, QMessageBox
 )
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QIcon, QAction, QMouseEvent
+from PySide6.QtCore import Qt, Signal, QTimer, QEvent, QThread
+from PySide6.QtGui import QIcon, QAction, QMouseEvent, QKeySequence
+from logger import logger
 from chuck_handler import ChucKManager
+from instrument_index import AUDIO_EXTENSIONS, CHUCK_EXTENSIONS
+from instrument_model import InstrumentListModel, EntryRole
+from history import ProjectHistory, thaw
+from asset_store import default_store
+from archive import export_workspace, ARCHIVE_EXTENSION
+from transport import Transport, TempoMap, ChucKTransportSink, DawDreamerTransportSink, SAMPLE_RATE
+from midi_handler import MidiClockSink
+from metering import MeterEngine, MetersPanel
+from memory_accounting import default_accountant, format_report, MB
+from sampler import Sampler, default_sample_cache
+from timestretch import default_stretcher, source_tempo
+from session import default_session
+
+
+MEMORY_CHECK_INTERVAL = 30000  # Milliseconds between memory budget checks
+# Per-workspace memory budgets in bytes, a warning is logged when one is exceeded
+MEMORY_BUDGETS = {
+    "console": 16 * MB,
+    "chuck_processes": 1 * MB,
+    "sampler": 256 * MB,
+    "instrument_model": 32 * MB,
+    "meters": 32 * MB,
+}
+ROOT_NOTE = 60  # Key an auditioned sample plays at its original pitch
+LOOP_MIN_SECONDS = 2.0  # Audio files at least this long are loops that follow the project tempo
+# Computer keyboard piano for the instrument library, two rows starting at ROOT_NOTE
+KEYBOARD_NOTES = {
+    Qt.Key_A: 0, Qt.Key_W: 1, Qt.Key_S: 2, Qt.Key_E: 3, Qt.Key_D: 4, Qt.Key_F: 5, Qt.Key_T: 6, Qt.Key_G: 7,
+    Qt.Key_Y: 8, Qt.Key_H: 9, Qt.Key_U: 10, Qt.Key_J: 11, Qt.Key_K: 12, Qt.Key_O: 13, Qt.Key_L: 14,
+}
+
+
+class BackgroundTask(QThread):
+    """Runs function(*args) on its own thread and reports the outcome back through signals.
+
+    Slots connected to succeeded and failed run on the GUI thread.
+    """
+    succeeded = Signal(object)
+    failed = Signal(str)
+
+    def __init__(self, function, *args, parent=None):
+        super().__init__(parent)
+        self.function = function
+        self.args = args
+
+    def run(self):
+        try:
+            result = self.function(*self.args)
+        except Exception as e:
+            logger.error(f"{getattr(self.function, '__name__', 'Background task')} failed: {e}")
+            self.failed.emit(str(e))
+        else:
+            self.succeeded.emit(result)
 
 
 class ChucKConsole(QTextEdit):
@@ -30,90 +87,240 @@ class ChucKConsole(QTextEdit):
         self.append(f"<span style='color: red;'>ERROR: {sanitized_error_message}</span>")
 
 class InstrumentLibrary(QWidget):
-    """Instrument Library to display and load ChucK scripts and play audio files."""
-    def __init__(self, chuck_manager, workspace_instruments_dir, global_instruments_dir, console, parent=None):
+    """Instrument Library to display and load ChucK scripts and play audio files through the sampler."""
+    index_ready = Signal()
+    index_failed = Signal(str)
+    sample_decoded = Signal(str, object, int, int)
+    stretch_ready = Signal(str, float, object, bool)
+    audio_status = Signal(str)
+    audio_failed = Signal(str)
+
+    def __init__(self, session, chuck_manager, workspace_instruments_dir, console, sampler, tempo=120, parent=None):
         super().__init__(parent)
+        self.session = session
         self.chuck_manager = chuck_manager
+        self.sampler = sampler
+        self.sampler_output = session.sampler_output
+        self.tempo = tempo
         self.workspace_instruments_dir = os.path.expanduser(workspace_instruments_dir)
-        self.global_instruments_dir = os.path.expanduser(global_instruments_dir)
+        self.global_instruments_dir = session.global_instruments_dir
         self.console = console  # Reference to the ChucK console
         self.setWindowTitle("Instrument Library")
 
-        # Dictionary to track audio playback subprocesses
-        self.audio_processes = {}
+        # File path -> sampler zone of every audio file auditioned so far
+        self.sample_zones = {}
+        # Loops follow the project tempo: file path -> tempo it was recorded at, and the ratio it is stretched by
+        self.stretcher = default_stretcher()
+        self.sample_tempos = {}
+        self.stretch_ratios = {}
+        self.final_ratios = {}  # File path -> ratio whose finished render is in the sampler
+        # Decoding and preview stretches run here, one at a time so a loop is decoded before it's stretched
+        self.audio_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio")
+        self.sample_decoded.connect(self.on_sample_decoded)
+        self.stretch_ready.connect(self.on_stretch_ready)
+        self.audio_status.connect(self.console.log)
+        self.audio_failed.connect(self.console.log_error)
+
+        # Metadata index shared with the other open workspaces, rebuilt in the background so the
+        # library shows up immediately. Searches are restricted to this workspace and the global library.
+        self.session.add_library_dir(self.workspace_instruments_dir)
+        self.index = self.session.index
+        self.index_ready.connect(self.apply_search)
+        self.index_failed.connect(self.console.log_error)
 
         self.layout = QVBoxLayout()
-        self.instrument_list = QListWidget()
-        self.load_instruments()
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("Search (e.g. stereo, >10 s, uses LiSa)")
+        self.search_box.setEnabled(False)
+        self.search_box.textChanged.connect(self.apply_search)
+        self.layout.addWidget(self.search_box)
+
+        self.instrument_model = InstrumentListModel(
+            [("Workspace", self.workspace_instruments_dir), ("Global", self.global_instruments_dir)]
+        )
+        self.instrument_list = QListView()
+        self.instrument_list.setUniformItemSizes(True)  # Lets the view skip measuring every row
+        self.instrument_list.setModel(self.instrument_model)
+        self.instrument_list.installEventFilter(self)  # Keyboard piano for the last auditioned sample
         self.layout.addWidget(self.instrument_list)
 
+        self.status_label = QLabel("No instruments or audio files found.")
+        self.layout.addWidget(self.status_label)
+        self.load_instruments()
+
         self.load_button = QPushButton("Load Instrument")
         self.load_button.clicked.connect(self.load_selected_item)
         self.layout.addWidget(self.load_button)
 
+        self.add_to_workspace_button = QPushButton("Add to Workspace")
+        self.add_to_workspace_button.clicked.connect(self.add_selected_to_workspace)
+        self.layout.addWidget(self.add_to_workspace_button)
+
         self.setLayout(self.layout)
 
     def load_instruments(self):
-        """Load all .ck and audio files from both the workspace and global instruments directories."""
-        self.instrument_list.clear()
-
-        # Load instruments from the workspace directory
-        if os.path.exists(self.workspace_instruments_dir):
-            self._load_items_from_directory(self.workspace_instruments_dir, "Workspace")
-
-        # Load instruments from the global directory
-        if os.path.exists(self.global_instruments_dir):
-            self._load_items_from_directory(self.global_instruments_dir, "Global")
-
-        if self.instrument_list.count() == 0:
-            self.instrument_list.addItem("No instruments or audio files found.")
+        """Rescan the workspace and global instruments directories. Rows are fetched lazily by the view."""
+        self.instrument_model.rescan()
+        self._update_status()
+        threading.Thread(target=self._build_index, daemon=True).start()
 
-    def _load_items_from_directory(self, directory, source_label):
-        """Helper function to load .ck and audio files from a specific directory."""
-        for root, _, files in os.walk(directory):
-            for filename in files:
-                if filename.endswith(".ck") or filename.endswith((".wav", ".mp3", ".ogg")):
-                    relative_path = os.path.relpath(os.path.join(root, filename), directory)
-                    self.instrument_list.addItem(f"[{source_label}] {relative_path}")
+    def _build_index(self):
+        """Extract metadata for every library file not indexed yet. Runs on a worker thread."""
+        try:
+            self.index = self.session.rebuild_index()
+        except Exception as e:
+            self.index_failed.emit(f"Error indexing instrument library: {e}")
+            return
+        self.index_ready.emit()
+
+    def apply_search(self):
+        """Show only the library entries matching the search box query."""
+        self.search_box.setEnabled(True)
+        index = self.index
+        sources = index.source_ids([self.workspace_instruments_dir, self.global_instruments_dir])
+        self.instrument_model.show_index_results(index, index.search(self.search_box.text(), sources))
+        self._update_status()
+
+    def _update_status(self):
+        """Show the status label only when there is nothing to list."""
+        if self.instrument_model.canFetchMore():
+            self.instrument_model.fetchMore()
+        self.status_label.setVisible(self.instrument_model.is_empty())
 
     def load_selected_item(self):
         """Load the selected item and either run its ChucK script or play its audio file."""
-        selected_item = self.instrument_list.currentItem()
-        if selected_item:
-            item_text = selected_item.text()
-            if item_text.startswith("[Workspace]"):
-                base_dir = self.workspace_instruments_dir
-                relative_path = item_text.replace("[Workspace] ", "")
-            elif item_text.startswith("[Global]"):
-                base_dir = self.global_instruments_dir
-                relative_path = item_text.replace("[Global] ", "")
-            else:
-                return
+        entry = self.instrument_list.currentIndex().data(EntryRole)
+        if entry:
+            _, _, file_path = entry
 
-            file_path = os.path.join(base_dir, relative_path)
-
-            if file_path.endswith(".ck"):
+            if file_path.endswith(CHUCK_EXTENSIONS):
                 # Run the ChucK script
                 self.chuck_manager.run_script(file_path)
                 self.console.log(f"Running ChucK script: {file_path}")
-            elif file_path.endswith((".wav", ".mp3", ".ogg")):
+            elif file_path.endswith(AUDIO_EXTENSIONS):
                 # Play the audio file
                 self.play_audio(file_path)
                 self.console.log(f"Playing audio file: {file_path}")
 
-    def play_audio(self, file_path):
-        """Play an audio file in a separate subprocess."""
+    def add_selected_to_workspace(self):
+        """Link the selected global library file into the workspace through the shared asset store."""
+        entry = self.instrument_list.currentIndex().data(EntryRole)
+        if not entry or entry[0] != "Global":
+            return
+        _, relative_path, file_path = entry
+        workspace_path = os.path.dirname(self.workspace_instruments_dir)
+        try:
+            default_store().add_to_workspace(workspace_path, file_path, os.path.join("instruments", relative_path))
+            self.console.log(f"Added {relative_path} to the workspace")
+        except OSError as e:
+            self.console.log_error(f"Error adding {relative_path} to the workspace: {e}")
+            return
+        self.load_instruments()
+
+    def play_audio(self, file_path, pitch=ROOT_NOTE, velocity=100):
+        """Map an audio file across the keyboard of the sampler and play it, once it's decoded on the worker."""
+        zone = self.sample_zones.get(file_path)
+        if zone is None:
+            self.audio_worker.submit(self._decode, file_path, pitch, velocity)
+            return
+        self._play_zone(zone, pitch, velocity)
+
+    def _play_zone(self, zone, pitch, velocity):
+        try:
+            self.sampler.map_keys(zone)
+            self.sampler_output.start()
+            self.sampler.note_on(pitch, velocity)
+        except Exception as e:
+            self.console.log_error(f"Error playing audio: {e}")
+
+    def _decode(self, file_path, pitch, velocity):
+        """Decode a file into the shared sample cache. Runs on the audio worker."""
         try:
-            # Start a new subprocess to play the audio file using ffplay
-            process = subprocess.Popen(
-                ["ffplay", "-nodisp", "-autoexit", file_path],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
+            audio = default_sample_cache().get(file_path)
+        except Exception as e:
+            self.audio_failed.emit(f"Error playing audio file {file_path}: {e}")
+            return
+        self.sample_decoded.emit(file_path, audio, pitch, velocity)
+
+    def on_sample_decoded(self, file_path, audio, pitch, velocity):
+        zone = self.sample_zones.get(file_path)
+        if zone is None:
+            zone = self.sample_zones[file_path] = self.sampler.add_zone(audio, root=ROOT_NOTE)
+            self.track_tempo(file_path, audio)
+        self._play_zone(zone, pitch, velocity)
+
+    def track_tempo(self, file_path, audio):
+        """Make a loop follow the project tempo from now on.
+
+        Its own tempo comes from the file name, otherwise the project tempo
+        at the time it is first played is taken as the tempo it fits.
+        """
+        tempo = source_tempo(file_path)
+        if tempo is None and audio.shape[1] >= LOOP_MIN_SECONDS * SAMPLE_RATE:
+            tempo = self.tempo
+        if tempo:
+            self.sample_tempos[file_path] = tempo
+            self.follow_tempo(file_path)
+
+    def set_tempo(self, tempo):
+        """Stretch every loop played so far to a new project tempo."""
+        self.tempo = tempo
+        for file_path in self.sample_tempos:
+            self.follow_tempo(file_path)
+
+    def follow_tempo(self, file_path):
+        """Swap a loop's sampler zone for a render at the project tempo, a preview until that is ready."""
+        ratio = self.sample_tempos[file_path] / self.tempo
+        if self.stretch_ratios.get(file_path, 1.0) == ratio:
+            return
+        self.stretch_ratios[file_path] = ratio
+        self.final_ratios.pop(file_path, None)
+        self.audio_worker.submit(self._stretch, file_path, ratio)
+
+    def _stretch(self, file_path, ratio):
+        """Look up a render, or start one and stretch a preview meanwhile. Runs on the audio worker."""
+        if self.stretch_ratios.get(file_path) != ratio:
+            return  # The tempo changed again before this got its turn
+        try:
+            audio, final = self.stretcher.get(
+                file_path, ratio, on_ready=lambda audio: self.stretch_ready.emit(file_path, ratio, audio, True)
             )
-            # Store the process in the dictionary
-            self.audio_processes[file_path] = process
         except Exception as e:
-            self.console.log_error(f"Error playing audio file {file_path}: {e}")
+            self.audio_failed.emit(f"Error time-stretching {file_path}: {e}")
+            return
+        self.stretch_ready.emit(file_path, ratio, audio, final)
+        if not final:
+            tempo = self.sample_tempos[file_path] / ratio
+            self.audio_status.emit(f"Rendering {os.path.basename(file_path)} at {tempo:g} BPM, previewing meanwhile")
+
+    def on_stretch_ready(self, file_path, ratio, audio, final):
+        """Swap in a render or preview unless the tempo has moved on, or the finished render is already in."""
+        if self.stretch_ratios.get(file_path) != ratio or self.final_ratios.get(file_path) == ratio:
+            return
+        if final:
+            self.final_ratios[file_path] = ratio
+        self.sampler.replace_zone(self.sample_zones[file_path], audio)
+
+    def close_library(self):
+        """Leave the shared index when the workspace closes."""
+        self.session.remove_library_dir(self.workspace_instruments_dir)
+        self.audio_worker.shutdown(wait=True, cancel_futures=True)
+
+    def eventFilter(self, watched, event):
+        """Play the last auditioned sample from the computer keyboard while the list has focus."""
+        if event.type() in (QEvent.KeyPress, QEvent.KeyRelease) and event.key() in KEYBOARD_NOTES \
+                and not event.modifiers() & ~Qt.KeypadModifier:
+            if not self.sample_zones:
+                return False  # Nothing to play yet, leave the key to type-ahead search
+            if not event.isAutoRepeat():
+                pitch = ROOT_NOTE + KEYBOARD_NOTES[event.key()]
+                if event.type() == QEvent.KeyPress:
+                    self.sampler_output.start()
+                    self.sampler.note_on(pitch)
+                else:
+                    self.sampler.note_off(pitch)
+            return True
+        return super().eventFilter(watched, event)
 
 
 class ViewsWindow(QDialog):
@@ -127,12 +334,53 @@ class ViewsWindow(QDialog):
         self.console_button = QPushButton("Toggle Console")
         self.instrument_library_button = QPushButton("Toggle Instrument Library")
         self.timeline_button = QPushButton("Toggle Timeline")
+        self.meters_button = QPushButton("Toggle Meters")
 
         self.layout.addWidget(self.console_button)
         self.layout.addWidget(self.instrument_library_button)
         self.layout.addWidget(self.timeline_button)
+        self.layout.addWidget(self.meters_button)
+
+        self.setLayout(self.layout)
+
+
+class MemoryReportDialog(QDialog):
+    """Shows the memory accounting report and saves it as JSON for bug reports."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Memory Report")
+        self.setGeometry(300, 300, 800, 500)
+
+        self.layout = QVBoxLayout()
+        self.text = QTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFontFamily("monospace")
+        self.layout.addWidget(self.text)
+
+        self.refresh_button = QPushButton("Refresh")
+        self.refresh_button.clicked.connect(self.refresh)
+        self.layout.addWidget(self.refresh_button)
+
+        self.save_button = QPushButton("Save as JSON...")
+        self.save_button.clicked.connect(self.save)
+        self.layout.addWidget(self.save_button)
 
         self.setLayout(self.layout)
+        self.baseline = None  # Snapshot of the previous refresh, growth before that is since tracing started
+        self.refresh()
+
+    def refresh(self):
+        """Measure again and show the growth since the previous refresh."""
+        accountant = default_accountant()
+        report = accountant.report(include_diff=False)
+        report["allocation_growth"] = accountant.snapshot_diff(baseline=self.baseline)
+        self.baseline = accountant.snapshot()
+        self.text.setPlainText(format_report(report))
+
+    def save(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save Memory Report", "pydaw-memory.json", "JSON (*.json)")
+        if path:
+            default_accountant().dump(path)
 
 
 class Timeline(QWidget):
@@ -182,9 +430,15 @@ class TempoDialog(QDialog):
 
 
 class WorkspaceWindow(QMainWindow):
-    """Main workspace window for managing audio and MIDI clips."""
-    def __init__(self, workspace_name="New Workspace", workspace_path=""):
+    """Main workspace window for managing audio and MIDI clips.
+
+    Several can be open at once; they share the engine and caches of one Session.
+    """
+    asset_gc_finished = Signal(int, int)  # Blobs removed, bytes freed
+
+    def __init__(self, workspace_name="New Workspace", workspace_path="", session=None):
         super().__init__()
+        self.session = session or default_session()
         self.setWindowTitle(f"{workspace_name} - PyDAW Workspace")
         self.workspace_path = workspace_path
         self.setGeometry(200, 200, 1200, 800)
@@ -192,10 +446,29 @@ class WorkspaceWindow(QMainWindow):
 
         # Initialize ChucKManager
         self.chuck_console = ChucKConsole()  # Separate ChucK console widget
-        self.chuck_manager = ChucKManager(console=self.chuck_console)
+        self.chuck_manager = ChucKManager(console=self.chuck_console, supervisor=self.session.supervisor,
+                                          control=self.session.control)
+
+        # Project state with undo/redo, loaded from the workspace manifest
+        self.history = ProjectHistory(self.load_manifest(), on_change=self.on_history_changed,
+                                      load_blob=default_store().read_bytes)
 
         # Default tempo
-        self.tempo = 120
+        self.tempo = self.history.get(("tempo",), 120)
+
+        # Transport shared by every engine, it pushes tempo and position to all of them.
+        # A saved tempo map already holds the tempo, setting it again would drop its later changes
+        self.tempo_map_state = self.history.get(("tempo_map",))  # The map the transport follows, as in the history
+        self.transport = Transport(TempoMap.from_json(thaw(self.tempo_map_state), self.tempo))
+        self.add_transport_sinks()
+
+        # Level and spectrum analysis off the GUI thread, audio sources push into meter_engine.tap(name)
+        self.meter_engine = MeterEngine()
+
+        # Sampler for auditioning and playing samples, mixed into the session's output
+        self.sampler = Sampler(tap=self.meter_engine.tap("sampler"))
+        self.sampler_output = self.session.sampler_output
+        self.sampler_output.add(self.sampler)
 
         # Toolbar
         self.toolbar = QToolBar("Main Toolbar")
@@ -209,6 +482,20 @@ class WorkspaceWindow(QMainWindow):
 
         # Last opened ChucK script
         self.last_opened_script = None
+        self.export_task = None
+
+        self.add_tools_menu()
+
+        # Memory accounting, see the Debug menu
+        self.add_debug_menu()
+        self.console_footprint = (0, 0)
+        self.memory_check_task = None
+        self.register_memory_accounting()
+        self.memory_timer = QTimer(self)
+        self.memory_timer.timeout.connect(self.check_memory)
+        self.memory_timer.start(MEMORY_CHECK_INTERVAL)
+
+        self.session.add_window(self)
 
         # Set the main layout
         self.setCentralWidget(self.chuck_console)
@@ -225,11 +512,35 @@ class WorkspaceWindow(QMainWindow):
         self.tempo_display.mousePressEvent = self.open_tempo_dialog_event
         self.toolbar.addWidget(self.tempo_display)
 
+        # Play / Stop transport button
+        self.play_action = QAction("Play", self)
+        self.play_action.setShortcut(Qt.Key_Space)
+        self.play_action.triggered.connect(self.toggle_transport)
+        self.toolbar.addAction(self.play_action)
+
         # Save button
         save_action = QAction("Save", self)
+        save_action.setShortcut(QKeySequence.Save)
         save_action.triggered.connect(self.save_workspace)
         self.toolbar.addAction(save_action)
 
+        # Export button
+        export_action = QAction("Export", self)
+        export_action.triggered.connect(self.export_workspace)
+        self.toolbar.addAction(export_action)
+
+        # Undo / Redo buttons
+        self.undo_action = QAction("Undo", self)
+        self.undo_action.setShortcut(QKeySequence.Undo)
+        self.undo_action.triggered.connect(self.history.undo)
+        self.toolbar.addAction(self.undo_action)
+
+        self.redo_action = QAction("Redo", self)
+        self.redo_action.setShortcut(QKeySequence.Redo)
+        self.redo_action.triggered.connect(self.history.redo)
+        self.toolbar.addAction(self.redo_action)
+        self.update_undo_actions()
+
         # Stop All Scripts button
         stop_all_action = QAction("Stop All Scripts", self)
         stop_all_action.triggered.connect(self.chuck_manager.stop_all_scripts)
@@ -254,10 +565,12 @@ class WorkspaceWindow(QMainWindow):
 
         # Instrument Library
         self.instrument_library = InstrumentLibrary(
+            self.session,
             self.chuck_manager,
             workspace_instruments_dir=os.path.join(self.workspace_path, "instruments"),
-            global_instruments_dir="~/pydaw/instruments",
-            console=self.chuck_console
+            console=self.chuck_console,
+            sampler=self.sampler,
+            tempo=self.tempo
         )
         self.instrument_library_dock = QDockWidget("Instrument Library", self)
         self.instrument_library_dock.setWidget(self.instrument_library)
@@ -269,10 +582,214 @@ class WorkspaceWindow(QMainWindow):
         self.timeline_dock.setWidget(self.timeline)
         self.addDockWidget(Qt.TopDockWidgetArea, self.timeline_dock)
 
+        # Meters
+        self.meters_panel = MetersPanel(self.meter_engine)
+        self.meters_dock = QDockWidget("Meters", self)
+        self.meters_dock.setWidget(self.meters_panel)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.meters_dock)
+        self.meter_engine.start()
+
+    def manifest_path(self):
+        return os.path.join(self.workspace_path, "manifest.json")
+
+    def load_manifest(self):
+        """Load the workspace manifest, falling back to an empty project."""
+        manifest = {"tracks": [], "vst_plugins": [], "chuck_scripts": []}
+        if os.path.exists(self.manifest_path()):
+            try:
+                with open(self.manifest_path(), "r") as f:
+                    manifest.update(json.load(f))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.error(f"Failed to load manifest {self.manifest_path()}: {e}")
+        return manifest
+
     def save_workspace(self):
         """Save the current workspace."""
-        # Placeholder for save functionality
-        print("Workspace saved.")
+        try:
+            # Binary payloads go to the asset store, the manifest keeps their digests
+            manifest = thaw(self.history.state, save_blob=default_store().put_bytes)
+            with open(self.manifest_path(), "w") as f:
+                json.dump(manifest, f, indent=4)
+            print("Workspace saved.")
+        except OSError as e:
+            self.chuck_console.log_error(f"Failed to save workspace: {e}")
+
+    def add_tools_menu(self):
+        """Add the Tools menu with asset store maintenance."""
+        tools_menu = self.menuBar().addMenu("Tools")
+        gc_action = QAction("Clean Up Asset Store...", self)
+        gc_action.triggered.connect(self.collect_asset_garbage)
+        tools_menu.addAction(gc_action)
+        self.asset_gc_finished.connect(self.on_asset_gc_finished)
+
+    def collect_asset_garbage(self):
+        """Delete stored samples no workspace uses any more, in the background."""
+        answer = QMessageBox.question(self, "Clean Up Asset Store",
+                                      "Delete stored files that no workspace references any more?")
+        if answer != QMessageBox.Yes:
+            return
+        self.save_workspace()  # Blobs only referenced by unsaved history must be in the manifest first
+        self.chuck_console.log("Cleaning up the asset store...")
+
+        def collect():
+            try:
+                self.asset_gc_finished.emit(*default_store().collect_garbage())
+            except OSError as e:
+                logger.error(f"Asset store cleanup failed: {e}")
+                self.asset_gc_finished.emit(-1, 0)
+
+        threading.Thread(target=collect, daemon=True).start()
+
+    def on_asset_gc_finished(self, removed, freed):
+        if removed < 0:
+            self.chuck_console.log_error("Asset store cleanup failed, see the log for details.")
+        else:
+            self.chuck_console.log(f"Asset store cleanup removed {removed} files, {freed / MB:.1f} MB freed.")
+
+    def add_debug_menu(self):
+        """Add the Debug menu with memory reports and allocation tracing."""
+        debug_menu = self.menuBar().addMenu("Debug")
+
+        report_action = QAction("Memory Report...", self)
+        report_action.triggered.connect(lambda: MemoryReportDialog(self).exec())
+        debug_menu.addAction(report_action)
+
+        self.trace_action = QAction("Trace Allocations", self)
+        self.trace_action.setCheckable(True)
+        self.trace_action.setChecked(default_accountant().tracing)
+        self.trace_action.toggled.connect(self.toggle_allocation_tracing)
+        debug_menu.addAction(self.trace_action)
+
+        dump_action = QAction("Save Memory Report...", self)
+        dump_action.triggered.connect(self.save_memory_report)
+        debug_menu.addAction(dump_action)
+
+    def register_memory_accounting(self):
+        """Register this workspace's subsystems with the memory accountant under a per-workspace prefix."""
+        accountant = default_accountant()
+        self.memory_prefix = f"workspace:{self.workspace_path}"
+        library = self.instrument_library
+        sizers = {
+            # Sampled on the GUI thread by check_memory, the accountant measures on a worker
+            "console": lambda: self.console_footprint,
+            "chuck_processes": self.chuck_manager.memory_footprint,
+            "sampler": self.sampler.memory_footprint,
+            "instrument_model": library.instrument_model.memory_footprint,
+            "meters": lambda: (sum(tap.buffer.nbytes for tap in self.meter_engine.taps.values()),
+                               len(self.meter_engine.taps)),
+        }
+        for name, sizer in sizers.items():
+            accountant.register(f"{self.memory_prefix}/{name}", sizer, MEMORY_BUDGETS.get(name))
+        accountant.register(f"{self.memory_prefix}/history", lambda: (self.history.memory_used, len(self.history)),
+                            self.history.memory_budget)
+
+    def check_memory(self):
+        """Measure every subsystem on a worker thread, walking a large library would stall the GUI."""
+        if self.memory_check_task is not None and self.memory_check_task.isRunning():
+            return
+        document = self.chuck_console.document()
+        self.console_footprint = (document.characterCount() * 2, document.blockCount())  # UTF-16
+        self.memory_check_task = BackgroundTask(default_accountant().check, parent=self)
+        self.memory_check_task.succeeded.connect(self.report_over_budget)
+        self.memory_check_task.start()
+
+    def report_over_budget(self, entries):
+        """Warn in the console about subsystems that went over their memory budget."""
+        for entry in entries:
+            self.chuck_console.log_error(f"{entry['name']} uses {entry['bytes'] / MB:.1f} MB, "
+                                         f"over its {entry['budget'] / MB:.1f} MB budget")
+
+    def toggle_allocation_tracing(self, enabled):
+        """Start or stop tracemalloc; reports then include the allocation sites that grew the most."""
+        if enabled:
+            default_accountant().start_tracing()
+            self.chuck_console.log("Allocation tracing started.")
+        else:
+            default_accountant().stop_tracing()
+            self.chuck_console.log("Allocation tracing stopped.")
+
+    def save_memory_report(self):
+        """Write the memory report to a JSON file."""
+        path, _ = QFileDialog.getSaveFileName(self, "Save Memory Report", "pydaw-memory.json", "JSON (*.json)")
+        if path:
+            default_accountant().dump(path)
+            self.chuck_console.log(f"Memory report saved to {path}")
+
+    def add_transport_sinks(self):
+        """Connect ChucK, the DAWDreamer engine and MIDI clock output (where available) to the transport.
+
+        The engine and clock output are shared by every open workspace, so they
+        only follow this transport while this is the session's active workspace.
+        """
+        self.transport.add_sink(ChucKTransportSink(self.chuck_manager, self.transport.tempo_map,
+                                                   self.transport.sample_rate))
+        self.shared_sinks = []
+        try:
+            import daw_engine
+            self.shared_sinks.append(DawDreamerTransportSink(daw_engine.engine, self.transport.tempo_map,
+                                                             self.transport.sample_rate))
+        except (ImportError, AttributeError) as e:
+            self.chuck_console.log_error(f"DAWDreamer engine not available to the transport: {e}")
+        port = self.session.clock_port()
+        if port:
+            self.shared_sinks.append(MidiClockSink(port, self.transport.tempo_map, self.transport.sample_rate))
+
+    def set_engine_active(self, active):
+        """Attach or detach the shared engine and clock sinks, called by the session on activation."""
+        for sink in self.shared_sinks:
+            if active:
+                self.transport.add_sink(sink)
+            else:
+                self.transport.remove_sink(sink)
+
+    def toggle_transport(self):
+        """Start or stop the transport."""
+        if self.transport.playing:
+            self.transport.stop()
+            self.play_action.setText("Play")
+        else:
+            self.transport.play()
+            self.play_action.setText("Stop")
+
+    def export_workspace(self):
+        """Save the workspace and pack it into a single archive file in the background."""
+        default_name = os.path.basename(os.path.normpath(self.workspace_path)) + ARCHIVE_EXTENSION
+        archive_path, _ = QFileDialog.getSaveFileName(
+            self, "Export Workspace", os.path.join(os.path.expanduser("~"), default_name),
+            f"PyDAW Archives (*{ARCHIVE_EXTENSION})"
+        )
+        if not archive_path:
+            return
+        if self.export_task is not None and self.export_task.isRunning():
+            self.chuck_console.log_error("An export is already running.")
+            return
+        self.save_workspace()
+        self.chuck_console.log(f"Exporting workspace to {archive_path}...")
+        self.export_task = BackgroundTask(export_workspace, self.workspace_path, archive_path, parent=self)
+        self.export_task.succeeded.connect(lambda count: self.chuck_console.log(
+            f"Exported {count} files to {archive_path}."))
+        self.export_task.failed.connect(lambda message: self.chuck_console.log_error(f"Export failed: {message}"))
+        self.export_task.start()
+
+    def on_history_changed(self, history):
+        """Refresh everything derived from the project state after an edit, undo or redo."""
+        self.tempo = history.get(("tempo",), 120)
+        self.tempo_display.setText(f"Tempo: {self.tempo} BPM")
+        # Snapshots share untouched values, so an unchanged map is the very same object
+        tempo_map = history.get(("tempo_map",))
+        if tempo_map is not self.tempo_map_state:
+            self.tempo_map_state = tempo_map
+            self.transport.set_tempo_map(TempoMap.from_json(thaw(tempo_map), self.tempo))
+        self.instrument_library.set_tempo(self.tempo)
+        self.update_undo_actions()
+
+    def update_undo_actions(self):
+        """Enable and label the undo/redo actions after the step they would revert."""
+        undo_label, redo_label = self.history.undo_label(), self.history.redo_label()
+        self.undo_action.setEnabled(undo_label is not None)
+        self.undo_action.setText(f"Undo {undo_label}" if undo_label else "Undo")
+        self.redo_action.setEnabled(redo_label is not None)
+        self.redo_action.setText(f"Redo {redo_label}" if redo_label else "Redo")
 
     def open_tempo_dialog_event(self, event: QMouseEvent):
         """Open the tempo dialog when the tempo display is clicked."""
@@ -281,9 +798,14 @@ class WorkspaceWindow(QMainWindow):
     def open_tempo_dialog(self):
         """Open the tempo dialog to change the tempo."""
         dialog = TempoDialog(self.tempo, self)
-        if dialog.exec():
-            self.tempo = dialog.get_tempo()
-            self.tempo_display.setText(f"Tempo: {self.tempo} BPM")
+        if dialog.exec() and dialog.get_tempo() != self.tempo:
+            tempo = dialog.get_tempo()
+            # The edited map is part of the step, so undo also restores the changes after the current beat
+            tempo_map = TempoMap.from_json(self.transport.tempo_map.to_json(), tempo)
+            beat = self.transport.beat
+            tempo_map.clear_after(beat)
+            tempo_map.set_tempo(beat, tempo)
+            self.history.update("Change Tempo", {("tempo",): tempo, ("tempo_map",): tempo_map.to_json()})
 
     def open_views_window(self):
         """Open the views window."""
@@ -291,8 +813,33 @@ class WorkspaceWindow(QMainWindow):
         views_window.console_button.clicked.connect(self.toggle_console)
         views_window.instrument_library_button.clicked.connect(self.toggle_instruments)
         views_window.timeline_button.clicked.connect(self.toggle_timeline)
+        views_window.meters_button.clicked.connect(self.toggle_meters)
         views_window.exec()
 
+    def changeEvent(self, event):
+        """MIDI input, the DAWDreamer engine and MIDI clock follow the workspace activated last."""
+        if event.type() == QEvent.ActivationChange and self.isActiveWindow():
+            self.session.activate(self)
+        super().changeEvent(event)
+
+    def closeEvent(self, event):
+        """Stop this workspace's scripts, transport, sampler and meters; the shared engine keeps running."""
+        if self.export_task is not None:
+            self.export_task.wait()  # The archive would be left half written
+        self.transport.stop()
+        self.chuck_manager.stop_all_scripts()
+        self.sampler_output.remove(self.sampler)
+        self.meter_engine.stop()
+        self.memory_timer.stop()
+        if self.memory_check_task is not None:
+            self.memory_check_task.wait()
+        self.instrument_library.close_library()
+        default_accountant().unregister(self.memory_prefix)
+        self.session.remove_window(self)
+        if not self.session.windows:
+            self.session.shutdown()
+        super().closeEvent(event)
+
     def stop_chuck_vm(self):
         """Stop the ChucK virtual machine by forcefully killing all ChucK instances."""
         self.chuck_manager.stop_all_scripts()
@@ -310,17 +857,29 @@ class WorkspaceWindow(QMainWindow):
         """Toggle the visibility of the timeline dock."""
         self.timeline_dock.setVisible(not self.timeline_dock.isVisible())
 
-
-# Global variable to keep the WorkspaceWindow instance in scope
-workspace_window = None
+    def toggle_meters(self):
+        """Toggle the visibility of the meters dock."""
+        self.meters_dock.setVisible(not self.meters_dock.isVisible())
 
 
 def open_workspace_window(workspace_name, workspace_path):
-    """Open a new workspace window."""
-    global workspace_window
+    """Open a workspace window, or bring it to the front if it is already open. Returns the window.
+
+    The session's window list keeps every open window in scope.
+    """
     app = QApplication.instance()
     if not app:
         app = QApplication(sys.argv)
 
-    workspace_window = WorkspaceWindow(workspace_name, workspace_path)
-    workspace_window.show()
\ No newline at end of file
+    window = default_session().window_for(workspace_path)
+    if window is not None:
+        window.show()
+        window.raise_()
+        window.activateWindow()
+        return window
+
+    window = WorkspaceWindow(workspace_name, workspace_path)
+    window.show()
+    # Replace copies of samples that other workspaces already use with links into the shared store
+    threading.Thread(target=default_store().dedupe_workspace, args=(workspace_path,), daemon=True).start()
+    return window
@@ -2,13 +2,13 @@ import os
 import json
 import sys
 from PySide6.QtWidgets import QFileDialog, QInputDialog, QMessageBox, QApplication
-from workspace import open_workspace_window  # Import the function from workspace.py
+from workspace import open_workspace_window, BackgroundTask  # Import the function from workspace.py
+from archive import import_workspace, ARCHIVE_EXTENSION
+from asset_store import default_store
+from config import CUSTOM_WORKSPACES_DIR as WORKSPACES_DIR  # Honours PYDAW_CUSTOM_PATH
 
-# Detect custom installation paths
-DEFAULT_WORKSPACES_DIR = os.path.expanduser("~/pydaw/")
-CUSTOM_INSTALL_PATH = os.getenv("PYDAW_CUSTOM_PATH", DEFAULT_WORKSPACES_DIR)
-WORKSPACES_DIR = os.path.join(CUSTOM_INSTALL_PATH, "workspaces")
 os.makedirs(WORKSPACES_DIR, exist_ok=True)  # Ensure the workspaces directory exists
+_import_tasks = set()
 
 
 def create_new_workspace():
@@ -25,6 +25,8 @@ def create_new_workspace():
             manifest_data = {"tracks": [], "vst_plugins": [], "chuck_scripts": []}
             with open(os.path.join(workspace_path, "manifest.json"), "w") as f:
                 json.dump(manifest_data, f, indent=4)
+            # Instruments are added through the shared asset store, whose GC must know the workspace
+            default_store().register_workspace(workspace_path)
 
             # Open the newly created workspace
             open_workspace_window(workspace_name, workspace_path)
@@ -53,6 +55,36 @@ def open_existing_workspace():
         open_workspace_window(workspace_name, workspace_path)
 
 
+def import_workspace_archive():
+    """Extract a workspace archive into the workspaces directory and open it."""
+    archive_path, _ = QFileDialog.getOpenFileName(
+        None, "Import Workspace Archive", os.path.expanduser("~"), f"PyDAW Archives (*{ARCHIVE_EXTENSION})"
+    )
+    if archive_path:
+        workspace_name = os.path.basename(archive_path)
+        if workspace_name.endswith(ARCHIVE_EXTENSION):
+            workspace_name = workspace_name[:-len(ARCHIVE_EXTENSION)]
+        workspace_path = os.path.join(WORKSPACES_DIR, workspace_name)
+        if os.path.exists(workspace_path):
+            QMessageBox.warning(None, "Error", f"Workspace '{workspace_name}' already exists.")
+            return
+        # Decoding runs on a worker thread so the window stays responsive, the workspace opens once it's done
+        task = BackgroundTask(import_workspace, archive_path, workspace_path)
+
+        def imported(_):
+            _import_tasks.discard(task)
+            open_workspace_window(workspace_name, workspace_path)
+
+        def failed(message):
+            _import_tasks.discard(task)
+            QMessageBox.critical(None, "Error", f"An error occurred while importing the workspace:\n{message}")
+
+        task.succeeded.connect(imported)
+        task.failed.connect(failed)
+        _import_tasks.add(task)  # Keep the running task referenced
+        task.start()
+
+
 def main():
     """Main entry point for the UI."""
     app = QApplication.instance()
@@ -64,7 +96,7 @@ def main():
         None,
         "Workspace",
         "Choose an option:",
-        ["Create New Workspace", "Open Existing Workspace"],
+        ["Create New Workspace", "Open Existing Workspace", "Import Workspace Archive"],
         editable=False,
     )
 
@@ -72,6 +104,8 @@ def main():
         create_new_workspace()
     elif ok and choice == "Open Existing Workspace":
         open_existing_workspace()
+    elif ok and choice == "Import Workspace Archive":
+        import_workspace_archive()
 
     # Only call app.exec() if this script is run directly
     if __name__ == "__main__":